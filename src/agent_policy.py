@@ -0,0 +1,193 @@
+import json
+import os
+import time
+from typing import Any, Callable, Optional
+
+from langchain.agents import AgentExecutor
+from langchain_core.agents import AgentFinish, AgentStep
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.utils.input import get_color_mapping
+from pydantic import PrivateAttr
+
+from metrics import registry as metrics_registry
+
+# Ngân sách cho một lượt trả lời; nên nhỏ hơn CINEBOT_REQUEST_TIMEOUT để còn thời gian tổng hợp câu trả lời
+TURN_MAX_SECONDS = float(os.getenv("CINEBOT_TURN_MAX_SECONDS", "45"))
+TURN_MAX_TOKENS = int(os.getenv("CINEBOT_TURN_MAX_TOKENS", "24000"))
+TURN_MAX_TOOL_CALLS = int(os.getenv("CINEBOT_TURN_MAX_TOOL_CALLS", "8"))
+MAX_REPEATED_CALLS = 2  # Số lần gọi lặp (cùng tool, cùng input) trước khi coi là agent bị lặp
+
+# Tool mà kết quả thành công đã đủ để trả lời (không cần xác minh thêm)
+EVIDENCE_TOOLS = {"ScrapeCinemaShowtimes", "ScrapeMultipleCinemaShowtimes", "movie_similar"}
+_FAILURE_PREFIXES = ("Lỗi", "❌", "Không tìm thấy", "Chưa có")
+
+
+class TurnCancelled(Exception):
+    """Lượt trả lời bị hủy (ví dụ người gọi đã hết thời gian chờ)."""
+
+
+class TurnPolicy:
+    """Giới hạn cho một lượt: thời gian, số token LLM, số lần gọi tool, và các điều kiện dừng sớm."""
+
+    def __init__(self, max_seconds=TURN_MAX_SECONDS, max_tokens=TURN_MAX_TOKENS,
+                 max_tool_calls=TURN_MAX_TOOL_CALLS, max_repeated_calls=MAX_REPEATED_CALLS,
+                 evidence_tools=EVIDENCE_TOOLS):
+        self.max_seconds = max_seconds
+        self.max_tokens = max_tokens
+        self.max_tool_calls = max_tool_calls
+        self.max_repeated_calls = max_repeated_calls
+        self.evidence_tools = set(evidence_tools)
+
+    @staticmethod
+    def is_evidence(tool_name, observation):
+        """Kết quả tool có phải là bằng chứng đủ để trả lời không (tool trong EVIDENCE_TOOLS và thành công)."""
+        if isinstance(observation, dict):
+            if observation.get('status') != 'success':
+                return False
+            # Scrape thành công nhưng không có suất chiếu nào thì chưa đủ để trả lời
+            for key in ('schedules', 'showtimes'):
+                if key in observation:
+                    return bool(observation[key])
+            return True
+        return bool(observation) and not str(observation).lstrip().startswith(_FAILURE_PREFIXES)
+
+
+class TokenBudgetCallback(BaseCallbackHandler):
+    """
+    Đếm token LLM trong một lượt: dùng usage do model trả về nếu có (OpenAI khi không streaming),
+    nếu không thì ước lượng ~4 ký tự/token từ prompt và câu trả lời.
+    """
+
+    def __init__(self):
+        self.tokens = 0
+        self._prompt_estimates = {}
+
+    @staticmethod
+    def _estimate(text):
+        return len(text) // 4 + 1
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._prompt_estimates[run_id] = sum(self._estimate(str(m.content)) + self._estimate(json.dumps(m.additional_kwargs, ensure_ascii=False))
+                                             for batch in messages for m in batch)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        prompt_estimate = self._prompt_estimates.pop(run_id, 0)
+        usage = (response.llm_output or {}).get('token_usage') or {}
+        if usage.get('total_tokens'):
+            self.tokens += usage['total_tokens']
+            return
+        completion = 0
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, 'message', None)
+                metadata = getattr(message, 'usage_metadata', None) if message is not None else None
+                if metadata and metadata.get('total_tokens'):
+                    self.tokens += metadata['total_tokens']
+                    return
+                completion += self._estimate(generation.text)
+                if message is not None:
+                    completion += self._estimate(json.dumps(message.additional_kwargs, ensure_ascii=False))
+        self.tokens += prompt_estimate + completion
+
+
+class PolicyAgentExecutor(AgentExecutor):
+    """
+    AgentExecutor áp dụng TurnPolicy cho từng lượt:
+
+    - Dừng khi hết thời gian, hết ngân sách token, quá số lần gọi tool hoặc agent gọi lặp lại.
+    - Gọi tool trùng (cùng tên, cùng input) trong một lượt thì dùng lại kết quả đã có.
+    - Dừng sớm khi một tool trong EVIDENCE_TOOLS đã trả về kết quả thành công.
+
+    Khi dừng vì policy, `finalize(inputs, intermediate_steps, callbacks)` tổng hợp câu trả lời từ các
+    kết quả đã có (không gọi thêm tool); `callbacks` là callback con của lượt (đếm token, hủy, stream).
+    Lý do kết thúc mỗi lượt được log và đếm trong metrics (`policy.*`).
+    """
+
+    policy: Any = None
+    finalize: Optional[Callable] = None
+
+    _memo: dict = PrivateAttr(default_factory=dict)
+    _repeated: int = PrivateAttr(default=0)
+
+    def _perform_agent_action(self, name_to_tool_map, color_mapping, agent_action, run_manager=None):
+        key = (agent_action.tool, json.dumps(agent_action.tool_input, sort_keys=True, ensure_ascii=False, default=str))
+        if key in self._memo:
+            self._repeated += 1
+            metrics_registry.increment("policy.memo_hits")
+            print(f"♻️ Dùng lại kết quả đã có của {agent_action.tool} trong lượt này")
+            if run_manager:
+                run_manager.on_agent_action(agent_action, color="green")
+            return AgentStep(action=agent_action, observation=self._memo[key])
+        step = super()._perform_agent_action(name_to_tool_map, color_mapping, agent_action, run_manager)
+        self._memo[key] = step.observation
+        return step
+
+    def _stop_reason(self, iterations, started, tokens, intermediate_steps, last_steps):
+        policy = self.policy
+        if self.max_iterations is not None and iterations >= self.max_iterations:
+            return "max_iterations"
+        elapsed = time.time() - started
+        if elapsed >= policy.max_seconds or (self.max_execution_time is not None and elapsed >= self.max_execution_time):
+            return "time_budget"
+        if tokens.tokens >= policy.max_tokens:
+            return "token_budget"
+        if len(intermediate_steps) >= policy.max_tool_calls:
+            return "tool_call_budget"
+        if self._repeated >= policy.max_repeated_calls:
+            return "repeated_calls"
+        for action, observation in last_steps:
+            if action.tool in policy.evidence_tools and policy.is_evidence(action.tool, observation):
+                return "enough_evidence"
+        return None
+
+    def _stop(self, reason, inputs, intermediate_steps, started, run_manager):
+        elapsed = time.time() - started
+        print(f"🛑 Lượt kết thúc bởi policy: {reason} ({len(intermediate_steps)} lần gọi tool, {elapsed:.1f}s)")
+        metrics_registry.increment(f"policy.{reason}")
+        if self.finalize is not None:
+            try:
+                callbacks = run_manager.get_child() if run_manager else None
+                output = self.finalize(inputs, intermediate_steps, callbacks)
+                return self._return(AgentFinish({"output": output}, ""), intermediate_steps, run_manager=run_manager)
+            except TurnCancelled:
+                raise
+            except Exception as e:
+                print(f"⚠️ Không tổng hợp được câu trả lời sau khi dừng: {e}")
+        output = self._action_agent.return_stopped_response(self.early_stopping_method, intermediate_steps, **inputs)
+        return self._return(output, intermediate_steps, run_manager=run_manager)
+
+    def _call(self, inputs, run_manager=None):
+        if self.policy is None:
+            return super()._call(inputs, run_manager)
+
+        name_to_tool_map = {tool.name: tool for tool in self.tools}
+        color_mapping = get_color_mapping([tool.name for tool in self.tools], excluded_colors=["green", "red"])
+        intermediate_steps = []
+        self._memo = {}
+        self._repeated = 0
+        tokens = TokenBudgetCallback()
+        if run_manager:
+            # Các lần gọi LLM/tool trong lượt là con của run_manager nên nhận callback này
+            run_manager.inheritable_handlers.append(tokens)
+        iterations = 0
+        started = time.time()
+
+        while True:
+            next_step_output = self._take_next_step(name_to_tool_map, color_mapping, inputs, intermediate_steps,
+                                                    run_manager=run_manager)
+            if isinstance(next_step_output, AgentFinish):
+                print(f"🏁 Lượt kết thúc bởi policy: agent_finish ({len(intermediate_steps)} lần gọi tool, "
+                      f"{time.time() - started:.1f}s)")
+                metrics_registry.increment("policy.agent_finish")
+                return self._return(next_step_output, intermediate_steps, run_manager=run_manager)
+
+            intermediate_steps.extend(next_step_output)
+            if len(next_step_output) == 1:
+                tool_return = self._get_tool_return(next_step_output[0])
+                if tool_return is not None:
+                    return self._return(tool_return, intermediate_steps, run_manager=run_manager)
+            iterations += 1
+
+            reason = self._stop_reason(iterations, started, tokens, intermediate_steps, next_step_output)
+            if reason:
+                return self._stop(reason, inputs, intermediate_steps, started, run_manager)
@@ -0,0 +1,313 @@
+"""
+API HTTP/JSON (ASGI) cho CineBot, chạy độc lập với giao diện Gradio.
+
+Chạy:
+    python src/api.py --host 0.0.0.0 --port 8000
+
+Endpoint:
+    POST   /chat                       {"message", "session_id"?} -> {"session_id", "answer", "latency"}
+    POST   /chat/stream                như /chat nhưng trả về Server-Sent Events (token, tool, done, error)
+    POST   /sessions/{session_id}/clear   xóa lịch sử trò chuyện của phiên
+    DELETE /sessions/{session_id}         giải phóng phiên
+    GET    /health                     tiến trình còn sống
+    GET    /ready                      engine đã khởi tạo xong (503 nếu chưa)
+    GET    /metrics                    độ trễ request/tool, tỉ lệ hit của các cache
+    POST   /snapshot?include_models=true  ghi snapshot trạng thái ấm cho replica mới (xem warm_state.py);
+                                       cần header X-Admin-Token = CINEBOT_ADMIN_TOKEN, tắt nếu chưa đặt token
+"""
+import argparse
+import asyncio
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+from langchain_core.callbacks import BaseCallbackHandler
+from pydantic import BaseModel, Field
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from chatbot_engine import REQUEST_TIMEOUT, ChatbotEngine
+from cinema_search import get_cinema_search_stats
+from metrics import registry as metrics_registry
+from onnx_encoder import query_embedding_cache
+from scrape_cinema_showtimes import showtimes_store
+from web_search_agent import get_web_search_stats
+
+# Số lượt trả lời chạy song song và số request được phép chờ thêm; vượt quá thì trả 429
+API_CONCURRENCY = int(os.getenv("CINEBOT_API_CONCURRENCY", "8"))
+API_MAX_PENDING = int(os.getenv("CINEBOT_API_MAX_PENDING", "16"))
+ADMIN_TOKEN = os.getenv("CINEBOT_ADMIN_TOKEN", "")  # Để trống để tắt các endpoint quản trị (/snapshot)
+RETRY_AFTER_SECONDS = 5
+
+
+class ChatRequest(BaseModel):
+    message: str = Field(description="Câu hỏi của người dùng")
+    session_id: Optional[str] = Field(default=None, description="ID phiên; bỏ trống để tạo phiên mới")
+
+
+class AdmissionControl:
+    """
+    Giới hạn số lượt đang xử lý (`concurrency`) và số lượt được xếp hàng (`max_pending`).
+    Khi cả hai đều đầy, request bị từ chối ngay thay vì chờ vô hạn (backpressure).
+    """
+
+    def __init__(self, concurrency=API_CONCURRENCY, max_pending=API_MAX_PENDING):
+        self.capacity = concurrency + max_pending
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.admitted = 0
+        self.running = 0
+
+    def admit(self):
+        """Nhận request (chạy ngay hoặc xếp hàng), hoặc từ chối ngay với 429 khi đã đầy."""
+        if self.admitted >= self.capacity:
+            metrics_registry.increment("api.rejected")
+            raise HTTPException(status_code=429, detail="Máy chủ đang bận, vui lòng thử lại sau.",
+                                headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+        self.admitted += 1
+
+    async def start(self, func, *args):
+        """
+        Chờ tới lượt rồi chạy `func(*args)` trong thread; trả về asyncio.Task của lượt đó.
+
+        Chỗ chạy chỉ được trả lại khi thread thực sự kết thúc (kể cả khi request đã hết thời gian chờ),
+        để số lượt đang chạy không bao giờ vượt `concurrency`. Không được cancel task trả về.
+        """
+        try:
+            await self._semaphore.acquire()
+        except BaseException:
+            self.admitted -= 1
+            raise
+        self.running += 1
+        task = asyncio.ensure_future(asyncio.to_thread(func, *args))
+        task.add_done_callback(self._release)
+        return task
+
+    def _release(self, task):
+        self.running -= 1
+        self.admitted -= 1
+        self._semaphore.release()
+        if not task.cancelled() and task.exception() is not None:
+            # Lượt đã bị bỏ (timeout/ngắt kết nối) thì không ai đọc lỗi của nó nữa
+            print(f"⚠️ Lượt kết thúc với lỗi: {task.exception()}")
+
+
+class _StreamCallback(BaseCallbackHandler):
+    """Đẩy token của LLM và tên tool đang chạy từ thread của agent sang hàng đợi asyncio."""
+
+    def __init__(self, loop, queue):
+        self.loop = loop
+        self.queue = queue
+
+    def _emit(self, event, data):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, (event, data))
+
+    def on_llm_new_token(self, token, **kwargs):
+        # Khi agent gọi function, nội dung token rỗng; chỉ đẩy phần câu trả lời
+        if token:
+            self._emit("token", {"text": token})
+
+    def on_tool_start(self, serialized, input_str, **kwargs):
+        self._emit("tool", {"name": (serialized or {}).get("name", "unknown")})
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def create_app(engine=None, concurrency=API_CONCURRENCY, max_pending=API_MAX_PENDING, request_timeout=REQUEST_TIMEOUT,
+               admin_token=ADMIN_TOKEN):
+    """
+    Args:
+        engine: ChatbotEngine có sẵn (ví dụ engine với model giả lập); nếu None, engine thật
+            được khởi tạo ở thread nền khi ứng dụng khởi động và /ready trả 503 cho tới khi xong.
+        admin_token: Token cho các endpoint quản trị; rỗng thì các endpoint này bị tắt.
+    """
+    state = {"engine": engine, "error": None}
+
+    def _init_engine():
+        try:
+            state["engine"] = ChatbotEngine()
+        except Exception as e:
+            state["error"] = str(e)
+            print(f"❌ Không khởi tạo được ChatbotEngine: {e}")
+
+    @asynccontextmanager
+    async def lifespan(app):
+        # asyncio.Semaphore phải được tạo trong event loop của server
+        app.state.admission = AdmissionControl(concurrency, max_pending)
+        if state["engine"] is None:
+            threading.Thread(target=_init_engine, name="cinebot-engine-init", daemon=True).start()
+        yield
+
+    app = FastAPI(title="CineBot API", lifespan=lifespan)
+
+    def _engine():
+        if state["engine"] is None:
+            raise HTTPException(status_code=503, detail=state["error"] or "Chatbot đang khởi động, vui lòng thử lại sau.")
+        return state["engine"]
+
+    def _require_admin(token):
+        if not admin_token:
+            raise HTTPException(status_code=403, detail="Endpoint quản trị đã tắt (chưa đặt CINEBOT_ADMIN_TOKEN).")
+        if not token or not secrets.compare_digest(token, admin_token):
+            raise HTTPException(status_code=401, detail="Sai hoặc thiếu X-Admin-Token.")
+
+    def _validate(request):
+        if not request.message.strip():
+            raise HTTPException(status_code=400, detail="Vui lòng nhập câu hỏi của bạn! 🎬")
+        return request.session_id or uuid.uuid4().hex
+
+    @app.post("/chat")
+    async def chat(request: ChatRequest):
+        engine = _engine()
+        session_id = _validate(request)
+        app.state.admission.admit()
+        cancel_event = threading.Event()
+        started = time.perf_counter()
+        task = await app.state.admission.start(engine.answer, request.message, session_id, None, cancel_event)
+        try:
+            # shield: hết thời gian chờ không hủy task, chỗ chạy vẫn giữ tới khi thread dừng hẳn
+            answer = await asyncio.wait_for(asyncio.shield(task), timeout=request_timeout)
+        except asyncio.TimeoutError:
+            cancel_event.set()
+            metrics_registry.increment("api.timeouts")
+            raise HTTPException(status_code=504, detail=f"Quá {int(request_timeout)} giây mà chưa có câu trả lời.")
+        except Exception as e:
+            metrics_registry.increment("api.errors")
+            raise HTTPException(status_code=500, detail=f"Lỗi khi tạo câu trả lời: {e}")
+        latency = time.perf_counter() - started
+        metrics_registry.record("api.chat", latency)
+        return JSONResponse({"session_id": session_id, "answer": answer, "latency": round(latency, 3)},
+                            headers={"X-Session-ID": session_id})
+
+    @app.post("/chat/stream")
+    async def chat_stream(request: ChatRequest):
+        engine = _engine()
+        session_id = _validate(request)
+        admission = app.state.admission
+        # Nhận request trước khi mở stream để có thể trả 429 đúng chuẩn HTTP
+        admission.admit()
+        # Bắt đầu lượt ngay trong handler: chỗ đã nhận được trả lại khi thread kết thúc, kể cả khi
+        # client ngắt kết nối trước khi Starlette kịp chạy generator bên dưới
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        cancel_event = threading.Event()
+        started = time.perf_counter()
+        task = await admission.start(engine.answer, request.message, session_id,
+                                     [_StreamCallback(loop, queue)], cancel_event)
+        # Generator có thể không bao giờ chạy (client ngắt sớm): vẫn dừng agent khi hết thời gian
+        loop.call_later(request_timeout, cancel_event.set)
+
+        async def events():
+            try:
+                yield _sse("session", {"session_id": session_id})
+                deadline = started + request_timeout
+                while True:
+                    getter = asyncio.ensure_future(queue.get())
+                    done, _ = await asyncio.wait({getter, task}, timeout=max(0.0, deadline - time.perf_counter()),
+                                                 return_when=asyncio.FIRST_COMPLETED)
+                    if getter in done:
+                        event, data = getter.result()
+                        yield _sse(event, data)
+                        continue
+                    getter.cancel()
+                    if task in done:
+                        # Xả các token còn lại trong hàng đợi trước khi báo kết thúc
+                        while not queue.empty():
+                            event, data = queue.get_nowait()
+                            yield _sse(event, data)
+                        if task.exception() is not None:
+                            metrics_registry.increment("api.errors")
+                            yield _sse("error", {"detail": f"Lỗi khi tạo câu trả lời: {task.exception()}"})
+                        else:
+                            latency = time.perf_counter() - started
+                            metrics_registry.record("api.chat_stream", latency)
+                            yield _sse("done", {"answer": task.result(), "latency": round(latency, 3)})
+                    else:
+                        metrics_registry.increment("api.timeouts")
+                        yield _sse("error", {"detail": f"Quá {int(request_timeout)} giây mà chưa có câu trả lời."})
+                    break
+            finally:
+                # Hết thời gian hoặc client ngắt kết nối: dừng agent ở bước kế tiếp
+                if not task.done():
+                    cancel_event.set()
+
+        return StreamingResponse(events(), media_type="text/event-stream",
+                                 headers={"X-Session-ID": session_id, "Cache-Control": "no-cache"})
+
+    @app.post("/sessions/{session_id}/clear")
+    async def clear_session(session_id: str):
+        return {"session_id": session_id, "message": _engine().clear_conversation(session_id)}
+
+    @app.delete("/sessions/{session_id}")
+    async def end_session(session_id: str):
+        _engine().end_session(session_id)
+        return {"session_id": session_id, "ended": True}
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    @app.get("/ready")
+    async def ready():
+        if state["engine"] is None:
+            return JSONResponse({"ready": False, "error": state["error"]}, status_code=503)
+        return {"ready": True}
+
+    @app.get("/metrics")
+    async def metrics():
+        admission = app.state.admission
+        engine = state["engine"]
+        return {
+            "latency": metrics_registry.summary(),
+            "caches": {
+                "web_search": get_web_search_stats(),
+                "cinema_search": get_cinema_search_stats(),
+                "showtimes": showtimes_store.cache.stats(),
+                "rerank": engine.reranker.stats() if engine is not None and engine.reranker is not None else None,
+                "query_embeddings": query_embedding_cache.stats(),
+            },
+            "requests": {"running": admission.running, "admitted": admission.admitted, "capacity": admission.capacity},
+            "sessions": engine.session_count if engine is not None else 0,
+        }
+
+    @app.post("/snapshot")
+    async def snapshot(include_models: bool = True, x_admin_token: Optional[str] = Header(default=None)):
+        _require_admin(x_admin_token)
+        engine = _engine()
+        try:
+            manifest = await asyncio.to_thread(engine.export_snapshot, None, include_models)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Không ghi được snapshot: {e}")
+        return manifest
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="CineBot HTTP API")
+    parser.add_argument("--host", default=os.getenv("CINEBOT_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("CINEBOT_API_PORT", "8000")))
+    parser.add_argument("--concurrency", type=int, default=API_CONCURRENCY, help="Số lượt trả lời chạy song song")
+    parser.add_argument("--max-pending", type=int, default=API_MAX_PENDING, help="Số request được chờ trước khi trả 429")
+    parser.add_argument("--timeout", type=float, default=REQUEST_TIMEOUT, help="Thời gian tối đa (giây) cho một lượt trả lời")
+    args = parser.parse_args()
+
+    app = create_app(concurrency=args.concurrency, max_pending=args.max_pending, request_timeout=args.timeout)
+    print(f"🚀 CineBot API tại http://{args.host}:{args.port}")
+    # Phiên chat nằm trong bộ nhớ tiến trình nên chỉ chạy một worker uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, workers=1)
+
+
+if __name__ == "__main__":
+    main()
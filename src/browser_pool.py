@@ -0,0 +1,222 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+from webdriver_manager.chrome import ChromeDriverManager
+
+# Cấu hình pool (có thể ghi đè bằng biến môi trường)
+POOL_SIZE = int(os.getenv("CINEBOT_BROWSER_POOL_SIZE", "2"))
+MAX_USES_PER_BROWSER = int(os.getenv("CINEBOT_BROWSER_MAX_USES", "20"))
+CHECKOUT_TIMEOUT = float(os.getenv("CINEBOT_BROWSER_CHECKOUT_TIMEOUT", "30"))
+WARM_UP_COUNT = int(os.getenv("CINEBOT_BROWSER_WARM_UP", "1"))  # Số trình duyệt khởi động sẵn lúc start (0 = tắt)
+CREATE_BACKOFF_MAX = float(os.getenv("CINEBOT_BROWSER_CREATE_BACKOFF_MAX", "60"))
+
+_driver_path = None
+_driver_path_lock = threading.Lock()
+
+
+def resolve_driver_path():
+    """Tìm đường dẫn chromedriver đúng một lần cho cả tiến trình."""
+    global _driver_path
+    if _driver_path:
+        return _driver_path
+    with _driver_path_lock:
+        if not _driver_path:
+            _driver_path = os.getenv("CHROMEDRIVER_PATH") or ChromeDriverManager().install()
+            print(f"✅ Chromedriver: {_driver_path}")
+    return _driver_path
+
+
+def build_chrome_options():
+    """Tạo Chrome options với các tùy chọn tối ưu."""
+    chrome_options = Options()
+    chrome_options.add_argument("--headless")  # Bỏ comment để chạy ẩn
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+    chrome_options.add_argument("--start-maximized")
+    chrome_options.add_argument("--disable-blink-features=AutomationControlled")
+    chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
+    chrome_options.add_experimental_option('useAutomationExtension', False)
+    chrome_options.add_argument("user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36")
+
+    # Tùy chọn để tăng tốc độ load
+    prefs = {"profile.managed_default_content_settings.images": 2 # Không load ảnh
+                , "profile.managed_default_content_settings.stylesheets": 2 # Không load CSS
+             }
+    chrome_options.add_experimental_option("prefs", prefs)
+    return chrome_options
+
+
+def setup_selenium_driver():
+    """Khởi tạo Selenium Chrome driver với các tùy chọn tối ưu."""
+    try:
+        driver = webdriver.Chrome(service=Service(resolve_driver_path()), options=build_chrome_options())
+        driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
+        return driver
+    except Exception as e:
+        print(f"❌ Lỗi khi cài đặt WebDriver: {e}. Vui lòng kiểm tra kết nối mạng hoặc phiên bản Chrome.")
+        return None
+
+
+class BrowserPool:
+    """Pool giới hạn các trình duyệt Chrome đã khởi động sẵn, dùng lại giữa các lần scrape."""
+
+    def __init__(self, size=POOL_SIZE, max_uses=MAX_USES_PER_BROWSER, checkout_timeout=CHECKOUT_TIMEOUT):
+        self.size = max(1, size)
+        self.max_uses = max_uses
+        self.checkout_timeout = checkout_timeout
+        self._idle = queue.LifoQueue()  # LIFO để ưu tiên trình duyệt vừa dùng (còn "nóng")
+        self._uses = {}
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        # Sau mỗi lần khởi động Chrome thất bại, chờ lâu dần (1s, 2s, 4s... tối đa CREATE_BACKOFF_MAX)
+        self._create_failures = 0
+        self._create_retry_at = 0.0
+
+    def warm_up(self, count=None):
+        """Khởi động trước một số trình duyệt để request đầu tiên không phải chờ."""
+        count = self.size if count is None else min(count, self.size)
+        for _ in range(count):
+            driver = self._create()
+            if driver is None:
+                break
+            self._idle.put(driver)
+        print(f"🔥 Browser pool: {self._idle.qsize()} trình duyệt sẵn sàng.")
+
+    def warm_up_async(self, count=WARM_UP_COUNT):
+        """Khởi động trước trình duyệt ở luồng nền để không làm chậm lúc start."""
+        if count <= 0:
+            return
+        threading.Thread(target=self.warm_up, args=(count,), daemon=True).start()
+
+    def _create(self):
+        with self._lock:
+            if self._closed or self._created >= self.size:
+                return None
+            if time.monotonic() < self._create_retry_at:
+                return None
+            self._created += 1
+        driver = setup_selenium_driver()
+        if driver is None:
+            with self._lock:
+                self._created -= 1
+                self._create_failures += 1
+                backoff = min(2 ** (self._create_failures - 1), CREATE_BACKOFF_MAX)
+                self._create_retry_at = time.monotonic() + backoff
+            print(f"⏸️ Không khởi động được Chrome ({self._create_failures} lần liên tiếp), thử lại sau {backoff:.0f}s.")
+            return None
+        with self._lock:
+            self._create_failures = 0
+            self._create_retry_at = 0.0
+            self._uses[id(driver)] = 0
+        return driver
+
+    def _destroy(self, driver):
+        try:
+            driver.quit()
+        except Exception:
+            pass
+        with self._lock:
+            self._uses.pop(id(driver), None)
+            self._created -= 1
+
+    @staticmethod
+    def _is_healthy(driver):
+        try:
+            return driver.execute_script("return 1") == 1
+        except Exception:
+            return False
+
+    def acquire(self, timeout=None):
+        """Mượn một trình duyệt; trả về None nếu hết thời gian chờ hoặc không tạo được."""
+        timeout = self.checkout_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while not self._closed:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                driver = self._create()
+            if driver is None:
+                with self._lock:
+                    no_browser = self._create_failures > 0 and self._created == 0
+                if no_browser:
+                    # Không có trình duyệt nào để chờ trả về và Chrome đang lỗi -> báo lỗi ngay
+                    print("❌ Không khởi động được trình duyệt nào, bỏ qua chờ.")
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    print(f"⏳ Hết thời gian chờ trình duyệt rảnh ({timeout}s).")
+                    return None
+                # Chờ theo từng nhịp ngắn để kịp tạo mới khi có trình duyệt bị hủy
+                try:
+                    driver = self._idle.get(timeout=min(remaining, 0.5))
+                except queue.Empty:
+                    continue
+            if self._is_healthy(driver):
+                return driver
+            print("♻️ Trình duyệt không phản hồi, tạo lại.")
+            self._destroy(driver)
+        return None
+
+    def release(self, driver, broken=False):
+        """Trả trình duyệt về pool, tái tạo nếu lỗi hoặc đã dùng quá số lần cho phép."""
+        if driver is None:
+            return
+        with self._lock:
+            uses = self._uses.get(id(driver), 0) + 1
+            self._uses[id(driver)] = uses
+        if broken or self._closed or uses >= self.max_uses:
+            self._destroy(driver)
+            return
+        try:
+            driver.delete_all_cookies()
+            driver.get("about:blank")
+        except Exception:
+            self._destroy(driver)
+            return
+        self._idle.put(driver)
+
+    @contextmanager
+    def browser(self, timeout=None):
+        driver = self.acquire(timeout)
+        broken = False
+        try:
+            yield driver
+        except Exception:
+            broken = True
+            raise
+        finally:
+            self.release(driver, broken=broken)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._destroy(driver)
+        print("🔒 Đã đóng toàn bộ trình duyệt trong pool.")
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_browser_pool():
+    """Pool dùng chung cho toàn tiến trình."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                resolve_driver_path()
+                _pool = BrowserPool()
+                atexit.register(_pool.close)
+    return _pool
@@ -1,10 +1,12 @@
 import os
-import json
-from langchain.text_splitter import CharacterTextSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_core.documents import Document
+import sys
 import shutil
 
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from movie_chunker import MovieChunker
+from onnx_encoder import get_embedding_model
+from preprocess import iter_movie_batches
+
 # Import mới để tránh deprecation warning
 try:
     from langchain_chroma import Chroma
@@ -14,131 +16,86 @@ except ImportError:
     print("⚠️ Sử dụng Chroma cũ")
 
 db_name = 'vector_db'
+# Đầu ra của preprocess.py (JSONL hoặc Parquet); nếu có cả hai thì dùng file mới hơn
+MOVIES_FILES = ["data/movies.jsonl", "data/movies.parquet"]
+LEGACY_MOVIES_FILE = "data/movies.json"
+BATCH_SIZE = 1000  # Số phim đọc và đưa vào Chroma mỗi lần
+
 
-def build_movie_database():
-    """Xây dựng vector database từ file JSON"""
+def build_movie_database(file_path=None, batch_size=BATCH_SIZE):
+    """Xây dựng vector database từ file phim (JSONL/Parquet của preprocess.py, hoặc movies.json cũ)"""
     
     print("🎬 Bắt đầu xây dựng Movie Vector Database...")
-    
-    # Xóa database cũ nếu tồn tại
-    if os.path.exists(db_name):
-        print(f"🗑️ Xóa database cũ: {db_name}")
-        shutil.rmtree(db_name)
-    
-    documents = []
-    
+
     # Đường dẫn file
-    file_path = "data/movies.json"
+    if file_path is None:
+        existing = [path for path in MOVIES_FILES if os.path.exists(path)]
+        file_path = max(existing, key=os.path.getmtime) if existing else LEGACY_MOVIES_FILE
     
     if not os.path.exists(file_path):
         print(f"❌ Không tìm thấy file: {file_path}")
-        print("💡 Vui lòng đảm bảo file movies.json tồn tại trong thư mục data/")
-        return False
-    
-    try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        print(f"📁 Đã load {len(data)} phim từ {file_path}")
-    except Exception as e:
-        print(f"❌ Lỗi đọc file JSON: {e}")
+        print("💡 Vui lòng chạy preprocess.py để tạo data/movies.jsonl (hoặc data/movies.parquet)")
         return False
     
-    # Xử lý từng phim
-    for i, movie in enumerate(data):
-        try:
-            # Xử lý Title - có thể là string hoặc list
-            title = movie.get('Title', 'Unknown')
-            if isinstance(title, list):
-                title = ', '.join(title)
-            
-            # Tạo nội dung document
-            content = f"""Tên phim: {title}
-                        Năm phát hành: {movie.get('Release_year', movie.get('Release Year', 'Không rõ'))}
-                        Quốc gia: {movie.get('Nation', movie.get('Origin/Ethnicity', 'Không rõ'))}
-                        Đạo diễn: {movie.get('Director', 'Không rõ')}
-                        Diễn viên: {movie.get('Cast', 'Không rõ')}
-                        Thể loại: {movie.get('Genre', 'Không rõ')}
-                        Cốt truyện: {movie.get('Plot', 'Không có mô tả')}
-                        Wiki: {movie.get('Wiki_page', movie.get('Wiki Page', 'Không có'))}"""
-            
-            # Tạo metadata chuẩn
-            metadata = {
-                "title": title,
-                "release_year": str(movie.get('Release_year', movie.get('Release Year', 'Unknown'))),
-                "nation": movie.get('Nation', movie.get('Origin/Ethnicity', 'Unknown')),
-                "director": movie.get('Director', 'Unknown'),
-                "cast": movie.get('Cast', 'Unknown'),
-                "genre": movie.get('Genre', 'Unknown'),
-                "wiki_page": movie.get('Wiki_page', movie.get('Wiki Page', 'Unknown')),
-                "plot": movie.get('Plot', 'No plot available'),
-                "source": f"movies.json - {title}"
-            }
-            
-            documents.append(Document(page_content=content, metadata=metadata))
-            
-        except Exception as e:
-            print(f"⚠️ Lỗi xử lý phim {i}: {e}")
-            continue
-    
-    print(f"📄 Đã tạo {len(documents)} documents")
-    
-    if not documents:
-        print("❌ Không có document nào được tạo!")
-        return False
-    
-    # Tạo text splitter
-    print("✂️ Đang chia nhỏ documents...")
-    text_splitter = CharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        separator="\n"
-    )
-    chunks = text_splitter.split_documents(documents)
-    print(f"📝 Đã tạo {len(chunks)} chunks")
-    
     # Tạo embeddings
     print("🤖 Đang tạo embeddings...")
     try:
-        embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2",
-            model_kwargs={'device': 'cpu'},
-            encode_kwargs={'normalize_embeddings': True}
-        )
+        embeddings = get_embedding_model()
         print("✅ Embedding model đã sẵn sàng")
     except Exception as e:
         print(f"❌ Lỗi tạo embedding model: {e}")
         return False
-    
-    # Tạo vector store
-    print("💾 Đang tạo vector database...")
+
+    # Xóa database cũ nếu tồn tại
+    if os.path.exists(db_name):
+        print(f"🗑️ Xóa database cũ: {db_name}")
+        shutil.rmtree(db_name)
+
+    vectorstore = Chroma(
+        persist_directory=db_name,
+        embedding_function=embeddings,
+        collection_name="movies"
+    )
+    # Mỗi phim: 1 chunk header + các chunk cốt truyện vừa cửa sổ 256 token của MiniLM
+    chunker = MovieChunker()
+
+    # Đọc và ghi theo từng lô thay vì nạp toàn bộ file vào bộ nhớ
+    print(f"💾 Đang tạo vector database từ {file_path}...")
+    movie_count = chunk_count = 0
     try:
-        vectorstore = Chroma.from_documents(
-            documents=chunks,
-            embedding=embeddings,
-            persist_directory=db_name,
-            collection_name="movies"
-        )
-        print(f"✅ Đã tạo vector database tại {db_name}")
-        
-        # Test database
-        test_results = vectorstore.similarity_search("phim hành động", k=2)
-        print(f"🧪 Test search: Tìm thấy {len(test_results)} kết quả")
-        
-        return True
-        
+        for batch in iter_movie_batches(file_path, batch_size):
+            chunks = []
+            for movie in batch:
+                try:
+                    chunks.extend(chunker.chunk_movie(movie))
+                    movie_count += 1
+                except Exception as e:
+                    print(f"⚠️ Lỗi xử lý phim {movie.get('Title')}: {e}")
+            if chunks:
+                vectorstore.add_documents(chunks)
+            chunk_count += len(chunks)
+            print(f"📝 {movie_count} phim -> {chunk_count} chunks")
     except Exception as e:
         print(f"❌ Lỗi tạo vector database: {e}")
         return False
 
+    if not chunk_count:
+        print("❌ Không có document nào được tạo!")
+        return False
+
+    print(f"✅ Đã tạo vector database tại {db_name}")
+
+    # Test database
+    test_results = vectorstore.similarity_search("phim hành động", k=2)
+    print(f"🧪 Test search: Tìm thấy {len(test_results)} kết quả")
+    return True
+
 def test_database():
     """Test vector database"""
     print("\n🧪 Testing Vector Database...")
     
     try:
-        embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2",
-            model_kwargs={'device': 'cpu'}
-        )
+        embeddings = get_embedding_model()
         
         vectorstore = Chroma(
             persist_directory=db_name,
@@ -167,7 +124,7 @@ def test_database():
         return False
 
 if __name__ == "__main__":
-    success = build_movie_database()
+    success = build_movie_database(sys.argv[1] if len(sys.argv) > 1 else None)
     if success:
         print("\n🎉 Xây dựng database thành công!")
         test_database()
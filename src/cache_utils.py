@@ -0,0 +1,163 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Cache trong bộ nhớ có thời hạn (TTL) và giới hạn số phần tử (loại bỏ theo LRU).
+
+    An toàn khi dùng từ nhiều thread; đếm hit/miss để theo dõi hiệu quả.
+    """
+
+    def __init__(self, ttl, max_entries=1024, name="cache"):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.name = name
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > time.time():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def ttl_remaining(self, key):
+        """Số giây còn lại trước khi hết hạn, None nếu không có trong cache."""
+        with self._lock:
+            entry = self._data.get(key)
+        return None if entry is None else entry[0] - time.time()
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'name': self.name,
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0,
+        }
+
+    def export(self):
+        """Các phần tử còn hạn dưới dạng list [key, expires_at, value] để lưu ra file."""
+        now = time.time()
+        with self._lock:
+            return [[key, expires_at, value] for key, (expires_at, value) in self._data.items() if expires_at > now]
+
+    def load(self, entries):
+        """Nạp lại các phần tử từ `export()`, bỏ qua phần tử đã hết hạn."""
+        now = time.time()
+        with self._lock:
+            for key, expires_at, value in entries:
+                if expires_at > now:
+                    key = tuple(key) if isinstance(key, list) else key
+                    self._data[key] = (expires_at, value)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+
+class SingleFlight:
+    """Gộp các lời gọi trùng key đang chạy đồng thời thành một lần thực thi duy nhất."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> (event, result holder)
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = (threading.Event(), {})
+                self._calls[key] = call
+        event, holder = call
+
+        if not leader:
+            event.wait()
+            if 'error' in holder:
+                raise holder['error']
+            return holder['result']
+
+        try:
+            holder['result'] = fn()
+            return holder['result']
+        except Exception as e:
+            holder['error'] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            event.set()
+
+
+class RateLimiter:
+    """
+    Giới hạn tốc độ kiểu token bucket kèm ngân sách tổng cho cả tiến trình.
+
+    Args:
+        rate_per_minute (float): Số lời gọi được phép mỗi phút (trung bình); <= 0 để tắt giới hạn tốc độ.
+        burst (int): Số lời gọi tối đa được phép dồn cùng lúc.
+        budget (int | None): Tổng số lời gọi tối đa trong vòng đời tiến trình (None = không giới hạn).
+    """
+
+    def __init__(self, rate_per_minute, burst=5, budget=None):
+        self.rate = rate_per_minute / 60.0 if rate_per_minute and rate_per_minute > 0 else None
+        self.burst = burst
+        self.budget = budget
+        self.used = 0
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=10.0):
+        """Chờ đến khi được phép gọi; trả về False nếu hết ngân sách hoặc quá thời gian chờ."""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                if self.budget is not None and self.used >= self.budget:
+                    return False
+                if self.rate is None:
+                    self.used += 1
+                    return True
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    self.used += 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def stats(self):
+        return {'used': self.used, 'budget': self.budget}
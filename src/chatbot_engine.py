@@ -1,14 +1,19 @@
 import os
+import threading
+import time
+from collections import OrderedDict
 from dotenv import load_dotenv
 from typing import List, Dict, Any
 
 # LangChain core imports
 from langchain_openai import ChatOpenAI
-from langchain.agents import create_openai_functions_agent, AgentExecutor
+from langchain.agents import create_openai_functions_agent
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.tools import Tool
 from langchain.memory import ConversationBufferMemory
-from langchain.schema import BaseRetriever, SystemMessage
+from langchain.schema import BaseRetriever, SystemMessage, HumanMessage
+from langchain.agents.format_scratchpad import format_to_openai_function_messages
+from langchain_core.callbacks import BaseCallbackHandler
 
 # Import mới để tránh deprecation warning
 try:
@@ -18,34 +23,78 @@ except ImportError:
     from langchain.vectorstores import Chroma
     print("⚠️ Sử dụng Chroma cũ")
 
-# Import embeddings mới
-try:
-    from langchain_huggingface import HuggingFaceEmbeddings
-    print("✅ Sử dụng langchain_huggingface mới")
-except ImportError:
-    try:
-        from langchain_community.embeddings import HuggingFaceEmbeddings
-        print("✅ Sử dụng langchain_community.embeddings")
-    except ImportError:
-        from langchain.embeddings import HuggingFaceEmbeddings
-        print("⚠️ Sử dụng HuggingFaceEmbeddings cũ")
-
 # Giả lập web_search_tool nếu file không tồn tại để code có thể chạy độc lập
 try:
     from web_search_agent import web_search_tool
     from cinema_search import cinema_search_tool
     from tmdb_tools import tmdb_tools
-    from scrape_cinema_showtimes import cinema_showtimes_tool
+    from scrape_cinema_showtimes import cinema_showtimes_tool, multi_cinema_showtimes_tool, showtimes_store
+    from showtimes_cache import load_popular_cinemas
+    from browser_pool import get_browser_pool
+    from similar_movies import get_similar_index, movie_similar_tool
+    from warm_state import SNAPSHOT_DIR, export_snapshot, load_snapshot
 except ImportError:
     print("⚠️ Không tìm thấy web_search_agent.py, cinema_search.py, tmdb_tools.py,tạo tool giả lập.")
     from langchain.tools import DuckDuckGoSearchRun
     web_search_tool = DuckDuckGoSearchRun()
 
+from agent_policy import PolicyAgentExecutor, TurnCancelled, TurnPolicy
+from metrics import ToolMetricsCallback, registry as metrics_registry
+from movie_chunker import collapse_by_movie
+from onnx_encoder import get_embedding_model
+from reranker import RERANK_CANDIDATES, get_reranker
+
+MOVIE_SEARCH_RESULTS = 3      # Số phim khác nhau trả về cho agent
+MOVIE_SEARCH_CANDIDATES = 15  # Số chunk lấy từ vector DB trước khi gộp theo phim
+
+DEFAULT_SESSION_ID = "default"
+MAX_SESSIONS = int(os.getenv("CINEBOT_MAX_SESSIONS", "1000"))
+SESSION_IDLE_TTL = int(os.getenv("CINEBOT_SESSION_IDLE_TTL", "3600"))
+# Giới hạn thời gian cho một lượt trả lời của agent (giây)
+REQUEST_TIMEOUT = float(os.getenv("CINEBOT_REQUEST_TIMEOUT", "90"))
+
+
+class _CancelCallback(BaseCallbackHandler):
+    """Dừng agent ở bước kế tiếp (trước lần gọi LLM/tool tiếp theo) khi `cancel_event` được bật."""
+
+    raise_error = True  # Để exception đi ra khỏi agent thay vì chỉ được log
+
+    def __init__(self, cancel_event):
+        self.cancel_event = cancel_event
+
+    def _check(self):
+        if self.cancel_event.is_set():
+            raise TurnCancelled("Lượt trả lời đã bị hủy")
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self._check()
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self._check()
+
+    def on_tool_start(self, serialized, input_str, **kwargs):
+        self._check()
+
+
+class ChatSession:
+    """Trạng thái riêng của một phiên chat: lịch sử hội thoại và executor gắn với nó."""
+
+    def __init__(self, memory, executor):
+        self.memory = memory
+        self.executor = executor
+        self.lock = threading.Lock()
+        self.last_used = time.time()
+
 
 class ChatbotEngine:
-    """Engine xử lý logic chatbot với 1 phiên duy nhất xuyên suốt."""
+    """Engine xử lý logic chatbot; mỗi phiên (session_id) có lịch sử trò chuyện riêng."""
     
-    def __init__(self):
+    def __init__(self, llm=None, tools=None, retriever=None):
+        """
+        Args:
+            llm, tools, retriever: Thành phần thay thế (ví dụ model giả lập khi load-test).
+                Nếu không truyền llm và tools, engine tự khởi tạo OpenAI, Chroma và các tool thật.
+        """
         # Cấu hình
         self.MODEL = "gpt-4o-mini"
         self.db_name = 'vector_db'
@@ -68,6 +117,7 @@ class ChatbotEngine:
     3. **ƯU TIÊN 3: Tìm kiếm web (`web_search_tool`) ĐỘC LẬP.**
         * Chỉ sử dụng công cụ `web_search_tool` (web search) khi thông tin KHÔNG CÓ trong database nội bộ hoặc TMDB, hoặc khi người dùng hỏi về các tin tức, sự kiện rất mới mà các nguồn khác không cập nhật kịp (ví dụ: "tin tức điện ảnh mới nhất", "sự kiện liên quan đến diễn viên [tên] gần đây").
 
+    - Khi người dùng muốn tìm phim GIỐNG một bộ phim cụ thể (ví dụ "phim giống Inception"), HÃY GỌI `movie_similar` TRƯỚC; chỉ tìm thêm bằng công cụ khác nếu `movie_similar` không tìm thấy phim đó.
     - Đưa ra gợi ý phim phù hợp kèm lý do thuyết phục.
 
     QUY TẮC GIAO TIẾP:
@@ -90,16 +140,26 @@ class ChatbotEngine:
         * Bạn **PHẢI truyền đúng hai tham số**: `specific_cinema_url` và `cinema_info`.
         * Ví dụ gọi công cụ: `ScrapeCinemaShowtimes(specific_cinema_url='https://www.cgv.vn/default/cinox/site/cgv-vincom-center-ba-trieu/', cinema_info={'name': 'CGV Vincom Center Bà Triệu', 'location': 'Hà Nội', 'source_url': 'https://www.cgv.vn/default/cinox/site/cgv-vincom-center-ba-trieu/'})`.
     6.  **Sau khi `ScrapeCinemaShowtimes` trả về dữ liệu lịch chiếu chi tiết (dạng dictionary), bạn HÃY PHÂN TÍCH DỮ LIỆU ĐÓ và TỔNG HỢP, SẮP XẾP, TRÌNH BÀY THÔNG TIN một cách rõ ràng, đầy đủ và thân thiện cho người dùng.**
-    7.  Đảm bảo câu trả lời bao gồm tên phim, các rạp chiếu, thời gian chiếu cụ thể cho từng ngày, và đường dẫn để đặt vé nếu có.
+    7.  **Nếu cần lịch chiếu của TỪ HAI RẠP TRỞ LÊN (ví dụ "tối nay xem phim X ở đâu?"), HÃY GỌI `ScrapeMultipleCinemaShowtimes` MỘT LẦN với danh sách các rạp** (kèm `movie_name` và `date` nếu biết) thay vì gọi `ScrapeCinemaShowtimes` lần lượt cho từng rạp.
+    8.  Đảm bảo câu trả lời bao gồm tên phim, các rạp chiếu, thời gian chiếu cụ thể cho từng ngày, và đường dẫn để đặt vé nếu có.
     """        
     )
 
         
 
         # Khởi tạo components
-        self.llm, self.retriever, self.tools = self._initialize_components()
+        self.reranker = None
+        self.embedding_model = None
+        self.warm_state = None
+        if llm is not None and tools is not None:
+            self.llm, self.retriever, self.tools = llm, retriever, tools
+        else:
+            self.llm, self.retriever, self.tools = self._initialize_components()
 
-        # Tạo agent duy nhất
+        # Đo độ trễ và số lần gọi của từng tool
+        self.callbacks = [ToolMetricsCallback(metrics_registry)]
+
+        # Tạo agent dùng chung và phiên mặc định
         self.agent_executor = self._create_agent()
 
     def _load_environment(self):
@@ -116,10 +176,18 @@ class ChatbotEngine:
             docs = self.retriever.get_relevant_documents(query)
             if not docs:
                 return "Không tìm thấy thông tin phim phù hợp trong cơ sở dữ liệu."
+            if self.reranker is not None:
+                docs = self.reranker.rerank(query, docs)
+            # Nhiều chunk của cùng một phim chỉ tính là một kết quả
             result = "Thông tin phim tìm được từ database:\n\n"
-            for i, doc in enumerate(docs[:3], 1):
-                title = doc.metadata.get('title', f'Phim {i}')
-                content = doc.page_content[:500]
+            for i, (metadata, chunks) in enumerate(collapse_by_movie(docs, limit=MOVIE_SEARCH_RESULTS), 1):
+                title = metadata.get('title', f'Phim {i}')
+                if metadata.get('parent_id'):
+                    content = (f"Năm phát hành: {metadata.get('release_year')} | Đạo diễn: {metadata.get('director')} | "
+                               f"Thể loại: {metadata.get('genre')}\nDiễn viên: {metadata.get('cast')}\n"
+                               + "\n".join(chunk.page_content for chunk in chunks))[:800]
+                else:
+                    content = chunks[0].page_content[:500]
                 result += f"**{title}:**\n{content}\n\n"
             return result
         except Exception as e:
@@ -130,19 +198,22 @@ class ChatbotEngine:
         self._load_environment()
         if not os.path.exists(self.db_name):
             raise FileNotFoundError(f"Vector database không tồn tại tại {self.db_name}. Vui lòng chạy build_index.py trước!")
-        embedding_model = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2",
-            model_kwargs={'device': 'cpu'},
-            encode_kwargs={'normalize_embeddings': True}
-        )
+        # Snapshot trạng thái ấm (model cục bộ, cache, chỉ mục) nếu có, xem warm_state.py
+        self.warm_state = load_snapshot()
+        # PyTorch (mặc định) hoặc ONNX Runtime, theo CINEBOT_EMBEDDING_BACKEND
+        embedding_model = get_embedding_model(model_path=self.warm_state.embedding_path if self.warm_state else None)
+        # Chạy encoder một lần để truy vấn đầu tiên không phải chịu chi phí khởi tạo
+        embedding_model.embed_query("warm up")
+        self.embedding_model = embedding_model
         vector_db = Chroma(
             persist_directory=self.db_name,
             embedding_function=embedding_model,
             collection_name="movies"
         )
-        if not vector_db._collection.count():
+        document_count = vector_db._collection.count()
+        if not document_count:
             raise ValueError("Vector database trống! Vui lòng chạy build_index.py để thêm dữ liệu.")
-        print(f"✅ Database có {vector_db._collection.count()} documents")
+        print(f"✅ Database có {document_count} documents")
         llm = ChatOpenAI(
             temperature=0.3,
             model_name=self.MODEL,
@@ -150,71 +221,186 @@ class ChatbotEngine:
             streaming=True    # giúp phản hồi từng phần (nếu frontend hỗ trợ)
         )
 
-        retriever = vector_db.as_retriever(search_type="similarity", search_kwargs={"k": 5})
+        # Cross-encoder (nếu bật qua CINEBOT_RERANKER) chấm lại một tập ứng viên lớn hơn
+        self.reranker = get_reranker(self.warm_state.reranker_path if self.warm_state else None)
+        if self.warm_state is not None:
+            self.warm_state.restore(reranker=self.reranker)
+        # Lấy dư chunk để sau khi gộp theo phim vẫn còn đủ MOVIE_SEARCH_RESULTS phim khác nhau
+        candidates = RERANK_CANDIDATES if self.reranker is not None else MOVIE_SEARCH_CANDIDATES
+        retriever = vector_db.as_retriever(search_type="similarity", search_kwargs={"k": candidates})
         tools = [
             Tool(
                 name="movie_database_search",
                 description="Tìm kiếm thông tin phim (tóm tắt, diễn viên, đạo diễn, thể loại, năm sản xuất) từ cơ sở dữ liệu phim nội bộ. Luôn dùng công cụ này trước tiên cho các câu hỏi về phim cụ thể.",
                 func=self._movie_search_function
             ),
+            movie_similar_tool,
             web_search_tool,
             cinema_search_tool,
-            cinema_showtimes_tool
+            cinema_showtimes_tool,
+            multi_cinema_showtimes_tool
         ]
         tools.extend(tmdb_tools)  
+
+        # Nạp sẵn đồ thị phim tương tự (nếu đã chạy similar_movies.py build)
+        if get_similar_index() is None:
+            print("💡 Chưa có đồ thị phim tương tự, chạy: python src/similar_movies.py build")
+
+        # Xác định chromedriver một lần lúc khởi động thay vì mỗi lần scrape,
+        # rồi khởi động sẵn trình duyệt ở nền để lần scrape Selenium đầu tiên không phải chờ
+        try:
+            get_browser_pool().warm_up_async()
+        except Exception as e:
+            print(f"⚠️ Chưa chuẩn bị được browser pool: {e}")
+
+        # Scrape nền các rạp phổ biến (nếu có cấu hình) để lịch chiếu luôn sẵn trong cache
+        popular_cinemas_file = os.getenv("CINEBOT_POPULAR_CINEMAS_FILE")
+        if popular_cinemas_file and os.path.exists(popular_cinemas_file):
+            showtimes_store.start_background_refresh(load_popular_cinemas(popular_cinemas_file))
         
 
         print("✅ Tất cả components đã sẵn sàng!")
         return llm, retriever, tools
 
     def _create_agent(self):
-        print(f"✨ Tạo agent duy nhất cho phiên chat.")
+        print(f"✨ Tạo agent dùng chung cho các phiên chat.")
         prompt = ChatPromptTemplate.from_messages([
             self.SYSTEM_PROMPT,
             MessagesPlaceholder(variable_name="chat_history"),
             ("human", "{input}"),
             MessagesPlaceholder(variable_name="agent_scratchpad"),
         ])
+        # Agent (prompt + LLM + tools) không giữ trạng thái nên dùng chung;
+        # mỗi phiên chỉ có memory và AgentExecutor riêng.
+        self.agent = create_openai_functions_agent(self.llm, self.tools, prompt)
+        self._sessions = OrderedDict()
+        self._sessions_lock = threading.Lock()
+
+        default_session = self._get_session(DEFAULT_SESSION_ID)
+        self.memory = default_session.memory
+        return default_session.executor
+
+    def _new_session(self):
         memory = ConversationBufferMemory(
             memory_key='chat_history',
             return_messages=True,
             max_token_limit=1000,
         )
-        agent = create_openai_functions_agent(self.llm, self.tools, prompt)
-        agent_executor = AgentExecutor(
-            agent=agent,
+        agent_executor = PolicyAgentExecutor(
+            agent=self.agent,
             tools=self.tools,
             agent_type="react-agent",
             memory=memory,
             verbose=True,
             handle_parsing_errors=True,
-            max_iterations=15
+            max_iterations=15,
+            max_execution_time=REQUEST_TIMEOUT,
+            policy=TurnPolicy(),
+            finalize=self._finalize_turn,
         )
-        self.memory = memory
-        return agent_executor
+        return ChatSession(memory, agent_executor)
 
-    def get_response(self, message: str):
-        if not message.strip():
-            return "Vui lòng nhập câu hỏi của bạn! 🎬"
-        try:
+    def _finalize_turn(self, inputs, intermediate_steps, callbacks=None):
+        """
+        Tổng hợp câu trả lời từ các kết quả tool đã có khi lượt bị dừng bởi policy (không gọi thêm tool).
+
+        `callbacks` là callback con của lượt, để lần gọi LLM này cũng được đếm token, hủy được và stream token.
+        """
+        messages = [
+            self.SYSTEM_PROMPT,
+            *inputs.get("chat_history", []),
+            HumanMessage(content=inputs["input"]),
+            *format_to_openai_function_messages(intermediate_steps),
+            HumanMessage(content="Hãy trả lời ngay câu hỏi trên dựa trên thông tin đã có, không gọi thêm công cụ nào."),
+        ]
+        return self.llm.invoke(messages, config={"callbacks": callbacks}).content
+
+    def _get_session(self, session_id):
+        """Lấy (hoặc tạo) phiên chat; dọn các phiên không hoạt động quá lâu hoặc vượt số lượng tối đa."""
+        now = time.time()
+        with self._sessions_lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._new_session()
+                self._sessions[session_id] = session
+            session.last_used = now
+            self._sessions.move_to_end(session_id)
+
+            # Các phiên được sắp theo thời điểm dùng gần nhất (cũ nhất trước)
+            for old_id in list(self._sessions):
+                if len(self._sessions) <= MAX_SESSIONS and now - self._sessions[old_id].last_used <= SESSION_IDLE_TTL:
+                    break
+                if old_id not in (session_id, DEFAULT_SESSION_ID):
+                    del self._sessions[old_id]
+        return session
+
+    @property
+    def session_count(self):
+        return len(self._sessions)
+
+    def answer(self, message: str, session_id: str = None, callbacks=None, cancel_event=None):
+        """
+        Chạy một lượt trả lời; lỗi của agent được ném ra cho người gọi (xem `get_response`).
+
+        Args:
+            callbacks: Callback LangChain bổ sung cho lượt này (ví dụ đẩy token ra SSE).
+            cancel_event: threading.Event; khi được bật, agent dừng ở bước kế tiếp với TurnCancelled
+                và lượt này không được ghi vào lịch sử trò chuyện.
+        """
+        session = self._get_session(session_id or DEFAULT_SESSION_ID)
+        callbacks = self.callbacks + list(callbacks or [])
+        if cancel_event is not None:
+            callbacks.append(_CancelCallback(cancel_event))
+        # Mỗi phiên xử lý lần lượt từng câu hỏi; các phiên khác nhau chạy song song
+        with session.lock:
+            if cancel_event is not None and cancel_event.is_set():
+                raise TurnCancelled("Lượt trả lời đã bị hủy trước khi bắt đầu")
             # Log lịch sử
-            chat_history = self.memory.chat_memory.messages
+            chat_history = session.memory.chat_memory.messages
             print("\n======================[ AGENT INPUT LOG ]======================")
+            print(f"SESSION: {session_id or DEFAULT_SESSION_ID}")
             print(f"CURRENT CHAT HISTORY ({len(chat_history)} messages):")
             for msg in chat_history:
                 print(f"  - {type(msg).__name__}: {msg.content}")
             print(f"INPUT: {message}")
             print("=================================================================\n")
-            
-            response_dict = self.agent_executor.invoke({"input": message})
+
+            started = time.perf_counter()
+            history_size = len(chat_history)
+            response_dict = session.executor.invoke({"input": message}, config={"callbacks": callbacks})
+            metrics_registry.record("turn", time.perf_counter() - started)
+            if cancel_event is not None and cancel_event.is_set():
+                # Người gọi đã bỏ cuộc trong lúc agent tạo câu trả lời cuối: bỏ lượt này khỏi lịch sử
+                del session.memory.chat_memory.messages[history_size:]
+                raise TurnCancelled("Lượt trả lời đã bị hủy")
             return response_dict.get('output', "Xin lỗi, tôi không thể tạo ra câu trả lời.")
+
+    def get_response(self, message: str, session_id: str = None, callbacks=None, cancel_event=None):
+        """Như `answer`, nhưng lỗi được trả về dưới dạng câu trả lời (dùng cho giao diện chat)."""
+        if not message.strip():
+            return "Vui lòng nhập câu hỏi của bạn! 🎬"
+        try:
+            return self.answer(message, session_id, callbacks, cancel_event)
+        except TurnCancelled as e:
+            print(f"⏹️ {e} (session {session_id or DEFAULT_SESSION_ID})")
+            return "⏳ Lượt trả lời đã bị hủy."
         except Exception as e:
             import traceback
             traceback.print_exc()
             return f"❌ Lỗi: {str(e)}"
 
-    def clear_conversation(self):
-        self.memory.clear()
+    def export_snapshot(self, snapshot_dir=None, include_models=True):
+        """Ghi snapshot trạng thái ấm (cache, chỉ mục, model) để replica mới khởi động nhanh."""
+        return export_snapshot(snapshot_dir or SNAPSHOT_DIR, reranker=self.reranker,
+                               embedding_model=self.embedding_model, include_models=include_models)
+
+    def clear_conversation(self, session_id: str = None):
+        self._get_session(session_id or DEFAULT_SESSION_ID).memory.clear()
         print("🗑️ Đã xóa lịch sử trò chuyện.")
         return "🔄 Đã xóa lịch sử trò chuyện!"
 
+    def end_session(self, session_id: str):
+        """Giải phóng phiên chat (ví dụ khi người dùng đóng tab)."""
+        if session_id and session_id != DEFAULT_SESSION_ID:
+            with self._sessions_lock:
+                self._sessions.pop(session_id, None)
@@ -0,0 +1,168 @@
+import re
+from urllib.parse import urlparse
+
+_TIME = r'(?:[01]?\d|2[0-3]):[0-5]\d'
+_TIME_RE = re.compile(rf'\b({_TIME})\b')
+# Phần tử suất chiếu chỉ chứa giờ bắt đầu, có thể kèm giờ kết thúc ("19:30" hoặc "19:30 ~ 21:45");
+# bỏ qua nút/link khác có lẫn giờ trong chữ (ví dụ "Mở cửa 08:00", "Đặt vé").
+_SHOWTIME_TEXT_RE = re.compile(rf'^({_TIME})(?:\s*[-~–]\s*{_TIME})?$')
+
+
+def _collect_times(elems, strict=False):
+    """
+    Lấy các giờ chiếu (HH:MM) duy nhất, đã sắp xếp, từ danh sách phần tử.
+
+    `strict=True` chỉ nhận phần tử mà toàn bộ chữ là giờ chiếu (cho selector rộng như `li a`);
+    mặc định lấy giờ đầu tiên trong chữ (selector CGV đã trỏ đúng phần tử, chữ có thể là "10:30 2D").
+    """
+    showtimes = set()
+    for elem in elems:
+        text = elem.get_text(' ', strip=True)
+        found_time = _SHOWTIME_TEXT_RE.match(text) if strict else _TIME_RE.search(text)
+        if found_time:
+            hour, minute = found_time.group(1).split(':')
+            showtimes.add(f"{int(hour):02d}:{minute}")
+    return sorted(showtimes)
+
+
+def extract_schedules_from_html(soup, date_str):
+    """Trích xuất lịch chiếu từ markup của CGV (.film-label + .film-right)."""
+    movies_data = []
+
+    label_blocks = soup.select('.film-label')  # Bắt đầu từ khối tiêu đề phim
+    print(f"🔎 Tìm thấy {len(label_blocks)} phim (film-label).")
+
+    for label_div in label_blocks:
+        try:
+            # Tìm tên phim
+            title_elem = label_div.select_one('h3 a')
+            if not title_elem:
+                continue
+            title = title_elem.get_text(strip=True)
+
+            # Tìm div.film-right kế tiếp
+            film_right_div = label_div.find_next_sibling('div', class_='film-right')
+            if not film_right_div:
+                continue
+
+            # Tìm tất cả các suất chiếu
+            unique_showtimes = _collect_times(film_right_div.select('.film-showtimes li.item a span'))
+
+            if unique_showtimes:
+                movies_data.append({
+                    'title': title,
+                    'date': date_str,
+                    'showtimes': unique_showtimes
+                })
+                print(f"  🎬 {title}: {', '.join(unique_showtimes)}")
+        except Exception as e:
+            print(f"  ⚠️ Lỗi khi xử lý phim: {e}")
+            continue
+
+    return movies_data
+
+
+class CinemaChainAdapter:
+    """
+    Mô tả cách đọc lịch chiếu của một hệ thống rạp.
+
+    Args:
+        name (str): Tên hệ thống rạp.
+        domains (tuple): Các tên miền của hệ thống rạp (so khớp cả subdomain).
+        movie_selector (str): CSS selector của khối chứa một phim.
+        title_selector (str): CSS selector của tên phim, tính trong khối phim.
+        time_selector (str): CSS selector của từng suất chiếu, tính trong khối phim.
+        tab_id_format (str | None): Mẫu ID của tab ngày (ví dụ `cgv{date}`), None nếu
+            trang không có tab ngày.
+        extractor (callable | None): Hàm (soup, date_str) -> list thay cho cách đọc
+            mặc định theo selector.
+    """
+
+    def __init__(self, name, domains, movie_selector, title_selector, time_selector,
+                 tab_id_format=None, extractor=None):
+        self.name = name
+        self.domains = tuple(domains)
+        self.movie_selector = movie_selector
+        self.title_selector = title_selector
+        self.time_selector = time_selector
+        self.tab_id_format = tab_id_format
+        self._extractor = extractor
+
+    def matches(self, url):
+        host = (urlparse(url).hostname or '').lower()
+        return any(host == d or host.endswith('.' + d) for d in self.domains)
+
+    @property
+    def ready_selector(self):
+        """Selector báo hiệu lịch chiếu đã được hiển thị trên trang."""
+        return self.movie_selector
+
+    def extract_schedules(self, soup, date_str):
+        if self._extractor:
+            return self._extractor(soup, date_str)
+
+        movies_data = []
+        blocks = soup.select(self.movie_selector)
+        print(f"🔎 [{self.name}] Tìm thấy {len(blocks)} khối phim.")
+        for block in blocks:
+            title_elem = block.select_one(self.title_selector)
+            if not title_elem:
+                continue
+            title = title_elem.get_text(strip=True)
+            showtimes = _collect_times(block.select(self.time_selector), strict=True)
+            if title and showtimes:
+                movies_data.append({'title': title, 'date': date_str, 'showtimes': showtimes})
+                print(f"  🎬 {title}: {', '.join(showtimes)}")
+        return movies_data
+
+
+CGV_ADAPTER = CinemaChainAdapter(
+    name="CGV",
+    domains=("cgv.vn",),
+    movie_selector=".film-label",
+    title_selector="h3 a",
+    time_selector=".film-showtimes li.item a span",
+    tab_id_format="cgv{date}",
+    extractor=extract_schedules_from_html,
+)
+
+# Selector của các hệ thống rạp khác dựa trên markup trang lịch chiếu theo rạp;
+# cần cập nhật khi website đổi giao diện.
+LOTTE_ADAPTER = CinemaChainAdapter(
+    name="Lotte Cinema",
+    domains=("lottecinemavn.com",),
+    movie_selector=".time_select_wrap, .movie-item",
+    title_selector=".tit, .movie-name, h3",
+    time_selector=".time, .time-item, li a",
+)
+
+BHD_ADAPTER = CinemaChainAdapter(
+    name="BHD Star",
+    domains=("bhdstar.vn",),
+    movie_selector=".movie-item, .film-item",
+    title_selector=".movie-title, .film-name, h3",
+    time_selector=".showtime, .time-item, li a",
+)
+
+GALAXY_ADAPTER = CinemaChainAdapter(
+    name="Galaxy Cinema",
+    domains=("galaxycine.vn",),
+    movie_selector=".showtimes-movie, .movie-item",
+    title_selector="h3, .movie-name",
+    time_selector=".showtime, .time-item, li a, li button",
+)
+
+_registry = [CGV_ADAPTER, LOTTE_ADAPTER, BHD_ADAPTER, GALAXY_ADAPTER]
+
+
+def register_adapter(adapter):
+    """Đăng ký adapter mới; adapter đăng ký sau được ưu tiên hơn."""
+    _registry.insert(0, adapter)
+
+
+def get_adapter(url):
+    """Chọn adapter theo tên miền của URL, mặc định dùng CGV."""
+    for adapter in _registry:
+        if adapter.matches(url):
+            return adapter
+    return CGV_ADAPTER
@@ -0,0 +1,257 @@
+import csv
+import json
+import math
+import os
+import re
+import unicodedata
+from collections import defaultdict
+
+DATA_DIR = os.getenv("CINEBOT_DATA_DIR", "data")
+CINEMAS_CSV = os.path.join(DATA_DIR, "cinemas.csv")
+GAZETTEER_CSV = os.path.join(DATA_DIR, "vn_places.csv")
+
+CELL_SIZE_DEG = 0.05  # ~5.5 km theo vĩ độ
+EARTH_RADIUS_KM = 6371.0
+CINEMA_FIELDS = ["name", "lat", "lon", "address", "city", "brand"]
+
+
+def normalize_vn_text(text):
+    """Chuẩn hóa tên địa điểm tiếng Việt: bỏ dấu, chữ thường, bỏ ký tự thừa."""
+    text = text.replace('đ', 'd').replace('Đ', 'D')
+    text = unicodedata.normalize('NFD', text)
+    text = ''.join(ch for ch in text if unicodedata.category(ch) != 'Mn')
+    text = re.sub(r'[^a-z0-9,]+', ' ', text.lower())
+    return re.sub(r'\s*,\s*', ',', text).strip(' ,')
+
+
+# Viết tắt thường gặp trong địa chỉ tiếng Việt (áp dụng sau khi bỏ dấu)
+_ABBREVIATIONS = [
+    (re.compile(r'\b(?:q|quan)\s*(\d+)\b'), r'quan \1'),
+    (re.compile(r'\b(?:p|phuong)\s*(\d+)\b'), r'phuong \1'),
+    (re.compile(r'\b(?:tp\s*hcm|hcm|hcmc|sai gon|sg)\b'), 'ho chi minh'),
+    (re.compile(r'\bhn\b'), 'ha noi'),
+    (re.compile(r'\bdn\b'), 'da nang'),
+    (re.compile(r'\b(?:tp|thanh pho|tinh|city)\s+'), ''),
+    (re.compile(r'\s+(?:city)\b'), ''),
+]
+_IGNORED_PARTS = {'viet nam', 'vietnam', 'vn'}
+
+
+def normalize_location(text):
+    """
+    Chuẩn hóa địa điểm để so khớp/cache: bỏ dấu, chữ thường, mở rộng viết tắt
+    (Q1 -> quan 1, HCM -> ho chi minh, HN -> ha noi), bỏ tiền tố "thành phố"/"tỉnh"
+    và phần "Việt Nam".
+    """
+    text = normalize_vn_text(text)
+    parts = []
+    for part in text.split(','):
+        part = part.strip()
+        for pattern, replacement in _ABBREVIATIONS:
+            part = pattern.sub(replacement, part)
+        part = re.sub(r'\s+', ' ', part).strip()
+        if part and part not in _IGNORED_PARTS:
+            parts.append(part)
+    return ','.join(parts)
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Khoảng cách (km) giữa hai tọa độ."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class CinemaGeoIndex:
+    """Danh sách rạp chiếu phim cục bộ với chỉ mục lưới (grid) để tìm rạp gần nhất trong bộ nhớ."""
+
+    def __init__(self, cinemas, cell_size=CELL_SIZE_DEG):
+        self.cell_size = cell_size
+        self.cinemas = []
+        self._grid = defaultdict(list)
+        seen = set()
+        for cinema in cinemas:
+            lat, lon = float(cinema['lat']), float(cinema['lon'])
+            key = (cinema['name'], round(lat, 4), round(lon, 4))
+            if key in seen:
+                continue
+            seen.add(key)
+            self._grid[self._cell(lat, lon)].append(len(self.cinemas))
+            self.cinemas.append({**cinema, 'lat': lat, 'lon': lon})
+
+    def __len__(self):
+        return len(self.cinemas)
+
+    def _cell(self, lat, lon):
+        return (math.floor(lat / self.cell_size), math.floor(lon / self.cell_size))
+
+    def nearest(self, lat, lon, radius_km=5.0, limit=10):
+        """Các rạp trong bán kính radius_km quanh (lat, lon), sắp xếp theo khoảng cách."""
+        dlat = radius_km / 111.0
+        dlon = radius_km / (111.0 * max(math.cos(math.radians(lat)), 0.01))
+        min_cell = self._cell(lat - dlat, lon - dlon)
+        max_cell = self._cell(lat + dlat, lon + dlon)
+
+        results = []
+        for i in range(min_cell[0], max_cell[0] + 1):
+            for j in range(min_cell[1], max_cell[1] + 1):
+                for idx in self._grid.get((i, j), ()):
+                    cinema = self.cinemas[idx]
+                    distance = haversine_km(lat, lon, cinema['lat'], cinema['lon'])
+                    if distance <= radius_km:
+                        results.append({**cinema, 'distance_km': round(distance, 2)})
+        results.sort(key=lambda c: c['distance_km'])
+        return results[:limit]
+
+    @classmethod
+    def from_csv(cls, file_path):
+        with open(file_path, "r", encoding="utf-8") as f:
+            return cls(list(csv.DictReader(f)))
+
+    @classmethod
+    def from_osm_json(cls, file_path):
+        """Đọc file JSON xuất từ Overpass (`out center;`) hoặc OSM có tag amenity=cinema."""
+        with open(file_path, "r", encoding="utf-8") as f:
+            return cls(osm_elements_to_cinemas(json.load(f).get('elements', [])))
+
+    def to_csv(self, file_path):
+        os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+        with open(file_path, "w", encoding="utf-8", newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=CINEMA_FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(self.cinemas)
+
+
+def osm_elements_to_cinemas(elements):
+    """Chuyển các phần tử OSM/Overpass thành dict rạp (bỏ qua phần tử không có tên hoặc tọa độ)."""
+    cinemas = []
+    for element in elements:
+        tags = element.get('tags', {})
+        if 'name' not in tags:
+            continue
+        center = element.get('center', {})
+        lat = element.get('lat', center.get('lat'))
+        lon = element.get('lon', center.get('lon'))
+        if lat is None or lon is None:
+            continue
+        address = ' '.join(filter(None, [tags.get('addr:housenumber'), tags.get('addr:street')]))
+        cinemas.append({
+            'name': tags['name'],
+            'lat': lat,
+            'lon': lon,
+            'address': address or tags.get('addr:full', ''),
+            'city': tags.get('addr:city', ''),
+            'brand': tags.get('brand', ''),
+        })
+    return cinemas
+
+
+class Gazetteer:
+    """Danh bạ địa danh Việt Nam cục bộ: tên đã chuẩn hóa -> tọa độ."""
+
+    def __init__(self, places=()):
+        self._places = {}
+        for place in places:
+            self.add(place['name'], float(place['lat']), float(place['lon']))
+
+    def __len__(self):
+        return len(self._places)
+
+    def add(self, name, lat, lon):
+        self._places[normalize_location(name)] = (lat, lon)
+
+    def lookup(self, location):
+        """Tọa độ của địa điểm khi cả chuỗi (đã chuẩn hóa) có trong danh bạ, None nếu không."""
+        return self._places.get(normalize_location(location))
+
+    def lookup_part(self, location):
+        """
+        Tìm theo từng phần cách nhau bởi dấu phẩy, từ trái sang phải (phần cụ thể nhất trước,
+        ví dụ "Vincom Bà Triệu, Hà Nội" -> "ha noi" nếu không có "vincom ba trieu").
+
+        Kết quả thường là tâm của quận/thành phố nên chỉ là vị trí gần đúng.
+
+        Returns:
+            tuple | None: ((lat, lon), phần đã khớp) hoặc None.
+        """
+        for part in normalize_location(location).split(','):
+            part = part.strip()
+            if part in self._places:
+                return self._places[part], part
+        return None
+
+    @classmethod
+    def from_csv(cls, file_path):
+        with open(file_path, "r", encoding="utf-8") as f:
+            return cls(list(csv.DictReader(f)))
+
+
+_cinema_index = None
+_gazetteer = None
+
+
+def get_cinema_index():
+    """Chỉ mục rạp cục bộ (None nếu chưa import dữ liệu vào data/cinemas.csv)."""
+    global _cinema_index
+    if _cinema_index is None and os.path.exists(CINEMAS_CSV):
+        _cinema_index = CinemaGeoIndex.from_csv(CINEMAS_CSV)
+        print(f"✅ Đã nạp {len(_cinema_index)} rạp từ {CINEMAS_CSV}")
+    return _cinema_index
+
+
+def get_gazetteer():
+    global _gazetteer
+    if _gazetteer is None:
+        _gazetteer = Gazetteer.from_csv(GAZETTEER_CSV) if os.path.exists(GAZETTEER_CSV) else Gazetteer()
+    return _gazetteer
+
+
+def set_geo_indexes(cinema_index=None, gazetteer=None):
+    """Thay chỉ mục rạp và/hoặc gazetteer dùng chung (ví dụ nạp từ snapshot của warm_state.py)."""
+    global _cinema_index, _gazetteer
+    if cinema_index is not None:
+        _cinema_index = cinema_index
+    if gazetteer is not None:
+        _gazetteer = gazetteer
+
+
+def fetch_vietnam_cinemas(timeout=180):
+    """Tải một lần toàn bộ rạp chiếu phim ở Việt Nam từ Overpass API."""
+    import requests
+
+    query = """
+    [out:json][timeout:170];
+    area["ISO3166-1"="VN"][admin_level=2]->.vn;
+    (
+      node(area.vn)[amenity=cinema];
+      way(area.vn)[amenity=cinema];
+      relation(area.vn)[amenity=cinema];
+    );
+    out center tags;
+    """
+    response = requests.post("http://overpass-api.de/api/interpreter", data={'data': query}, timeout=timeout)
+    response.raise_for_status()
+    return osm_elements_to_cinemas(response.json().get('elements', []))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Tạo dữ liệu rạp chiếu phim cục bộ cho CinemaSearch.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--from-osm", help="File JSON xuất từ Overpass/OSM")
+    source.add_argument("--from-csv", help="File CSV có các cột name, lat, lon[, address, city, brand]")
+    source.add_argument("--fetch", action="store_true", help="Tải toàn bộ rạp ở Việt Nam từ Overpass")
+    parser.add_argument("--out", default=CINEMAS_CSV)
+    args = parser.parse_args()
+
+    if args.from_osm:
+        index = CinemaGeoIndex.from_osm_json(args.from_osm)
+    elif args.from_csv:
+        index = CinemaGeoIndex.from_csv(args.from_csv)
+    else:
+        index = CinemaGeoIndex(fetch_vietnam_cinemas())
+    index.to_csv(args.out)
+    print(f"🎉 Đã lưu {len(index)} rạp vào {args.out}")
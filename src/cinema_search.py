@@ -1,21 +1,56 @@
 import requests
 from langchain.tools import Tool
 
-def find_nearest_cinemas(user_location: str):
+from cinema_geo_index import get_cinema_index, get_gazetteer, haversine_km, osm_elements_to_cinemas
+from geocode_cache import OVERPASS_CELL_DEG, get_geo_cache
+
+SEARCH_RADIUS_KM = 5
+COARSE_SEARCH_RADIUS_KM = 15  # Khi chỉ biết tâm quận/thành phố chứa địa điểm
+MAX_RESULTS = 10
+
+HEADERS = {
+    'User-Agent': 'MovieChatbotProject/1.0 (sondo212004@gmail.com)'
+}
+
+
+def _geocode(user_location):
     """
-    Tìm kiếm các rạp chiếu phim gần một địa điểm do người dùng cung cấp bằng cách sử dụng OpenStreetMap và Nominatim API.
+    Lấy tọa độ (latitude, longitude) từ địa chỉ người dùng: tra danh bạ địa danh
+    cục bộ và geo cache trước, chỉ gọi Nominatim API khi không tìm thấy.
 
-    Args:
-        user_location: Địa điểm do người dùng nhập vào (ví dụ: "Hồ Gươm, Hà Nội").
+    Chỉ khi cả hai đều không tìm thấy địa chỉ đầy đủ mới dùng một phần của địa chỉ
+    (ví dụ tâm "Hà Nội" cho "Vincom Bà Triệu, Hà Nội"); kết quả đó được đánh dấu là gần đúng.
 
     Returns:
-        Một danh sách các rạp chiếu phim gần đó hoặc một thông báo lỗi.
+        tuple | str: ((lat, lon), chính xác hay không) hoặc thông báo lỗi.
     """
-    headers = {
-        'User-Agent': 'MovieChatbotProject/1.0 (sondo212004@gmail.com)' 
-    }
+    gazetteer = get_gazetteer()
+    coords = gazetteer.lookup(user_location)
+    if coords:
+        print(f"📍 Tọa độ lấy từ danh bạ địa danh cục bộ: {user_location}")
+        return coords, True
+
+    coords = _nominatim_coords(user_location)
+    if isinstance(coords, tuple):
+        return coords, True
+
+    match = gazetteer.lookup_part(user_location)
+    if match:
+        print(f"📍 Không tìm thấy '{user_location}', dùng tọa độ gần đúng của '{match[1]}'")
+        return match[0], False
+    return coords
+
+
+def _nominatim_coords(user_location):
+    """(lat, lon) từ geo cache hoặc Nominatim API, hoặc thông báo lỗi."""
+    geo_cache = get_geo_cache()
+    cached = geo_cache.get_coords(user_location)
+    if cached:
+        print(f"📍 Tọa độ lấy từ geo cache: {user_location}")
+        return cached
+    if cached is False:
+        return "Không thể tìm thấy địa điểm của bạn. Vui lòng thử lại với một địa chỉ khác."
 
-    # Bước 1: Lấy tọa độ (latitude, longitude) từ địa chỉ người dùng bằng Nominatim API
     nominatim_url = "https://nominatim.openstreetmap.org/search"
     params = {
         'q': user_location,
@@ -23,53 +58,117 @@ def find_nearest_cinemas(user_location: str):
         'limit': 1
     }
     try:
-        response = requests.get(nominatim_url, params=params, headers=headers,timeout=20)
+        geo_cache.wait_for_nominatim_slot()
+        response = requests.get(nominatim_url, params=params, headers=HEADERS, timeout=20)
         response.raise_for_status()
         location_data = response.json()
         if not location_data:
+            geo_cache.set_coords(user_location, None)
             return "Không thể tìm thấy địa điểm của bạn. Vui lòng thử lại với một địa chỉ khác."
 
-        lat = location_data[0]['lat']
-        lon = location_data[0]['lon']
+        coords = float(location_data[0]['lat']), float(location_data[0]['lon'])
+        geo_cache.set_coords(user_location, coords)
+        return coords
 
     except requests.exceptions.RequestException as e:
         # Lỗi sẽ không còn là 403 Forbidden sau khi thêm User-Agent
         return f"Lỗi khi kết nối đến Nominatim API: {e}"
 
-    # Bước 2: Tìm kiếm rạp chiếu phim gần tọa độ đã cho bằng Overpass API
+
+def _overpass_cinemas(lat, lon):
+    """
+    Tìm rạp quanh tọa độ bằng Overpass API (dùng khi chưa có dữ liệu rạp cục bộ).
+
+    Kết quả được cache theo ô tọa độ đã làm tròn: truy vấn quanh tâm ô với bán kính
+    nới thêm nửa đường chéo ô để phủ mọi điểm trong ô.
+    """
+    geo_cache = get_geo_cache()
+    cell, (center_lat, center_lon) = geo_cache.cell_of(lat, lon)
+    cached = geo_cache.get_cinemas(cell)
+    if cached is not None:
+        print(f"🎯 Danh sách rạp lấy từ geo cache (ô {cell})")
+        return [dict(cinema) for cinema in cached]
+
     overpass_url = "http://overpass-api.de/api/interpreter"
+    radius_m = int(SEARCH_RADIUS_KM * 1000 + OVERPASS_CELL_DEG * 111000)
+    lat, lon = center_lat, center_lon
     overpass_query = f"""
     [out:json];
     (
-      node(around:5000,{lat},{lon})[amenity=cinema];
-      way(around:5000,{lat},{lon})[amenity=cinema];
-      relation(around:5000,{lat},{lon})[amenity=cinema];
+      node(around:{radius_m},{lat},{lon})[amenity=cinema];
+      way(around:{radius_m},{lat},{lon})[amenity=cinema];
+      relation(around:{radius_m},{lat},{lon})[amenity=cinema];
     );
-    out body;
-    >;
-    out skel qt;
+    out center tags;
     """
-    try:
-        response = requests.get(overpass_url, params={'data': overpass_query}, headers=headers,timeout=20)
-        response.raise_for_status()
-        cinema_data = response.json()
+    response = requests.get(overpass_url, params={'data': overpass_query}, headers=HEADERS, timeout=20)
+    response.raise_for_status()
+    cinemas = osm_elements_to_cinemas(response.json().get('elements', []))
+    geo_cache.set_cinemas(cell, cinemas)
+    return [dict(cinema) for cinema in cinemas]
 
-        cinemas = []
-        if cinema_data.get('elements'):
-            for element in cinema_data['elements']:
-                if 'tags' in element and 'name' in element['tags']:
-                    cinema_name = element['tags']['name']
-                    cinemas.append(cinema_name)
 
-        if not cinemas:
-            return f"Không tìm thấy rạp chiếu phim nào trong vòng 5km quanh '{user_location}'."
+def _format_cinema(cinema):
+    line = f"{cinema['name']} ({cinema['distance_km']} km)"
+    if cinema.get('address'):
+        line += f" - {cinema['address']}"
+    return line
 
-        # Loại bỏ các rạp trùng lặp và trả về kết quả
-        unique_cinemas = sorted(list(set(cinemas)))
-        return f"Các rạp chiếu phim gần '{user_location}':\n- " + "\n- ".join(unique_cinemas)
 
-    except requests.exceptions.RequestException as e:
-        return f"Lỗi khi kết nối đến Overpass API: {e}"
+def find_nearest_cinemas(user_location: str):
+    """
+    Tìm kiếm các rạp chiếu phim gần một địa điểm do người dùng cung cấp.
+
+    Dùng dữ liệu rạp cục bộ (data/cinemas.csv) nếu có, nếu không thì dùng
+    OpenStreetMap Overpass API. Kết quả được sắp xếp theo khoảng cách.
+
+    Args:
+        user_location: Địa điểm do người dùng nhập vào (ví dụ: "Hồ Gươm, Hà Nội").
+
+    Returns:
+        Một danh sách các rạp chiếu phim gần đó hoặc một thông báo lỗi.
+    """
+    # Bước 1: Lấy tọa độ
+    result = _geocode(user_location)
+    if isinstance(result, str):
+        return result
+    (lat, lon), precise = result
+    note = "" if precise else (" (không tìm thấy địa chỉ chính xác, kết quả tính từ trung tâm khu vực; "
+                               "hãy hỏi người dùng địa chỉ cụ thể hơn nếu cần)")
+
+    # Bước 2: Tìm rạp gần tọa độ đã cho
+    index = get_cinema_index()
+    if index is not None:
+        # Tọa độ gần đúng (tâm quận/thành phố): nới bán kính để không bỏ sót rạp quanh địa điểm thật
+        radius_km = SEARCH_RADIUS_KM if precise else COARSE_SEARCH_RADIUS_KM
+        cinemas = index.nearest(lat, lon, radius_km=radius_km, limit=MAX_RESULTS)
+    else:
+        radius_km = SEARCH_RADIUS_KM  # Overpass được truy vấn và cache theo bán kính cố định
+        try:
+            elements = _overpass_cinemas(lat, lon)
+        except requests.exceptions.RequestException as e:
+            return f"Lỗi khi kết nối đến Overpass API: {e}"
+
+        # Loại bỏ các rạp trùng tên, giữ bản gần nhất
+        nearest_by_name = {}
+        for cinema in elements:
+            cinema['distance_km'] = round(haversine_km(lat, lon, float(cinema['lat']), float(cinema['lon'])), 2)
+            if cinema['distance_km'] > SEARCH_RADIUS_KM:
+                continue
+            current = nearest_by_name.get(cinema['name'])
+            if current is None or cinema['distance_km'] < current['distance_km']:
+                nearest_by_name[cinema['name']] = cinema
+        cinemas = sorted(nearest_by_name.values(), key=lambda c: c['distance_km'])[:MAX_RESULTS]
+
+    if not cinemas:
+        return f"Không tìm thấy rạp chiếu phim nào trong vòng {radius_km}km quanh '{user_location}'{note}."
+
+    return f"Các rạp chiếu phim gần '{user_location}'{note} (gần nhất trước):\n- " + "\n- ".join(_format_cinema(c) for c in cinemas)
+
+
+def get_cinema_search_stats():
+    """Số lần hit/miss của geo cache (geocoding và danh sách rạp Overpass)."""
+    return get_geo_cache().stats()
 
 # Định nghĩa Tool cho LangChain
 cinema_search_tool = Tool(
@@ -77,6 +176,6 @@ cinema_search_tool = Tool(
     func=find_nearest_cinemas,
     description=(
         "Tìm kiếm các rạp chiếu phim gần một địa điểm do người dùng cung cấp. "
-        "Trả về danh sách các rạp chiếu phim gần đó."
+        "Trả về danh sách các rạp chiếu phim gần đó, sắp xếp theo khoảng cách."
     )
-)
\ No newline at end of file
+)
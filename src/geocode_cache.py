@@ -0,0 +1,176 @@
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+
+from cache_utils import TTLCache
+from cinema_geo_index import DATA_DIR, normalize_location
+
+GEO_CACHE_FILE = os.path.join(DATA_DIR, "geo_cache.json")
+GEOCODE_TTL = 30 * 24 * 3600   # Tọa độ địa danh gần như không đổi
+GEOCODE_MISS_TTL = 3600        # Địa điểm không tìm thấy: thử lại sau 1 giờ
+OVERPASS_TTL = 24 * 3600
+OVERPASS_CELL_DEG = 0.01       # ~1.1 km
+NOMINATIM_MIN_INTERVAL = 1.0   # Chính sách sử dụng Nominatim: tối đa 1 request/giây
+SAVE_DELAY = float(os.getenv("CINEBOT_GEO_CACHE_SAVE_DELAY", "5"))  # Gom các lần ghi file trong khoảng này
+
+
+class GeoCache:
+    """
+    Cache bền vững (lưu ra file JSON) cho kết quả geocoding và danh sách rạp từ Overpass.
+
+    - Geocoding được cache theo địa điểm đã chuẩn hóa (bỏ dấu, viết tắt quận/thành phố).
+    - Danh sách rạp Overpass được cache theo ô tọa độ đã làm tròn.
+    """
+
+    def __init__(self, file_path=GEO_CACHE_FILE):
+        self.file_path = file_path
+        self.geocode = TTLCache(GEOCODE_TTL, max_entries=20000, name="geocode")
+        self.overpass = TTLCache(OVERPASS_TTL, max_entries=5000, name="overpass")
+        self._save_lock = threading.Lock()
+        self._timer_lock = threading.Lock()
+        self._save_timer = None
+        self._dirty = False
+        self._rate_lock = threading.Lock()
+        self._last_nominatim_call = 0.0
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.file_path):
+            return
+        try:
+            with open(self.file_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.geocode.load(data.get('geocode', []))
+            self.overpass.load(data.get('overpass', []))
+            print(f"✅ Đã nạp geo cache: {len(self.geocode)} địa điểm, {len(self.overpass)} ô rạp")
+        except Exception as e:
+            print(f"⚠️ Không đọc được geo cache {self.file_path}: {e}")
+
+    def _read_file(self):
+        try:
+            with open(self.file_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _merge(disk_entries, own_entries):
+        """Gộp phần tử trên file (do tiến trình khác ghi) với phần tử trong bộ nhớ, giữ bản hết hạn muộn hơn."""
+        merged = {}
+        now = time.time()
+        for key, expires_at, value in list(disk_entries) + list(own_entries):
+            if expires_at <= now:
+                continue
+            key = tuple(key) if isinstance(key, list) else key
+            if key not in merged or expires_at >= merged[key][1]:
+                merged[key] = [key, expires_at, value]
+        return list(merged.values())
+
+    def save(self):
+        """
+        Ghi cache ra file: gộp với nội dung hiện có (các worker khác có thể đã ghi),
+        ghi vào file tạm riêng của tiến trình rồi đổi tên để tránh hỏng file.
+        """
+        with self._save_lock:
+            self._dirty = False
+            directory = os.path.dirname(self.file_path) or '.'
+            os.makedirs(directory, exist_ok=True)
+            disk = self._read_file()
+            data = {
+                'geocode': self._merge(disk.get('geocode', []), self.geocode.export()),
+                'overpass': self._merge(disk.get('overpass', []), self.overpass.export()),
+            }
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(self.file_path) + ".", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(tmp_path, self.file_path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+    def schedule_save(self):
+        """Đánh dấu cache đã đổi và ghi file sau SAVE_DELAY giây (gom nhiều thay đổi vào một lần ghi)."""
+        self._dirty = True
+        with self._timer_lock:
+            if self._save_timer is not None:
+                return
+            self._save_timer = threading.Timer(SAVE_DELAY, self._scheduled_save)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def _scheduled_save(self):
+        with self._timer_lock:
+            self._save_timer = None
+        try:
+            self.save()
+        except Exception as e:
+            print(f"⚠️ Không ghi được geo cache {self.file_path}: {e}")
+
+    def flush(self):
+        """Ghi ngay các thay đổi còn chờ (gọi khi tắt tiến trình)."""
+        with self._timer_lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+        if self._dirty:
+            self.save()
+
+    # --- Geocoding ---
+
+    def get_coords(self, location):
+        """(lat, lon), False nếu đã biết là không tìm thấy, None nếu chưa có trong cache."""
+        value = self.geocode.get(normalize_location(location))
+        return tuple(value) if value else value
+
+    def set_coords(self, location, coords):
+        key = normalize_location(location)
+        if coords:
+            self.geocode.set(key, list(coords))
+            self.schedule_save()
+        else:
+            self.geocode.set(key, False, ttl=GEOCODE_MISS_TTL)
+
+    def wait_for_nominatim_slot(self):
+        """Giữ khoảng cách tối thiểu giữa hai lần gọi Nominatim trong tiến trình."""
+        with self._rate_lock:
+            delay = self._last_nominatim_call + NOMINATIM_MIN_INTERVAL - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._last_nominatim_call = time.monotonic()
+
+    # --- Overpass ---
+
+    @staticmethod
+    def cell_of(lat, lon):
+        """Ô tọa độ đã làm tròn chứa (lat, lon) và tâm của ô đó."""
+        cell = (round(lat / OVERPASS_CELL_DEG), round(lon / OVERPASS_CELL_DEG))
+        return cell, (cell[0] * OVERPASS_CELL_DEG, cell[1] * OVERPASS_CELL_DEG)
+
+    def get_cinemas(self, cell):
+        return self.overpass.get(f"{cell[0]}:{cell[1]}")
+
+    def set_cinemas(self, cell, cinemas):
+        self.overpass.set(f"{cell[0]}:{cell[1]}", cinemas)
+        self.schedule_save()
+
+    def stats(self):
+        return {'geocode': self.geocode.stats(), 'overpass': self.overpass.stats()}
+
+
+_geo_cache = None
+_geo_cache_lock = threading.Lock()
+
+
+def get_geo_cache():
+    global _geo_cache
+    if _geo_cache is None:
+        with _geo_cache_lock:
+            if _geo_cache is None:
+                _geo_cache = GeoCache()
+                atexit.register(_geo_cache.flush)
+    return _geo_cache
@@ -0,0 +1,302 @@
+"""
+Load-test ChatbotEngine với model giả lập và các tool thay thế chạy cục bộ.
+
+Ví dụ:
+    python src/load_test.py --sessions 50 --concurrency 10 --llm-latency 0.3 --tool-latency 0.2
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+# Các module tool đọc cấu hình lúc import: dùng giá trị giả để không cần API key thật
+os.environ.setdefault("TMDB_API_KEY", "load-test")
+os.environ.setdefault("OPENAI_API_KEY", "load-test")
+os.environ.setdefault("CINEBOT_SEARCH_PROVIDER", "fixture")
+
+from langchain.tools import StructuredTool, Tool
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, FunctionMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from chatbot_engine import ChatbotEngine
+from cinema_adapters import get_adapter
+from metrics import percentile, registry as metrics_registry
+from search_providers import FixtureSearchProvider, LatencyInjectingProvider
+from showtimes_cache import ShowtimesStore
+from showtimes_http import fetch_showtimes_http
+from web_search_agent import set_search_provider, web_search_tool
+
+CGV_URL = "https://www.cgv.vn/default/cinox/site/cgv-vincom-center-ba-trieu/"
+
+# Mỗi lượt: câu hỏi của người dùng, chuỗi tool mà model giả lập sẽ gọi, và câu trả lời cuối
+DEFAULT_SCENARIOS = [
+    {
+        "name": "movie_info",
+        "turns": [
+            {"input": "Inception của đạo diễn nào?",
+             "tool_calls": [["movie_database_search", {"__arg1": "Inception"}]],
+             "answer": "Inception do Christopher Nolan đạo diễn 🎬"},
+            {"input": "Phim đó ra rạp Việt Nam khi nào?",
+             "tool_calls": [["tmdb_movie_search", {"query": "Inception"}],
+                            ["tmdb_get_movie_details", {"item_id": 27205}],
+                            ["TavilyWebSearch", {"__arg1": "ngày phát hành Inception Việt Nam"}]],
+             "answer": "Inception khởi chiếu tại Việt Nam năm 2010 🍿"},
+        ],
+    },
+    {
+        "name": "showtimes",
+        "turns": [
+            {"input": "Tối nay xem Inception ở đâu gần Hồ Gươm?",
+             "tool_calls": [["CinemaSearch", {"__arg1": "Hồ Gươm, Hà Nội"}],
+                            ["TavilyWebSearch", {"__arg1": "trang lịch chiếu CGV Vincom Center Bà Triệu"}],
+                            ["ScrapeCinemaShowtimes", {"specific_cinema_url": CGV_URL,
+                                                       "cinema_info": {"name": "CGV Vincom Center Bà Triệu", "location": "Hà Nội"}}]],
+             "answer": "CGV Vincom Center Bà Triệu có suất 19:30 và 21:45 tối nay 🎟️"},
+        ],
+    },
+    {
+        "name": "recommendation",
+        "turns": [
+            {"input": "Gợi ý phim giống Interstellar",
+             "tool_calls": [["movie_database_search", {"__arg1": "phim giống Interstellar"}]],
+             "answer": "Bạn có thể thử The Martian hoặc Gravity 🚀"},
+        ],
+    },
+]
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    Chat model giả lập, tất định: dựa vào câu hỏi hiện tại và số FunctionMessage đã có
+    trong scratchpad để phát lại đúng chuỗi tool call theo kịch bản, rồi trả lời.
+    """
+
+    scripts: dict = {}
+    latency: float = 0.0
+
+    @property
+    def _llm_type(self):
+        return "scripted-fake"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        human_idx = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=-1)
+        turn = self.scripts.get(messages[human_idx].content, {}) if human_idx >= 0 else {}
+        step = sum(1 for m in messages[human_idx + 1:] if isinstance(m, FunctionMessage))
+        tool_calls = turn.get("tool_calls", [])
+        if step < len(tool_calls):
+            name, args = tool_calls[step]
+            message = AIMessage(content="", additional_kwargs={
+                "function_call": {"name": name, "arguments": json.dumps(args, ensure_ascii=False)}
+            })
+        else:
+            message = AIMessage(content=turn.get("answer", "Xin lỗi, tôi chưa có câu trả lời."))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+def _sleep(latency, jitter):
+    time.sleep(max(0.0, latency + random.uniform(-jitter, jitter)))
+
+
+def _fixture_cinema_page():
+    """Trang lịch chiếu CGV giả lập: hôm nay nằm trong trang, các ngày sau là fragment AJAX."""
+    def block(title, times):
+        items = "".join(f'<li class="item"><a><span>{t}</span></a></li>' for t in times)
+        return (f'<div class="film-label"><h3><a>{title}</a></h3></div>'
+                f'<div class="film-right"><ul class="film-showtimes">{items}</ul></div>')
+
+    pages = {}
+    tabs = []
+    for i in range(1, 5):
+        date_str = (datetime.now() + timedelta(days=i)).strftime('%Y%m%d')
+        fragment_url = f"https://www.cgv.vn/ajax/showtimes?date={date_str}"
+        tabs.append(f'<div id="cgv{date_str}" data-url="{fragment_url}"></div>')
+        pages[fragment_url] = json.dumps({"html": block("Inception", ["18:00", "20:30"])})
+    pages[CGV_URL] = "<html>" + "".join(tabs) + block("Inception", ["19:30", "21:45"]) + "</html>"
+    return pages
+
+
+def build_stub_tools(tool_latency=0.2, search_latency=0.3, page_latency=0.15, jitter=0.05):
+    """
+    Các tool thay thế cục bộ với độ trễ cấu hình được:
+    TMDB, Overpass (CinemaSearch) và cơ sở dữ liệu phim là stub; web search dùng
+    provider fixture qua đúng wrapper cache thật; lịch chiếu dùng bộ parse HTTP và
+    ShowtimesStore thật trên trang CGV giả lập.
+    """
+    set_search_provider(LatencyInjectingProvider(FixtureSearchProvider(documents=[
+        {"title": "Lịch chiếu CGV Vincom Center Bà Triệu", "content": "Lịch chiếu phim tại CGV Vincom Center Bà Triệu", "url": CGV_URL},
+        {"title": "Inception - ngày phát hành Việt Nam", "content": "Inception khởi chiếu tại Việt Nam ngày 16/07/2010.", "url": "https://example.vn/inception"},
+    ]), latency=search_latency, jitter=jitter))
+
+    def movie_db(query):
+        _sleep(tool_latency / 4, jitter)
+        return f"Thông tin phim tìm được từ database:\n\n**Inception:**\nĐạo diễn: Christopher Nolan (query: {query})"
+
+    def cinema_search(location):
+        _sleep(tool_latency, jitter)
+        return f"Các rạp chiếu phim gần '{location}' (gần nhất trước):\n- CGV Vincom Center Bà Triệu (1.2 km)"
+
+    def tmdb_movie_search(query):
+        _sleep(tool_latency, jitter)
+        return json.dumps([{"id": 27205, "title": "Inception", "release_date": "2010-07-15"}])
+
+    def tmdb_get_movie_details(item_id):
+        _sleep(tool_latency, jitter)
+        return json.dumps({"id": item_id, "title": "Inception", "director": "Christopher Nolan"})
+
+    pages = _fixture_cinema_page()
+
+    def fetch_page(url):
+        _sleep(page_latency, jitter)
+        return pages[url]
+
+    def scrape_live(specific_cinema_url, cinema_info):
+        adapter = get_adapter(specific_cinema_url)
+        covered_dates = []
+        schedules = fetch_showtimes_http(specific_cinema_url, adapter.extract_schedules, fetch=fetch_page,
+                                         tab_id_format=adapter.tab_id_format, covered_dates=covered_dates)
+        movies = {}
+        for item in schedules:
+            movies.setdefault(item['title'], {'dates': {}})['dates'][item['date']] = item['showtimes']
+        return {'status': 'success', 'cinema_info': cinema_info, 'method': 'http',
+                'scrape_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'dates': covered_dates,
+                'schedules': [{'title': t, **d} for t, d in movies.items()]}
+
+    store = ShowtimesStore(scrape_live, days=2)
+
+    def scrape_cinema_showtimes(specific_cinema_url: str, cinema_info: dict):
+        return store.get(specific_cinema_url, cinema_info)
+
+    return [
+        Tool(name="movie_database_search", func=movie_db, description="Tìm phim trong cơ sở dữ liệu nội bộ."),
+        web_search_tool,
+        Tool(name="CinemaSearch", func=cinema_search, description="Tìm rạp chiếu phim gần một địa điểm."),
+        StructuredTool.from_function(func=scrape_cinema_showtimes, name="ScrapeCinemaShowtimes",
+                                     description="Lấy lịch chiếu phim từ một rạp cụ thể."),
+        StructuredTool.from_function(func=tmdb_movie_search, name="tmdb_movie_search",
+                                     description="Tìm phim trên TMDB."),
+        StructuredTool.from_function(func=tmdb_get_movie_details, name="tmdb_get_movie_details",
+                                     description="Lấy chi tiết phim trên TMDB."),
+    ]
+
+
+def run_load_test(sessions=20, concurrency=5, llm_latency=0.2, tool_latency=0.2, search_latency=0.3,
+                  page_latency=0.15, scenarios=None, think_time=0.0, seed=42, verbose=False):
+    """
+    Chạy `sessions` phiên hội thoại theo kịch bản với tối đa `concurrency` phiên song song.
+
+    Returns:
+        dict: Thông lượng, phân vị độ trễ mỗi lượt, bộ nhớ mỗi phiên và số lần gọi tool.
+    """
+    random.seed(seed)
+    scenarios = scenarios or DEFAULT_SCENARIOS
+    scripts = {turn["input"]: turn for scenario in scenarios for turn in scenario["turns"]}
+    llm = ScriptedChatModel(scripts=scripts, latency=llm_latency)
+    tools = build_stub_tools(tool_latency, search_latency, page_latency)
+    metrics_registry.reset()
+
+    turn_latencies = []
+    errors = []
+
+    def run_session(index):
+        scenario = scenarios[index % len(scenarios)]
+        for turn in scenario["turns"]:
+            started = time.perf_counter()
+            answer = engine.get_response(turn["input"], session_id=f"load-{index}")
+            turn_latencies.append(time.perf_counter() - started)
+            if answer.startswith("❌"):
+                errors.append(answer)
+            if think_time:
+                time.sleep(think_time)
+
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        # Một engine dùng chung như khi chạy thật; mỗi phiên có session_id riêng
+        engine = ChatbotEngine(llm=llm, tools=tools)
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    started = time.perf_counter()
+    with output:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(run_session, range(sessions)))
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    tool_calls = {name[len("tool."):]: entry for name, entry in metrics_registry.summary().items()
+                  if name.startswith("tool.")}
+    return {
+        "sessions": sessions,
+        "live_sessions": engine.session_count,
+        "concurrency": concurrency,
+        "turns": len(turn_latencies),
+        "errors": len(errors),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_turns_per_s": round(len(turn_latencies) / elapsed, 3) if elapsed else 0.0,
+        "turn_latency_s": {
+            "p50": round(percentile(turn_latencies, 50), 3),
+            "p90": round(percentile(turn_latencies, 90), 3),
+            "p99": round(percentile(turn_latencies, 99), 3),
+            "max": round(max(turn_latencies, default=0.0), 3),
+        },
+        "memory_per_session_kb": round((current - baseline) / 1024 / max(1, sessions), 1),
+        "peak_memory_mb": round(peak / 1024 / 1024, 1),
+        "tool_calls": tool_calls,
+    }
+
+
+def _print_report(report):
+    print("\n📊 KẾT QUẢ LOAD TEST")
+    print(f"  Phiên: {report['sessions']} (song song {report['concurrency']}), lượt: {report['turns']}, lỗi: {report['errors']}")
+    print(f"  Thời gian: {report['elapsed_s']}s, thông lượng: {report['throughput_turns_per_s']} lượt/s")
+    latency = report['turn_latency_s']
+    print(f"  Độ trễ mỗi lượt: p50={latency['p50']}s p90={latency['p90']}s p99={latency['p99']}s max={latency['max']}s")
+    print(f"  Bộ nhớ: ~{report['memory_per_session_kb']} KB/phiên, đỉnh {report['peak_memory_mb']} MB")
+    print("  Tool calls:")
+    for name, entry in sorted(report['tool_calls'].items()):
+        if name.endswith(".errors"):
+            continue
+        print(f"    - {name}: {entry['count']} lần, p50={entry.get('p50', 0)}s p90={entry.get('p90', 0)}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test CineBot với model và tool giả lập.")
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--tool-latency", type=float, default=0.2)
+    parser.add_argument("--search-latency", type=float, default=0.3)
+    parser.add_argument("--page-latency", type=float, default=0.15)
+    parser.add_argument("--think-time", type=float, default=0.0)
+    parser.add_argument("--scenarios", help="File JSON chứa danh sách kịch bản (cùng định dạng DEFAULT_SCENARIOS)")
+    parser.add_argument("--json", help="Ghi báo cáo ra file JSON")
+    parser.add_argument("--verbose", action="store_true", help="Hiện log của agent")
+    args = parser.parse_args()
+
+    scenarios = None
+    if args.scenarios:
+        with open(args.scenarios, "r", encoding="utf-8") as f:
+            scenarios = json.load(f)
+
+    report = run_load_test(
+        sessions=args.sessions, concurrency=args.concurrency, llm_latency=args.llm_latency,
+        tool_latency=args.tool_latency, search_latency=args.search_latency, page_latency=args.page_latency,
+        scenarios=scenarios, think_time=args.think_time, verbose=args.verbose,
+    )
+    _print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+import threading
+import time
+from collections import defaultdict, deque
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+MAX_SAMPLES = 10000  # Số mẫu gần nhất giữ lại cho mỗi chỉ số
+
+
+def percentile(values, q):
+    """Phân vị q (0-100) theo nội suy tuyến tính; 0.0 nếu không có dữ liệu."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q / 100.0
+    lower = int(pos)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (pos - lower)
+
+
+class LatencyRecorder:
+    """Ghi nhận độ trễ (giây) và số lần đếm theo tên, an toàn khi dùng từ nhiều thread."""
+
+    def __init__(self, max_samples=MAX_SAMPLES):
+        self._samples = defaultdict(lambda: deque(maxlen=max_samples))
+        self._counts = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            self._samples[name].append(seconds)
+            self._counts[name] += 1
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self._counts[name] += amount
+
+    def count(self, name):
+        return self._counts.get(name, 0)
+
+    def summary(self):
+        with self._lock:
+            samples = {name: list(values) for name, values in self._samples.items()}
+            counts = dict(self._counts)
+        result = {}
+        for name, count in counts.items():
+            values = samples.get(name, [])
+            entry = {'count': count}
+            if values:
+                entry.update({
+                    'mean': round(sum(values) / len(values), 4),
+                    'p50': round(percentile(values, 50), 4),
+                    'p90': round(percentile(values, 90), 4),
+                    'p99': round(percentile(values, 99), 4),
+                    'max': round(max(values), 4),
+                })
+            result[name] = entry
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+
+
+class ToolMetricsCallback(BaseCallbackHandler):
+    """Callback LangChain đo thời gian chạy và số lần gọi của từng tool."""
+
+    def __init__(self, recorder, prefix="tool."):
+        self.recorder = recorder
+        self.prefix = prefix
+        self._started = {}
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._started[run_id] = ((serialized or {}).get('name', 'unknown'), time.perf_counter())
+
+    def _finish(self, run_id, error=False):
+        name, started = self._started.pop(run_id, (None, None))
+        if name is None:
+            return
+        self.recorder.record(self.prefix + name, time.perf_counter() - started)
+        if error:
+            self.recorder.increment(self.prefix + name + ".errors")
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, error=True)
+
+
+# Bộ ghi chỉ số dùng chung cho toàn tiến trình
+registry = LatencyRecorder()
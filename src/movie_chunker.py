@@ -0,0 +1,170 @@
+"""
+Chia dữ liệu phim thành chunk theo cấu trúc của từng phim (thay cho CharacterTextSplitter).
+
+Mỗi phim gồm:
+- 1 chunk "header": tên, năm, quốc gia, đạo diễn, diễn viên, thể loại và phần mở đầu cốt truyện.
+- Các chunk "plot": cốt truyện được gom theo câu, mỗi chunk vừa cửa sổ 256 token của
+  all-MiniLM-L6-v2 (kể cả dòng tiêu đề phim ở đầu chunk).
+
+Mọi chunk của một phim có chung `parent_id` để gộp kết quả theo phim khi truy vấn.
+"""
+import hashlib
+import math
+import re
+
+from langchain_core.documents import Document
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+MAX_CHUNK_TOKENS = 250     # 256 token của MiniLM trừ [CLS], [SEP] và một ít dư
+OVERLAP_SENTENCES = 1      # Số câu lặp lại giữa hai chunk cốt truyện liền nhau
+WORDPIECE_RATIO = 1.3      # Ước lượng token/từ khi không có tokenizer
+
+_SENTENCE_SPLIT = re.compile(r'(?<=[.!?])\s+(?=[A-Z0-9"\'(\[])')
+_WORDS = re.compile(r"\w+|[^\w\s]")
+
+
+def _load_tokenizer(model_name=EMBEDDING_MODEL):
+    try:
+        from transformers import AutoTokenizer
+
+        return AutoTokenizer.from_pretrained(model_name)
+    except Exception as e:
+        print(f"⚠️ Không tải được tokenizer {model_name}, ước lượng số token theo số từ: {e}")
+        return None
+
+
+def movie_parent_id(title, release_year):
+    """ID ổn định của một phim, dùng chung cho mọi chunk của phim đó."""
+    key = f"{str(title).casefold().strip()}|{release_year or ''}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def _field(movie, *names, default=None):
+    for name in names:
+        value = movie.get(name)
+        if value not in (None, ""):
+            return value
+    return default
+
+
+class MovieChunker:
+    """Chia mỗi phim thành chunk header + các chunk cốt truyện giới hạn theo số token."""
+
+    def __init__(self, max_tokens=MAX_CHUNK_TOKENS, overlap_sentences=OVERLAP_SENTENCES, tokenizer="auto"):
+        self.max_tokens = max_tokens
+        self.overlap_sentences = overlap_sentences
+        self.tokenizer = _load_tokenizer() if tokenizer == "auto" else tokenizer
+
+    def count_tokens(self, texts):
+        """Số token (không tính token đặc biệt) của từng đoạn văn trong `texts`."""
+        if not texts:
+            return []
+        if self.tokenizer is not None:
+            return [len(ids) for ids in self.tokenizer(list(texts), add_special_tokens=False)["input_ids"]]
+        return [math.ceil(len(_WORDS.findall(text)) * WORDPIECE_RATIO) for text in texts]
+
+    def _split_long(self, sentence, budget):
+        """Cắt một câu dài hơn `budget` token thành các đoạn theo từ."""
+        words = sentence.split()
+        per_piece = max(1, int(len(words) * budget / max(1, self.count_tokens([sentence])[0])))
+        return [" ".join(words[i:i + per_piece]) for i in range(0, len(words), per_piece)]
+
+    def _pack(self, sentences, budget):
+        """Gom các câu liên tiếp thành đoạn không vượt `budget` token, lặp lại câu cuối giữa hai đoạn."""
+        units = []
+        for sentence, tokens in zip(sentences, self.count_tokens(sentences)):
+            if tokens > budget:
+                pieces = self._split_long(sentence, budget)
+                units.extend(zip(pieces, self.count_tokens(pieces)))
+            else:
+                units.append((sentence, tokens))
+
+        chunks, current, used = [], [], 0
+        for sentence, tokens in units:
+            if current and used + tokens > budget:
+                chunks.append(" ".join(s for s, _ in current))
+                current = current[-self.overlap_sentences:] if self.overlap_sentences else []
+                used = sum(t for _, t in current)
+                # Bỏ phần lặp nếu không còn đủ chỗ cho câu mới
+                while current and used + tokens > budget:
+                    used -= current.pop(0)[1]
+            current.append((sentence, tokens))
+            used += tokens
+        if current:
+            chunks.append(" ".join(s for s, _ in current))
+        return chunks
+
+    def chunk_movie(self, movie):
+        """Chuyển một bản ghi phim (từ preprocess.py hoặc movies.json cũ) thành list Document."""
+        title = _field(movie, "Title", default="Unknown")
+        if isinstance(title, list):
+            title = ", ".join(title)
+        release_year = _field(movie, "Release_year", "Release Year")
+        plot = (_field(movie, "Plot", default="") or "").strip()
+        parent_id = movie_parent_id(title, release_year)
+
+        # Metadata ngắn gọn, lặp lại ở mọi chunk để hiển thị kết quả mà không cần tra chunk header
+        metadata = {
+            "parent_id": parent_id,
+            "title": title,
+            "release_year": str(release_year or "Unknown"),
+            "nation": _field(movie, "Nation", "Origin/Ethnicity", default="Unknown"),
+            "director": _field(movie, "Director", default="Unknown"),
+            "cast": _field(movie, "Cast", default="Unknown"),
+            "genre": _field(movie, "Genre", default="Unknown"),
+            "wiki_page": _field(movie, "Wiki_page", "Wiki Page", default="Unknown"),
+            "source": f"movies - {title}",
+        }
+
+        header_lines = [
+            f"Tên phim: {title}",
+            f"Năm phát hành: {release_year or 'Không rõ'}",
+            f"Quốc gia: {metadata['nation']}",
+            f"Đạo diễn: {metadata['director']}",
+            f"Diễn viên: {metadata['cast']}",
+            f"Thể loại: {metadata['genre']}",
+        ]
+        header = "\n".join(header_lines)
+        header_tokens = self.count_tokens([header])[0]
+
+        sentences = [s for s in _SENTENCE_SPLIT.split(plot) if s.strip()] if plot else []
+        documents = []
+
+        # Header: metadata + các câu mở đầu cốt truyện nếu còn chỗ
+        opening = []
+        remaining = self.max_tokens - header_tokens - 4
+        for sentence, tokens in zip(sentences, self.count_tokens(sentences)):
+            if tokens > remaining:
+                break
+            opening.append(sentence)
+            remaining -= tokens
+        header_content = header + (f"\nCốt truyện: {' '.join(opening)}" if opening else "")
+        documents.append(Document(page_content=header_content,
+                                  metadata={**metadata, "chunk_type": "header", "chunk_index": 0}))
+
+        # Các câu còn lại (giữ câu cuối của phần mở đầu để nối mạch) chia theo token
+        rest = sentences[max(0, len(opening) - self.overlap_sentences):] if len(opening) < len(sentences) else []
+        prefix = f"{title} ({release_year or 'Không rõ'}) - Cốt truyện: "
+        budget = self.max_tokens - self.count_tokens([prefix])[0]
+        for i, text in enumerate(self._pack(rest, budget), 1):
+            documents.append(Document(page_content=prefix + text,
+                                      metadata={**metadata, "chunk_type": "plot", "chunk_index": i}))
+        return documents
+
+
+def collapse_by_movie(docs, limit=3):
+    """
+    Gộp kết quả truy vấn theo phim (`parent_id`), giữ thứ tự theo chunk khớp nhất của mỗi phim.
+
+    Returns:
+        list[tuple[dict, list[Document]]]: tối đa `limit` phim, mỗi phim gồm metadata và các chunk đã khớp.
+    """
+    movies = {}
+    for doc in docs:
+        key = doc.metadata.get("parent_id") or doc.metadata.get("title") or id(doc)
+        if key not in movies:
+            if len(movies) >= limit:
+                continue
+            movies[key] = (doc.metadata, [])
+        movies[key][1].append(doc)
+    return list(movies.values())
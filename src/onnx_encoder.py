@@ -0,0 +1,350 @@
+"""
+Encoder truy vấn all-MiniLM-L6-v2 chạy bằng ONNX Runtime trên CPU (tùy chọn lượng tử hóa int8),
+thay cho HuggingFaceEmbeddings/PyTorch.
+
+Ví dụ:
+    python src/onnx_encoder.py export                 # xuất ONNX (fp32 + int8) vào models/all-MiniLM-L6-v2-onnx
+    python src/onnx_encoder.py parity                 # so sánh embedding ONNX với PyTorch (exit code 1 nếu lệch)
+    python src/onnx_encoder.py benchmark --queries 200
+
+Bật trong chatbot và build_index.py bằng biến môi trường CINEBOT_EMBEDDING_BACKEND=onnx.
+"""
+import argparse
+import inspect
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from cache_utils import TTLCache
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_BACKEND = os.getenv("CINEBOT_EMBEDDING_BACKEND", "torch")
+ONNX_DIR = os.getenv("CINEBOT_ONNX_DIR", os.path.join("models", "all-MiniLM-L6-v2-onnx"))
+ONNX_QUANTIZED = os.getenv("CINEBOT_ONNX_QUANTIZED", "1") == "1"
+MAX_SEQ_LENGTH = 256
+MICRO_BATCH_SIZE = 32
+MICRO_BATCH_WAIT_MS = 5.0
+QUERY_CACHE_TTL = 7 * 24 * 3600  # Embedding chỉ phụ thuộc vào model nên có thể giữ lâu
+
+FP32_FILE = "model.onnx"
+INT8_FILE = "model.int8.onnx"
+
+PARITY_SENTENCES = [
+    "phim hành động",
+    "Christopher Nolan",
+    "A thief who steals corporate secrets through dream-sharing technology.",
+    "Phim tình cảm Hàn Quốc cảm động nhất",
+    "An astronaut is stranded on Mars and must survive alone.",
+    "Gợi ý phim hoạt hình cho trẻ em",
+    "The Godfather 1972 crime drama directed by Francis Ford Coppola",
+    "Phim kinh dị nào đáng xem nhất?",
+]
+
+
+def export_onnx(model_name=EMBEDDING_MODEL, out_dir=ONNX_DIR, quantize=True):
+    """Xuất transformer của model sang ONNX (trục batch/độ dài động) và lượng tử hóa int8 động."""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(out_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+    # Lưu tokenizer.json để lúc chạy chỉ cần thư viện `tokenizers`, không cần transformers/torch
+    tokenizer.save_pretrained(out_dir)
+
+    class _Encoder(torch.nn.Module):
+        """Gọi model bằng tham số tên, để thứ tự tham số của forward() giữa các phiên bản transformers không ảnh hưởng."""
+
+        def __init__(self, inner):
+            super().__init__()
+            self.inner = inner
+
+        def forward(self, input_ids, attention_mask, token_type_ids):
+            return self.inner(input_ids=input_ids, attention_mask=attention_mask,
+                              token_type_ids=token_type_ids).last_hidden_state
+
+    sample = tokenizer(["xin chào", "hello world"], padding=True, return_tensors="pt")
+    inputs = (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"])
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in ("input_ids", "attention_mask", "token_type_ids", "last_hidden_state")}
+    fp32_path = os.path.join(out_dir, FP32_FILE)
+    # Dùng exporter TorchScript (hỗ trợ dynamic_axes); torch >= 2.5 mặc định chuyển sang dynamo
+    export_kwargs = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+    with torch.no_grad():
+        torch.onnx.export(
+            _Encoder(model), inputs, fp32_path,
+            input_names=["input_ids", "attention_mask", "token_type_ids"],
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+            **export_kwargs,
+        )
+    print(f"✅ Đã xuất {fp32_path}")
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        int8_path = os.path.join(out_dir, INT8_FILE)
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+        print(f"✅ Đã lượng tử hóa int8: {int8_path}")
+    return out_dir
+
+
+class OnnxMiniLMEncoder:
+    """
+    Chạy MiniLM bằng onnxruntime: mean pooling + chuẩn hóa L2 như sentence-transformers.
+
+    `encode()` xử lý một list văn bản ngay; `submit()` gom các truy vấn đến gần như cùng lúc
+    (tối đa `max_batch` câu hoặc chờ `max_wait_ms`) thành một lần chạy model (micro-batching).
+    """
+
+    def __init__(self, model_dir=ONNX_DIR, quantized=ONNX_QUANTIZED, max_batch=MICRO_BATCH_SIZE,
+                 max_wait_ms=MICRO_BATCH_WAIT_MS, threads=None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_file = os.path.join(model_dir, INT8_FILE if quantized else FP32_FILE)
+        if not os.path.exists(model_file):
+            raise FileNotFoundError(f"Không tìm thấy {model_file}. Vui lòng chạy: python src/onnx_encoder.py export")
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(MAX_SEQ_LENGTH)
+        self.tokenizer.enable_padding()
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(model_file, options, providers=["CPUExecutionProvider"])
+        self._input_names = {i.name for i in self.session.get_inputs()}
+        self.model_file = model_file
+
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._pending = []
+        self._cond = threading.Condition()
+        self._worker = None
+
+    def encode(self, texts):
+        if not texts:
+            return np.zeros((0, 384), dtype=np.float32)
+        encodings = self.tokenizer.encode_batch(list(texts))
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+        hidden = self.session.run(["last_hidden_state"], feeds)[0]
+
+        mask = attention_mask[..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+    def submit(self, text):
+        """Đưa một câu vào hàng đợi micro-batch; trả về Future chứa vector."""
+        future = Future()
+        with self._cond:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run_batches, name="onnx-encoder", daemon=True)
+                self._worker.start()
+            self._pending.append((text, future))
+            self._cond.notify()
+        return future
+
+    def _run_batches(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                # Chờ thêm một chút để gom các truy vấn đến cùng lúc
+                deadline = time.monotonic() + self.max_wait
+                while len(self._pending) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            try:
+                vectors = self.encode([text for text, _ in batch])
+                for (_, future), vector in zip(batch, vectors):
+                    future.set_result(vector)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+
+class OnnxEmbeddings(Embeddings):
+    """Giao diện Embeddings của LangChain (dùng được với Chroma) trên OnnxMiniLMEncoder."""
+
+    def __init__(self, model_dir=ONNX_DIR, quantized=ONNX_QUANTIZED, batch_size=64):
+        self.encoder = OnnxMiniLMEncoder(model_dir, quantized)
+        self.batch_size = batch_size
+
+    def embed_documents(self, texts):
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self.encoder.encode(texts[start:start + self.batch_size]).tolist())
+        return vectors
+
+    def embed_query(self, text):
+        # Các truy vấn đồng thời từ nhiều phiên chat được gom vào một lần chạy model
+        return self.encoder.submit(text).result().tolist()
+
+
+# Embedding của các truy vấn đã gặp (dùng chung cho mọi phiên, lưu vào snapshot của warm_state.py)
+query_embedding_cache = TTLCache(QUERY_CACHE_TTL, max_entries=5000, name="query_embeddings")
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """Bọc một Embeddings: truy vấn lặp lại lấy vector từ cache thay vì chạy lại tokenizer và encoder."""
+
+    def __init__(self, inner, cache=query_embedding_cache):
+        self.inner = inner
+        self.cache = cache
+
+    def embed_documents(self, texts):
+        return self.inner.embed_documents(texts)
+
+    def embed_query(self, text):
+        key = text.strip()
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = self.inner.embed_query(text)
+            self.cache.set(key, vector)
+        return vector
+
+
+def get_embedding_model(backend=None, model_path=None):
+    """
+    Embedding model theo CINEBOT_EMBEDDING_BACKEND: `onnx` hoặc `torch` (HuggingFaceEmbeddings, mặc định).
+
+    Args:
+        model_path: Thư mục model cục bộ (ví dụ trong snapshot) thay cho ONNX_DIR / model trên HF hub.
+    """
+    backend = backend or EMBEDDING_BACKEND
+    if backend == "onnx":
+        model_dir = model_path or ONNX_DIR
+        print(f"✅ Dùng encoder ONNX ({'int8' if ONNX_QUANTIZED else 'fp32'}) tại {model_dir}")
+        return CachedQueryEmbeddings(OnnxEmbeddings(model_dir))
+    if backend != "torch":
+        raise ValueError(f"CINEBOT_EMBEDDING_BACKEND không hợp lệ: {backend}")
+    try:
+        from langchain_huggingface import HuggingFaceEmbeddings
+    except ImportError:
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+    return CachedQueryEmbeddings(HuggingFaceEmbeddings(
+        model_name=model_path or EMBEDDING_MODEL,
+        model_kwargs={'device': 'cpu'},
+        encode_kwargs={'normalize_embeddings': True}
+    ))
+
+
+def check_parity(model_dir=ONNX_DIR, quantized=ONNX_QUANTIZED, min_cosine=None):
+    """So sánh embedding ONNX với sentence-transformers (PyTorch) trên các câu mẫu."""
+    from sentence_transformers import SentenceTransformer
+
+    min_cosine = min_cosine or (0.98 if quantized else 0.9999)
+    reference = SentenceTransformer(EMBEDDING_MODEL, device="cpu").encode(PARITY_SENTENCES, normalize_embeddings=True)
+    onnx_vectors = OnnxMiniLMEncoder(model_dir, quantized).encode(PARITY_SENTENCES)
+    cosines = (reference * onnx_vectors).sum(axis=1)
+
+    # Thứ hạng tìm kiếm: với mỗi câu, câu gần nhất (ngoài chính nó) phải giống nhau
+    def neighbours(vectors):
+        sims = vectors @ vectors.T
+        np.fill_diagonal(sims, -1)
+        return sims.argmax(axis=1)
+
+    same_neighbours = float((neighbours(reference) == neighbours(onnx_vectors)).mean())
+    ok = float(cosines.min()) >= min_cosine
+    print(f"{'✅' if ok else '❌'} Cosine ONNX/PyTorch: min={cosines.min():.5f} mean={cosines.mean():.5f} "
+          f"(ngưỡng {min_cosine}); láng giềng gần nhất trùng {same_neighbours:.0%}")
+    return ok
+
+
+def _bench_worker(backend, queries):
+    """Chạy trong tiến trình riêng để đo thời gian import, độ trễ và RSS của một backend."""
+    import resource
+
+    started = time.perf_counter()
+    if backend == "torch":
+        from sentence_transformers import SentenceTransformer
+
+        model = SentenceTransformer(EMBEDDING_MODEL, device="cpu")
+        encode = lambda texts: model.encode(texts, normalize_embeddings=True)
+    else:
+        encoder = OnnxMiniLMEncoder(quantized=(backend == "onnx-int8"))
+        encode = encoder.encode
+    load_seconds = time.perf_counter() - started
+
+    texts = [PARITY_SENTENCES[i % len(PARITY_SENTENCES)] + f" {i}" for i in range(queries)]
+    encode(texts[:4])  # warm up
+    latencies = []
+    for text in texts:
+        t = time.perf_counter()
+        encode([text])
+        latencies.append(time.perf_counter() - t)
+    t = time.perf_counter()
+    encode(texts)
+    batch_seconds = time.perf_counter() - t
+
+    latencies.sort()
+    print(json.dumps({
+        "backend": backend,
+        "load_s": round(load_seconds, 3),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p90_ms": round(latencies[int(len(latencies) * 0.9)] * 1000, 2),
+        "batch_per_query_ms": round(batch_seconds / len(texts) * 1000, 2),
+        # ru_maxrss tính bằng KB trên Linux
+        "rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }))
+
+
+def benchmark(queries=200, backends=("torch", "onnx-fp32", "onnx-int8")):
+    """So sánh từng backend trong tiến trình riêng (để thời gian import và RSS không ảnh hưởng nhau)."""
+    results = []
+    for backend in backends:
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "_bench-worker", backend, str(queries)],
+                                capture_output=True, text=True)
+        if output.returncode != 0:
+            print(f"⚠️ {backend}: {output.stderr.strip().splitlines()[-1] if output.stderr.strip() else 'lỗi'}")
+            continue
+        results.append(json.loads(output.stdout.strip().splitlines()[-1]))
+
+    print(f"{'backend':<10} {'import+load(s)':>15} {'p50(ms)':>8} {'p90(ms)':>8} {'batch/q(ms)':>12} {'RSS(MB)':>8}")
+    for r in results:
+        print(f"{r['backend']:<10} {r['load_s']:>15} {r['p50_ms']:>8} {r['p90_ms']:>8} {r['batch_per_query_ms']:>12} {r['rss_mb']:>8}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Encoder MiniLM dùng ONNX Runtime")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export_cmd = sub.add_parser("export", help="Xuất model sang ONNX")
+    export_cmd.add_argument("--out", default=ONNX_DIR)
+    export_cmd.add_argument("--no-quantize", action="store_true")
+    parity_cmd = sub.add_parser("parity", help="So sánh embedding với PyTorch")
+    parity_cmd.add_argument("--fp32", action="store_true", help="Kiểm tra model fp32 thay vì int8")
+    bench_cmd = sub.add_parser("benchmark", help="Đo thời gian tải, độ trễ và RSS")
+    bench_cmd.add_argument("--queries", type=int, default=200)
+    worker_cmd = sub.add_parser("_bench-worker")
+    worker_cmd.add_argument("backend")
+    worker_cmd.add_argument("queries", type=int)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_onnx(out_dir=args.out, quantize=not args.no_quantize)
+    elif args.command == "parity":
+        sys.exit(0 if check_parity(quantized=not args.fp32) else 1)
+    elif args.command == "benchmark":
+        benchmark(args.queries)
+    else:
+        _bench_worker(args.backend, args.queries)
+
+
+if __name__ == "__main__":
+    main()
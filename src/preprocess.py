@@ -1,32 +1,222 @@
-import kagglehub
-import pandas as pd
-import os
+"""
+Tiền xử lý bộ dữ liệu Wikipedia Movie Plots (Kaggle) thành file JSONL hoặc Parquet cho build_index.py.
+
+Ví dụ:
+    python src/preprocess.py                                   # toàn bộ dữ liệu -> data/movies.jsonl
+    python src/preprocess.py --sample stratified --frac 0.05   # lấy mẫu 5% theo quốc gia
+    python src/preprocess.py --format parquet                  # -> data/movies.parquet
+"""
+import argparse
 import json
-from langchain_core.documents import Document
-
-# Download latest version
-path = kagglehub.dataset_download("jrobischon/wikipedia-movie-plots")
-csv_file = os.path.join(path, "wiki_movie_plots_deduped.csv")
-
-df = pd.read_csv(csv_file)
-df_5percent = df.sample(frac=0.05, random_state=42)
-df_5percent.rename(columns={"Release Year": "Release_year","Origin/Ethnicity":"Nation","Wiki Page":"Wiki_Page"}, inplace=True)
-
-movies = []
-
-for movie in df_5percent.itertuples():
-    movies.append({
-        "Title": movie.Title,
-        "Release_year": movie.Release_year,
-        "Nation": movie.Nation,
-        "Director": movie.Director,
-        "Cast": movie.Cast,
-        "Genre": movie.Genre,
-        "Wiki_page": movie.Wiki_Page,
-        "Plot": movie.Plot
-    })
-
-
-# Lưu trữ các tài liệu đã tạo
-with open('movies.json', 'w', encoding='utf-8') as file:
-  json.dump(movies, file, ensure_ascii=False, indent=2)
+import os
+import time
+
+import pandas as pd
+
+DATA_DIR = os.getenv("CINEBOT_DATA_DIR", "data")
+DEFAULT_OUTPUT = os.path.join(DATA_DIR, "movies.jsonl")
+KAGGLE_DATASET = "jrobischon/wikipedia-movie-plots"
+CSV_NAME = "wiki_movie_plots_deduped.csv"
+WRITE_CHUNK_ROWS = 10000
+SCHEMA_VERSION = 1
+
+# Tên cột gốc trong CSV -> tên trường dùng trong toàn bộ dự án
+COLUMN_MAP = {
+    "Title": "Title",
+    "Release Year": "Release_year",
+    "Origin/Ethnicity": "Nation",
+    "Director": "Director",
+    "Cast": "Cast",
+    "Genre": "Genre",
+    "Wiki Page": "Wiki_page",
+    "Plot": "Plot",
+}
+
+# Schema của file đầu ra (thứ tự cột cố định)
+MOVIE_SCHEMA = {
+    "Title": "string",
+    "Release_year": "int32",
+    "Nation": "string",
+    "Director": "string",
+    "Cast": "string",
+    "Genre": "string",
+    "Wiki_page": "string",
+    "Plot": "string",
+}
+
+# Các giá trị trong CSV mang nghĩa "không có thông tin"
+MISSING_VALUES = ["", "unknown", "nan", "n/a", "none", "-"]
+
+
+def load_raw(csv_path=None):
+    """Đọc CSV gốc; tải từ Kaggle nếu không chỉ định file cục bộ."""
+    if csv_path is None:
+        import kagglehub
+
+        path = kagglehub.dataset_download(KAGGLE_DATASET)
+        csv_path = os.path.join(path, CSV_NAME)
+    print(f"📥 Đang đọc {csv_path}")
+    return pd.read_csv(csv_path, usecols=list(COLUMN_MAP), dtype=str, keep_default_na=False)
+
+
+def clean(df):
+    """Đổi tên cột và làm sạch theo từng cột (không lặp qua từng dòng)."""
+    df = df.rename(columns=COLUMN_MAP)[list(MOVIE_SCHEMA)]
+    text_columns = [c for c, dtype in MOVIE_SCHEMA.items() if dtype == "string"]
+
+    # Gộp khoảng trắng thừa ở các cột metadata (ngắn); cốt truyện chỉ cần bỏ khoảng trắng hai đầu
+    meta_columns = [c for c in text_columns if c != "Plot"]
+    df[meta_columns] = df[meta_columns].apply(lambda col: col.str.replace(r"\s+", " ", regex=True).str.strip())
+    df["Plot"] = df["Plot"].str.strip()
+    # Chuyển các giá trị "unknown"/rỗng thành NA
+    df[meta_columns] = df[meta_columns].mask(df[meta_columns].apply(lambda col: col.str.lower().isin(MISSING_VALUES)))
+    df["Plot"] = df["Plot"].mask(df["Plot"] == "")
+
+    df["Release_year"] = pd.to_numeric(df["Release_year"], errors="coerce").astype("Int32")
+    df["Genre"] = df["Genre"].str.lower()
+    return df.dropna(subset=["Title", "Plot"]).astype({c: "string" for c in text_columns})
+
+
+def dedupe_titles(df):
+    """
+    Bỏ các dòng trùng (cùng tên phim đã chuẩn hóa và cùng năm), giữ bản có cốt truyện dài nhất.
+    Phim làm lại ở năm khác vẫn được giữ.
+    """
+    key = df["Title"].str.casefold().str.replace(r"[^\w]+", " ", regex=True).str.strip()
+    ordered = df.assign(_key=key, _plot_len=df["Plot"].str.len()).sort_values("_plot_len", ascending=False)
+    deduped = ordered.drop_duplicates(subset=["_key", "Release_year"]).drop(columns=["_key", "_plot_len"])
+    return deduped.sort_index()
+
+
+def sample(df, mode="full", frac=0.05, stratify_by="Nation", seed=42):
+    """
+    - `full`: giữ toàn bộ.
+    - `random`: lấy ngẫu nhiên `frac` số phim.
+    - `stratified`: lấy `frac` trong từng nhóm `stratify_by` (mỗi nhóm ít nhất 1 phim)
+      để các quốc gia/thể loại nhỏ không bị mất khi lấy mẫu.
+    """
+    if mode == "full":
+        return df
+    if mode == "random":
+        return df.sample(frac=frac, random_state=seed).sort_index()
+    if mode == "stratified":
+        groups = df[stratify_by].fillna("Unknown")
+        sizes = (groups.map(groups.value_counts()) * frac).round().clip(lower=1)
+        # Xếp hạng ngẫu nhiên trong từng nhóm rồi giữ `sizes` dòng đầu của mỗi nhóm
+        rank = df.sample(frac=1.0, random_state=seed).groupby(groups, sort=False).cumcount()
+        return df[rank.reindex(df.index) < sizes]
+    raise ValueError(f"Chế độ lấy mẫu không hợp lệ: {mode}")
+
+
+def _schema_path(out_path):
+    return os.path.splitext(out_path)[0] + ".schema.json"
+
+
+def write_jsonl(df, out_path, chunk_rows=WRITE_CHUNK_ROWS):
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for start in range(0, len(df), chunk_rows):
+            chunk = df.iloc[start:start + chunk_rows]
+            # to_json ghi NA thành null và không ép kiểu số năm thành float
+            f.write(chunk.to_json(orient="records", lines=True, force_ascii=False))
+    os.replace(tmp_path, out_path)
+
+
+def write_parquet(df, out_path, chunk_rows=WRITE_CHUNK_ROWS):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Cần cài pyarrow để ghi Parquet: pip install pyarrow")
+
+    arrow_types = {"string": pa.string(), "int32": pa.int32()}
+    schema = pa.schema([(name, arrow_types[dtype]) for name, dtype in MOVIE_SCHEMA.items()],
+                       metadata={"schema_version": str(SCHEMA_VERSION)})
+    tmp_path = out_path + ".tmp"
+    with pq.ParquetWriter(tmp_path, schema) as writer:
+        for start in range(0, len(df), chunk_rows):
+            chunk = df.iloc[start:start + chunk_rows]
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+    os.replace(tmp_path, out_path)
+
+
+def default_output(fmt=None):
+    """File đầu ra mặc định theo định dạng: data/movies.jsonl hoặc data/movies.parquet."""
+    return os.path.join(DATA_DIR, f"movies.{fmt or 'jsonl'}")
+
+
+def write_movies(df, out_path, fmt=None, chunk_rows=WRITE_CHUNK_ROWS):
+    """Ghi từng khối `chunk_rows` dòng ra JSONL/Parquet, kèm file mô tả schema."""
+    inferred = "parquet" if out_path.endswith(".parquet") else "jsonl"
+    fmt = fmt or inferred
+    # iter_movie_batches chọn cách đọc theo đuôi file nên đuôi file phải khớp định dạng
+    if fmt != inferred:
+        raise ValueError(f"Định dạng {fmt} không khớp với đuôi file {out_path}; hãy dùng đuôi .{fmt}")
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    if fmt == "parquet":
+        write_parquet(df, out_path, chunk_rows)
+    else:
+        write_jsonl(df, out_path, chunk_rows)
+    with open(_schema_path(out_path), "w", encoding="utf-8") as f:
+        json.dump({"version": SCHEMA_VERSION, "format": fmt, "rows": len(df), "fields": MOVIE_SCHEMA}, f, indent=2)
+    return fmt
+
+
+def iter_movie_batches(path, batch_size=1000):
+    """
+    Đọc dần file phim theo từng lô (list các dict) để không phải nạp toàn bộ vào bộ nhớ.
+    Hỗ trợ .jsonl, .parquet và file movies.json cũ (dạng list JSON).
+    """
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+            yield batch.to_pylist()
+    elif path.endswith(".jsonl"):
+        batch = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    batch.append(json.loads(line))
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        for start in range(0, len(data), batch_size):
+            yield data[start:start + batch_size]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiền xử lý dữ liệu phim cho CineBot")
+    parser.add_argument("--csv", help="File CSV gốc (mặc định: tải từ Kaggle)")
+    parser.add_argument("--sample", choices=["full", "random", "stratified"], default="full")
+    parser.add_argument("--frac", type=float, default=0.05, help="Tỉ lệ lấy mẫu cho random/stratified")
+    parser.add_argument("--stratify-by", default="Nation", choices=list(MOVIE_SCHEMA))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--format", choices=["jsonl", "parquet"], help="Mặc định suy ra từ đuôi file --out")
+    parser.add_argument("--out", help=f"Mặc định {DEFAULT_OUTPUT}, hoặc data/movies.parquet với --format parquet")
+    parser.add_argument("--chunk-rows", type=int, default=WRITE_CHUNK_ROWS)
+    args = parser.parse_args()
+    args.out = args.out or default_output(args.format)
+    if args.format and args.format != ("parquet" if args.out.endswith(".parquet") else "jsonl"):
+        parser.error(f"--format {args.format} không khớp với đuôi file --out {args.out}")
+
+    started = time.perf_counter()
+    raw = load_raw(args.csv)
+    df = clean(raw)
+    cleaned = len(df)
+    df = dedupe_titles(df)
+    deduped = len(df)
+    df = sample(df, args.sample, args.frac, args.stratify_by, args.seed)
+    fmt = write_movies(df, args.out, args.format, args.chunk_rows)
+
+    print(f"🧹 {len(raw)} dòng gốc -> {cleaned} sau làm sạch -> {deduped} sau bỏ trùng -> {len(df)} sau lấy mẫu ({args.sample})")
+    print(f"✅ Đã ghi {args.out} ({fmt}) trong {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import hashlib
+import os
+import threading
+import time
+
+from cache_utils import TTLCache
+from metrics import registry as metrics_registry
+from search_providers import normalize_query
+
+# Để trống CINEBOT_RERANKER để tắt bước re-rank
+RERANKER_MODEL = os.getenv("CINEBOT_RERANKER", "")
+RERANK_CANDIDATES = int(os.getenv("CINEBOT_RERANK_CANDIDATES", "30"))
+RERANK_BUDGET_MS = float(os.getenv("CINEBOT_RERANK_BUDGET_MS", "300"))
+RERANK_BATCH_SIZE = 8
+RERANK_PROBE_INTERVAL = 60  # Giây; đo lại thời gian một lô ở nền khi ước lượng cũ khiến re-rank bị bỏ qua
+RERANK_MAX_LENGTH = 256
+SCORE_CACHE_TTL = 24 * 3600
+
+
+def _doc_key(doc):
+    metadata = doc.metadata or {}
+    if metadata.get('parent_id') is not None:
+        return f"{metadata['parent_id']}:{metadata.get('chunk_index', 0)}"
+    return hashlib.sha1(doc.page_content.encode('utf-8')).hexdigest()[:16]
+
+
+class CrossEncoderReranker:
+    """
+    Sắp xếp lại ứng viên từ vector DB bằng cross-encoder chạy trên CPU.
+
+    Ứng viên được chấm điểm theo từng lô, theo thứ tự của bi-encoder. Khi sắp hết ngân sách
+    thời gian (`budget_ms`), các ứng viên chưa chấm giữ nguyên thứ tự bi-encoder và đứng sau
+    các ứng viên đã chấm. Điểm (query, chunk) được cache để câu hỏi lặp lại không phải chấm lại.
+    """
+
+    def __init__(self, model_name, budget_ms=RERANK_BUDGET_MS, batch_size=RERANK_BATCH_SIZE):
+        self.model_name = model_name
+        self.budget = budget_ms / 1000.0
+        self.batch_size = batch_size
+        self.scores = TTLCache(SCORE_CACHE_TTL, max_entries=50000, name="rerank_scores")
+        self._model = None
+        self._lock = threading.Lock()
+        self._batch_seconds = None  # Thời gian chấm một lô gần nhất, để dự đoán có kịp ngân sách không
+        self._measured_at = 0.0
+        self._probing = False
+
+    def _get_model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+
+                    self._model = CrossEncoder(self.model_name, max_length=RERANK_MAX_LENGTH, device='cpu')
+                    print(f"✅ Cross-encoder {self.model_name} đã sẵn sàng")
+        return self._model
+
+    def warm_up(self):
+        """Tải model và chấm thử một lô để lần truy vấn đầu tiên không bị tính thời gian tải."""
+        model = self._get_model()
+        # Chỉ đo thời gian predict; thời gian tải model không phải thời gian của một lô
+        started = time.perf_counter()
+        model.predict([("warm up", "warm up")] * self.batch_size)
+        self._batch_seconds = time.perf_counter() - started
+        self._measured_at = time.monotonic()
+
+    def _probe(self):
+        try:
+            self.warm_up()
+            print(f"🔁 Đo lại cross-encoder: {self._batch_seconds * 1000:.0f}ms/lô")
+        except Exception as e:
+            print(f"⚠️ Không đo lại được cross-encoder: {e}")
+        finally:
+            self._probing = False
+
+    def _maybe_probe(self):
+        """
+        Ước lượng cũ vượt ngân sách sẽ khiến mọi truy vấn bỏ qua re-rank và không bao giờ đo lại;
+        thỉnh thoảng đo lại ở luồng nền (ngoài đường trả lời) để re-rank bật lại khi máy bớt tải.
+        """
+        if self._probing or time.monotonic() - self._measured_at < RERANK_PROBE_INTERVAL:
+            return
+        self._probing = True
+        threading.Thread(target=self._probe, daemon=True).start()
+
+    def rerank(self, query, docs):
+        if not docs:
+            return docs
+        started = time.perf_counter()
+        deadline = started + self.budget
+        query_key = normalize_query(query)
+
+        scores = {}
+        pending = []
+        for i, doc in enumerate(docs):
+            cached = self.scores.get((query_key, _doc_key(doc)))
+            if cached is not None:
+                scores[i] = cached
+            else:
+                pending.append(i)
+
+        exhausted = False
+        for start in range(0, len(pending), self.batch_size):
+            # Không bắt đầu lô nào (kể cả lô đầu) nếu dự đoán sẽ vượt ngân sách
+            if self._batch_seconds is not None and time.perf_counter() + self._batch_seconds > deadline:
+                exhausted = True
+                if start == 0:
+                    self._maybe_probe()
+                break
+            batch = pending[start:start + self.batch_size]
+            batch_started = time.perf_counter()
+            batch_scores = self._get_model().predict([(query, docs[i].page_content) for i in batch])
+            elapsed = time.perf_counter() - batch_started
+            # Trung bình trượt: ước lượng theo kịp thay đổi tải nhưng không bị một lần đo quyết định
+            self._batch_seconds = elapsed if self._batch_seconds is None else 0.5 * self._batch_seconds + 0.5 * elapsed
+            self._measured_at = time.monotonic()
+            for i, score in zip(batch, batch_scores):
+                scores[i] = float(score)
+                self.scores.set((query_key, _doc_key(docs[i])), float(score))
+
+        if exhausted:
+            metrics_registry.increment("rerank.budget_exhausted")
+        metrics_registry.record("rerank", time.perf_counter() - started)
+
+        scored = sorted(scores, key=lambda i: scores[i], reverse=True)
+        unscored = [i for i in range(len(docs)) if i not in scores]
+        return [docs[i] for i in scored + unscored]
+
+    def save_model(self, path):
+        """Lưu bản sao model vào thư mục cục bộ để nạp lại mà không cần HF hub."""
+        self._get_model().save(path)
+
+    def stats(self):
+        return {'model': self.model_name, 'budget_ms': self.budget * 1000, 'scores': self.scores.stats()}
+
+
+_reranker = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker(model_path=None):
+    """
+    Reranker dùng chung, hoặc None nếu CINEBOT_RERANKER không được cấu hình hay không tải được model.
+
+    Args:
+        model_path: Thư mục chứa bản sao cục bộ của model CINEBOT_RERANKER (ví dụ trong snapshot).
+    """
+    global _reranker
+    if not RERANKER_MODEL:
+        return None
+    if _reranker is None:
+        with _reranker_lock:
+            if _reranker is None:
+                model_name = model_path or RERANKER_MODEL
+                try:
+                    reranker = CrossEncoderReranker(model_name)
+                    reranker.warm_up()
+                    _reranker = reranker
+                except Exception as e:
+                    print(f"⚠️ Không tải được cross-encoder {model_name}, dùng thứ tự của bi-encoder: {e}")
+                    _reranker = False  # Không thử tải lại ở mỗi truy vấn
+    return _reranker or None
@@ -1,119 +1,133 @@
-import re
+import os
 import time
 import traceback
 import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from typing import List, Optional
 from bs4 import BeautifulSoup
 from langchain.tools import StructuredTool
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
+from pydantic import BaseModel, Field
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
-from webdriver_manager.chrome import ChromeDriverManager
-
-def setup_selenium_driver():
-    """Khởi tạo Selenium Chrome driver với các tùy chọn tối ưu."""
-    chrome_options = Options()
-    chrome_options.add_argument("--headless")  # Bỏ comment để chạy ẩn
-    chrome_options.add_argument("--no-sandbox")
-    chrome_options.add_argument("--disable-dev-shm-usage")
-    chrome_options.add_argument("--start-maximized")
-    chrome_options.add_argument("--disable-blink-features=AutomationControlled")
-    chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
-    chrome_options.add_experimental_option('useAutomationExtension', False)
-    chrome_options.add_argument("user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36")
-    
-    # Tùy chọn để tăng tốc độ load
-    prefs = {"profile.managed_default_content_settings.images": 2 # Không load ảnh
-                , "profile.managed_default_content_settings.stylesheets": 2 # Không load CSS
-             } 
-    chrome_options.add_experimental_option("prefs", prefs)
 
+from browser_pool import get_browser_pool
+from cinema_adapters import get_adapter
+from showtimes_cache import ShowtimesStore
+from showtimes_http import fetch_showtimes_http
+
+# Số ngày lấy lịch chiếu, tính từ hôm nay
+SCRAPE_DAYS = 2
+# Số rạp được scrape song song trong một lần gọi nhiều rạp
+MAX_PARALLEL_CINEMAS = int(os.getenv("CINEBOT_MAX_PARALLEL_CINEMAS", "4"))
+
+# Giới hạn trên (giây) cho các lần chờ; trang load nhanh sẽ trả về ngay
+PAGE_READY_TIMEOUT = float(os.getenv("CINEBOT_PAGE_READY_TIMEOUT", "8"))
+DATE_TAB_TIMEOUT = float(os.getenv("CINEBOT_DATE_TAB_TIMEOUT", "6"))
+WAIT_POLL_INTERVAL = 0.1
+
+# Chữ ký nội dung lịch chiếu hiện tại, dùng để phát hiện AJAX đã thay nội dung
+_SCHEDULE_SIGNATURE_JS = (
+    "return Array.from(document.querySelectorAll(arguments[0]))"
+    ".map(function(e){return e.textContent;}).join('|');"
+)
+# Số request jQuery đang chạy (-1 nếu trang không dùng jQuery)
+_PENDING_AJAX_JS = "return (typeof jQuery !== 'undefined') ? jQuery.active : -1;"
+
+
+def _timed_wait(driver, condition, timeout, label, wait_log):
+    """Chờ đến khi condition đúng (tối đa timeout giây) và ghi lại thời gian đã chờ."""
+    start = time.monotonic()
     try:
-        driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=chrome_options)
-        driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
-        return driver
-    except Exception as e:
-        print(f"❌ Lỗi khi cài đặt WebDriver: {e}. Vui lòng kiểm tra kết nối mạng hoặc phiên bản Chrome.")
-        return None
+        WebDriverWait(driver, timeout, poll_frequency=WAIT_POLL_INTERVAL).until(condition)
+        ready = True
+    except TimeoutException:
+        ready = False
+    elapsed = round(time.monotonic() - start, 3)
+    wait_log.append({'wait': label, 'seconds': elapsed, 'ready': ready})
+    print(f"  ⏱️ {label}: {elapsed:.2f}s{'' if ready else ' (hết thời gian chờ)'}")
+    return ready
 
-def extract_schedules_from_html(soup, date_str):
-    movies_data = []
 
-    label_blocks = soup.select('.film-label')  # Bắt đầu từ khối tiêu đề phim
-    print(f"🔎 Tìm thấy {len(label_blocks)} phim (film-label).")
+def _page_ready(selector):
+    """Trang đã có khối phim, hoặc đã load xong và không còn AJAX nào đang chạy."""
+    def condition(driver):
+        if driver.find_elements(By.CSS_SELECTOR, selector):
+            return True
+        if driver.execute_script("return document.readyState") != 'complete':
+            return False
+        return driver.execute_script(_PENDING_AJAX_JS) == 0
+    return condition
 
-    for label_div in label_blocks:
-        try:
-            # Tìm tên phim
-            title_elem = label_div.select_one('h3 a')
-            if not title_elem:
-                continue
-            title = title_elem.get_text(strip=True)
 
-            # Tìm div.film-right kế tiếp
-            film_right_div = label_div.find_next_sibling('div', class_='film-right')
-            if not film_right_div:
-                continue
+def _schedule_changed(selector, before):
+    """Nội dung lịch chiếu đã khác trước khi click, hoặc AJAX của trang đã chạy xong."""
+    def condition(driver):
+        if driver.execute_script(_SCHEDULE_SIGNATURE_JS, selector) != before:
+            return True
+        return driver.execute_script(_PENDING_AJAX_JS) == 0
+    return condition
 
-            # Tìm tất cả các suất chiếu
-            showtime_elems = film_right_div.select('.film-showtimes li.item a span')
-            showtimes = []
-            for elem in showtime_elems:
-                time_text = elem.get_text(strip=True)
-                found_time = re.search(r'\d{1,2}:\d{2}', time_text)
-                if found_time:
-                    showtimes.append(found_time.group(0))
-
-            if showtimes:
-                unique_showtimes = sorted(list(set(showtimes)))
-                movies_data.append({
-                    'title': title,
-                    'date': date_str,
-                    'showtimes': unique_showtimes
-                })
-                print(f"  🎬 {title}: {', '.join(unique_showtimes)}")
-        except Exception as e:
-            print(f"  ⚠️ Lỗi khi xử lý phim: {e}")
-            continue
 
-    return movies_data
+def _group_schedules(all_schedules):
+    """Gom nhóm lịch chiếu theo phim: [{'title', 'dates': {date: [giờ chiếu]}}]."""
+    final_movies = {}
+    for schedule in all_schedules:
+        title = schedule['title']
+        if title not in final_movies:
+            final_movies[title] = {'dates': {}}
+        
+        date = schedule['date']
+        final_movies[title]['dates'][date] = schedule['showtimes']
 
+    return [{'title': title, **data} for title, data in final_movies.items()]
 
 
-def scrape_cinema_showtimes(specific_cinema_url, cinema_info):
+def _success_result(all_schedules, cinema_info, method, covered_dates, wait_log=None):
     """
-    Tool chính: Scrape lịch chiếu từ một URL cụ thể của rạp.
-
     Args:
-        specific_cinema_url (str): Link trực tiếp đến trang lịch chiếu của rạp.
-        cinema_info (dict): Thông tin về rạp (tên, địa chỉ,...) để trả về trong kết quả.
-    
-    Returns:
-        dict: Dữ liệu lịch chiếu hoặc thông báo lỗi.
+        covered_dates (list): Các ngày (YYYYMMDD) đã thực sự lấy được lịch chiếu; cache chỉ lưu
+            các ngày này để ngày bị bỏ dở (tab lỗi, qua nửa đêm) được scrape lại.
     """
-    driver = setup_selenium_driver()
+    result_list = _group_schedules(all_schedules)
+    print(f"\n🎉 Hoàn thành! Tìm thấy {len(result_list)} phim có lịch chiếu.")
+    result = {
+        'status': 'success',
+        'cinema_info': cinema_info,
+        'scrape_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'method': method,
+        'dates': covered_dates,
+        'schedules': result_list
+    }
+    if wait_log is not None:
+        result['wait_timings'] = wait_log
+    return result
+
+
+def _scrape_with_selenium(specific_cinema_url, cinema_info, adapter):
+    """Scrape bằng Chrome headless cho các trang cần JavaScript để hiển thị lịch chiếu."""
+    pool = get_browser_pool()
+    driver = pool.acquire()
     if not driver:
         return {'status': 'error', 'message': 'Không thể khởi tạo WebDriver.'}
-        
+
+    broken = False
     all_schedules = []
+    covered_dates = []
+    wait_log = []
     
     try:
-        print(f"\n🚀 Bắt đầu scraping cho: {cinema_info.get('name', specific_cinema_url)}")
-        print(f"🔗 URL: {specific_cinema_url}")
-        
         driver.get(specific_cinema_url)
-        WebDriverWait(driver, 2).until(
-            EC.presence_of_element_located((By.TAG_NAME, "body"))
-        )
-        time.sleep(2)
+        _timed_wait(driver, _page_ready(adapter.ready_selector), PAGE_READY_TIMEOUT, "Chờ trang lịch chiếu", wait_log)
 
-        # Lặp qua 5 ngày tới
-        for i in range(2):
-            current_date = datetime.now() + timedelta(days=i)
-            date_str = current_date.strftime('%Y%m%d')
+        # Lặp qua các ngày tới (tính mốc một lần để không lệch ngày khi scrape qua nửa đêm)
+        today = datetime.now()
+        dates = [(today + timedelta(days=i)).strftime('%Y%m%d') for i in range(SCRAPE_DAYS)]
+        for i in range(SCRAPE_DAYS):
+            current_date = today + timedelta(days=i)
+            date_str = dates[i]
             display_date = current_date.strftime('%Y-%m-%d')
             
             print(f"\n🗓️ Đang xử lý ngày: {display_date}")
@@ -122,73 +136,121 @@ def scrape_cinema_showtimes(specific_cinema_url, cinema_info):
             # 1. Khởi tạo biến date_clicked = False
             date_clicked = False
             if i > 0: # Chỉ thử click từ ngày thứ hai trở đi
+                if not adapter.tab_id_format:
+                    print(f"  ℹ️ {adapter.name} không có tab ngày, chỉ lấy lịch đang hiển thị.")
+                    covered_dates.extend(dates[i:])  # Trang không cung cấp các ngày này
+                    break
                 try:
-                    # ⭐ ƯU TIÊN SỬ DỤNG ID CỦA CGV
-                    cgv_date_id = f"cgv{date_str}" 
+                    # ⭐ ID tab ngày theo từng hệ thống rạp (CGV: cgv{date})
+                    date_tab_id = adapter.tab_id_format.format(date=date_str)
                     
-                    date_element = WebDriverWait(driver, 5).until(
-                        EC.element_to_be_clickable((By.ID, cgv_date_id))
+                    date_element = WebDriverWait(driver, DATE_TAB_TIMEOUT, poll_frequency=WAIT_POLL_INTERVAL).until(
+                        EC.element_to_be_clickable((By.ID, date_tab_id))
                     )
+                    before = driver.execute_script(_SCHEDULE_SIGNATURE_JS, adapter.ready_selector)
                     driver.execute_script("arguments[0].click();", date_element)
                     
                     # 2. Cập nhật biến nếu click thành công
                     date_clicked = True
-                    print(f"  ✅ Clicked tab ngày bằng ID: {cgv_date_id}")
-                    time.sleep(2) # Đợi AJAX load lại lịch chiếu
+                    print(f"  ✅ Clicked tab ngày bằng ID: {date_tab_id}")
+                    # Đợi AJAX load lại lịch chiếu
+                    _timed_wait(driver, _schedule_changed(adapter.ready_selector, before), DATE_TAB_TIMEOUT, f"Chờ lịch ngày {display_date}", wait_log)
 
                 except Exception:
                     # Thử các selector dự phòng khác ở đây nếu cần
                     print("  ⚠️ Không tìm thấy tab ngày để click.")
                     # Nếu không tìm thấy tab cho ngày tiếp theo, dừng lại
-                    # vì trang web có thể không hỗ trợ xem nhiều ngày
+                    # vì trang web có thể không hỗ trợ xem nhiều ngày.
+                    # Chỉ coi là "không có lịch chiếu" khi tab thực sự không có trên trang;
+                    # tab có mà click lỗi thì để trống để lần sau scrape lại
+                    if not driver.find_elements(By.ID, date_tab_id):
+                        covered_dates.extend(dates[i:])
                     break
 
             # Lấy HTML hiện tại sau khi đã click (hoặc không)
             soup = BeautifulSoup(driver.page_source, 'html.parser')
-            schedules_for_date = extract_schedules_from_html(soup, date_str)
+            schedules_for_date = adapter.extract_schedules(soup, date_str)
             
             if schedules_for_date:
                 all_schedules.extend(schedules_for_date)
             else:
                 print("  ❌ Không tìm thấy lịch chiếu cho ngày này.")
+            covered_dates.append(date_str)
             
             # Nếu là lần lặp đầu tiên và không có tab nào được click,
             # giả định rằng trang chỉ hiển thị một ngày và dừng lại.
             # Logic này đã được xử lý bằng lệnh `break` ở trên.
         
-        # Gom nhóm lại kết quả cuối cùng
-        final_movies = {}
-        for schedule in all_schedules:
-            title = schedule['title']
-            if title not in final_movies:
-                final_movies[title] = {'dates': {}}
-            
-            date = schedule['date']
-            final_movies[title]['dates'][date] = schedule['showtimes']
-
-        result_list = [{'title': title, **data} for title, data in final_movies.items()]
-
-        print(f"\n🎉 Hoàn thành! Tìm thấy {len(result_list)} phim có lịch chiếu.")
-        return {
-            'status': 'success',
-            'cinema_info': cinema_info,
-            'scrape_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'schedules': result_list
-        }
-    
+        return _success_result(all_schedules, cinema_info, 'selenium', covered_dates, wait_log)
 
     except Exception as e:
         print(f"❌ Lỗi nghiêm trọng trong quá trình scraping: {e}")
         traceback.print_exc()
+        broken = True
         return {
             'status': 'error',
             'message': str(e),
             'cinema_info': cinema_info
         }
     finally:
-        if driver:
-            driver.quit()
-            print("🔒 Đã đóng trình duyệt.")
+        pool.release(driver, broken=broken)
+        print("🔁 Đã trả trình duyệt về pool.")
+
+
+def scrape_cinema_showtimes_live(specific_cinema_url, cinema_info):
+    """
+    Scrape trực tiếp lịch chiếu từ một URL cụ thể của rạp (không qua cache).
+
+    Thử lấy HTML qua HTTP trước (nhanh, không cần trình duyệt); chỉ dùng
+    Selenium khi trang cần JavaScript để hiển thị lịch chiếu.
+
+    Args:
+        specific_cinema_url (str): Link trực tiếp đến trang lịch chiếu của rạp.
+        cinema_info (dict): Thông tin về rạp (tên, địa chỉ,...) để trả về trong kết quả.
+    
+    Returns:
+        dict: Dữ liệu lịch chiếu hoặc thông báo lỗi.
+    """
+    adapter = get_adapter(specific_cinema_url)
+    print(f"\n🚀 Bắt đầu scraping cho: {cinema_info.get('name', specific_cinema_url)} ({adapter.name})")
+    print(f"🔗 URL: {specific_cinema_url}")
+
+    covered_dates = []
+    try:
+        schedules = fetch_showtimes_http(
+            specific_cinema_url, adapter.extract_schedules,
+            days=SCRAPE_DAYS, tab_id_format=adapter.tab_id_format, covered_dates=covered_dates
+        )
+    except Exception as e:
+        print(f"⚠️ Không lấy được lịch chiếu qua HTTP: {e}")
+        schedules = None
+
+    if schedules is not None:
+        print("⚡ Lấy lịch chiếu qua HTTP, không cần trình duyệt.")
+        return _success_result(schedules, cinema_info, 'http', covered_dates)
+
+    print("🌐 Trang cần JavaScript, chuyển sang Selenium.")
+    return _scrape_with_selenium(specific_cinema_url, cinema_info, adapter)
+
+
+showtimes_store = ShowtimesStore(scrape_cinema_showtimes_live, days=SCRAPE_DAYS)
+
+
+def scrape_cinema_showtimes(specific_cinema_url, cinema_info):
+    """
+    Tool chính: Lấy lịch chiếu từ một URL cụ thể của rạp.
+
+    Kết quả được cache theo (URL rạp, ngày) trong thời gian ngắn; các request
+    giống nhau chạy đồng thời chỉ scrape một lần.
+
+    Args:
+        specific_cinema_url (str): Link trực tiếp đến trang lịch chiếu của rạp.
+        cinema_info (dict): Thông tin về rạp (tên, địa chỉ,...) để trả về trong kết quả.
+    
+    Returns:
+        dict: Dữ liệu lịch chiếu hoặc thông báo lỗi.
+    """
+    return showtimes_store.get(specific_cinema_url, cinema_info)
 
 cinema_showtimes_tool = StructuredTool.from_function(
     name="ScrapeCinemaShowtimes",
@@ -200,4 +262,103 @@ cinema_showtimes_tool = StructuredTool.from_function(
         "\n\n"
         "Ví dụ: `ScrapeCinemaShowtimes(specific_cinema_url='https://www.cgv.vn/default/cinox/site/cgv-vincom-center-ba-trieu/', cinema_info={'name': 'CGV Vincom Center Bà Triệu', 'location': 'Hà Nội', 'source_url': 'https://www.cgv.vn/default/cinox/site/cgv-vincom-center-ba-trieu/'})`."
     )
-)
\ No newline at end of file
+)
+
+class CinemaTarget(BaseModel):
+    """Một rạp cần lấy lịch chiếu."""
+    specific_cinema_url: str = Field(description="URL trang lịch chiếu của rạp.")
+    name: str = Field(description="Tên rạp, ví dụ 'CGV Vincom Center Bà Triệu'.")
+    location: Optional[str] = Field(default=None, description="Tỉnh/thành phố hoặc địa chỉ của rạp.")
+
+
+class MultiCinemaInput(BaseModel):
+    """Input cho tool lấy lịch chiếu của nhiều rạp cùng lúc."""
+    cinemas: List[CinemaTarget] = Field(description="Danh sách các rạp cần lấy lịch chiếu.")
+    movie_name: Optional[str] = Field(default=None, description="Chỉ giữ các suất chiếu của phim có tên chứa chuỗi này.")
+    date: Optional[str] = Field(default=None, description="Chỉ giữ các suất chiếu trong ngày này (YYYY-MM-DD).")
+
+
+_DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%Y%m%d')
+
+
+def _parse_date_filter(date):
+    """Chuyển ngày người dùng nhập (YYYY-MM-DD, DD/MM/YYYY, ...) về dạng YYYYMMDD; None nếu không hợp lệ."""
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(date.strip(), fmt).strftime('%Y%m%d')
+        except ValueError:
+            continue
+    return None
+
+
+def scrape_multiple_cinemas(cinemas, movie_name=None, date=None):
+    """
+    Lấy lịch chiếu của nhiều rạp song song và gộp thành một danh sách sắp xếp theo thời gian.
+
+    Args:
+        cinemas (list): Danh sách rạp (dict hoặc CinemaTarget) gồm specific_cinema_url, name, location.
+        movie_name (str): Lọc theo tên phim (không phân biệt hoa thường).
+        date (str): Lọc theo ngày (YYYY-MM-DD).
+
+    Returns:
+        dict: Danh sách suất chiếu đã gộp và lỗi của từng rạp (nếu có).
+    """
+    targets = [c.model_dump() if isinstance(c, BaseModel) else dict(c) for c in cinemas]
+    if not targets:
+        return {'status': 'error', 'message': 'Chưa có rạp nào để lấy lịch chiếu.'}
+
+    date_filter = _parse_date_filter(date) if date else None
+    if date and not date_filter:
+        return {'status': 'error', 'message': f"Ngày '{date}' không hợp lệ, hãy dùng định dạng YYYY-MM-DD."}
+
+    def _scrape(target):
+        url = target['specific_cinema_url']
+        cinema_info = {'name': target.get('name'), 'location': target.get('location'), 'source_url': url}
+        return scrape_cinema_showtimes(url, cinema_info)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(len(targets), MAX_PARALLEL_CINEMAS))) as executor:
+        results = list(executor.map(_scrape, targets))
+
+    movie_filter = movie_name.casefold() if movie_name else None
+    showtimes, errors = [], []
+    for target, result in zip(targets, results):
+        if result.get('status') != 'success':
+            errors.append({'cinema': target.get('name'), 'message': result.get('message')})
+            continue
+        for movie in result['schedules']:
+            if movie_filter and movie_filter not in movie['title'].casefold():
+                continue
+            for date_str, times in movie['dates'].items():
+                if date_filter and date_str != date_filter:
+                    continue
+                for showtime in times:
+                    showtimes.append({
+                        'date': date_str,
+                        'time': showtime,
+                        'title': movie['title'],
+                        'cinema': target.get('name'),
+                        'source_url': target['specific_cinema_url'],
+                    })
+
+    showtimes.sort(key=lambda item: (item['date'], item['time'], item['cinema'] or ''))
+    print(f"\n🎉 Gộp {len(showtimes)} suất chiếu từ {len(targets) - len(errors)}/{len(targets)} rạp.")
+    return {
+        'status': 'success' if len(errors) < len(targets) else 'error',
+        'scrape_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'showtimes': showtimes,
+        'errors': errors,
+    }
+
+
+multi_cinema_showtimes_tool = StructuredTool.from_function(
+    name="ScrapeMultipleCinemaShowtimes",
+    func=scrape_multiple_cinemas,
+    args_schema=MultiCinemaInput,
+    description=(
+        "Dùng để lấy lịch chiếu của NHIỀU rạp cùng lúc (CGV, Lotte, BHD, Galaxy) trong một lần gọi, "
+        "có thể lọc theo tên phim và ngày. Trả về danh sách suất chiếu đã gộp, sắp xếp theo ngày giờ. "
+        "Ưu tiên dùng công cụ này thay vì gọi ScrapeCinemaShowtimes lần lượt cho từng rạp."
+        "\n\n"
+        "Ví dụ: `ScrapeMultipleCinemaShowtimes(cinemas=[{'specific_cinema_url': 'https://www.cgv.vn/default/cinox/site/cgv-vincom-center-ba-trieu/', 'name': 'CGV Vincom Center Bà Triệu', 'location': 'Hà Nội'}], movie_name='Inception', date='2025-07-01')`."
+    )
+)
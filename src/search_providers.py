@@ -0,0 +1,226 @@
+import json
+import os
+import random
+import re
+import threading
+import time
+import unicodedata
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeout
+
+
+def normalize_query(query):
+    """Chuẩn hóa câu truy vấn làm key: NFC, chữ thường, bỏ dấu câu và khoảng trắng thừa."""
+    query = unicodedata.normalize('NFC', query).casefold()
+    query = re.sub(r'[^\w\s:/.-]', ' ', query)
+    return re.sub(r'\s+', ' ', query).strip()
+
+
+class SearchProviderError(Exception):
+    """Lỗi từ một nguồn tìm kiếm (kể cả lỗi giả lập khi load-test)."""
+
+
+class SearchProvider(ABC):
+    """
+    Giao diện chung cho các nguồn tìm kiếm web.
+
+    `search(query)` trả về list các dict có key `title`, `content`, `url`.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    def search(self, query):
+        ...
+
+
+class TavilyProvider(SearchProvider):
+    """Tìm kiếm qua Tavily API; client chỉ được tạo ở lần tìm kiếm đầu tiên."""
+
+    name = "tavily"
+
+    def __init__(self, api_key=None, max_results=5):
+        self.api_key = api_key or os.getenv('TAVILY_API_KEY')
+        self.max_results = max_results
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _get_client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    if not self.api_key:
+                        raise ValueError("TAVILY_API_KEY không tìm thấy trong biến môi trường!")
+                    from langchain_tavily import TavilySearch
+
+                    self._client = TavilySearch(
+                        max_results=self.max_results,
+                        tavily_api_key=self.api_key,
+                        search_type="web",  # Chọn loại tìm kiếm là web
+                        search_engine="google",  # Chọn công cụ tìm kiếm là Google
+                        days=30  # Tìm kiếm trong 30 ngày gần đây
+                    )
+                    print("✅ TavilySearch instance đã được tạo thành công")
+        return self._client
+
+    def search(self, query):
+        results = self._get_client().run(query)
+        if isinstance(results, dict):
+            results = results.get("results", [])
+        if isinstance(results, str):
+            return [{'title': '', 'content': results, 'url': ''}]
+        return [item if isinstance(item, dict) else {'title': '', 'content': str(item), 'url': ''}
+                for item in results or []]
+
+
+def _tokens(text):
+    return set(re.findall(r'\w+', (text or '').casefold()))
+
+
+class FixtureSearchProvider(SearchProvider):
+    """
+    Nguồn tìm kiếm cục bộ, không cần mạng, đọc từ file JSON:
+
+        {"recorded": {"<câu truy vấn>": [{"title", "content", "url"}, ...]},
+         "documents": [{"title", "content", "url"}, ...]}
+
+    Truy vấn khớp với một câu đã ghi lại thì trả về đúng kết quả đó; nếu không,
+    xếp hạng `documents` theo số từ trùng với truy vấn.
+    """
+
+    name = "fixture"
+
+    def __init__(self, file_path=None, recorded=None, documents=None, max_results=5):
+        self.max_results = max_results
+        data = {}
+        if file_path and os.path.exists(file_path):
+            with open(file_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        recorded = {**data.get('recorded', {}), **(recorded or {})}
+        self.recorded = {normalize_query(q): results for q, results in recorded.items()}
+        self.documents = list(data.get('documents', [])) + list(documents or [])
+
+    def search(self, query):
+        key = normalize_query(query)
+        if key in self.recorded:
+            return self.recorded[key][:self.max_results]
+        query_tokens = _tokens(query)
+        scored = []
+        for doc in self.documents:
+            score = len(query_tokens & _tokens(doc.get('title', '') + ' ' + doc.get('content', '')))
+            if score:
+                scored.append((score, doc))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [doc for _, doc in scored[:self.max_results]]
+
+
+class RecordingProvider(SearchProvider):
+    """Bọc một provider thật và ghi lại kết quả vào file fixture để chạy offline sau này."""
+
+    def __init__(self, inner, file_path):
+        self.inner = inner
+        self.file_path = file_path
+        self.name = f"recording({inner.name})"
+        self._lock = threading.Lock()
+
+    def search(self, query):
+        results = self.inner.search(query)
+        with self._lock:
+            data = {}
+            if os.path.exists(self.file_path):
+                with open(self.file_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            data.setdefault('recorded', {})[query] = results
+            os.makedirs(os.path.dirname(self.file_path) or '.', exist_ok=True)
+            with open(self.file_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+        return results
+
+
+class LatencyInjectingProvider(SearchProvider):
+    """Provider giả lập độ trễ (và lỗi ngẫu nhiên) để load-test không cần mạng."""
+
+    def __init__(self, inner, latency=0.5, jitter=0.0, failure_rate=0.0, seed=None):
+        self.inner = inner
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.name = f"latency({inner.name})"
+        self._random = random.Random(seed)
+
+    def search(self, query):
+        time.sleep(max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter)))
+        if self._random.random() < self.failure_rate:
+            raise SearchProviderError(f"Lỗi giả lập từ {self.name}")
+        return self.inner.search(query)
+
+
+class FanOutProvider(SearchProvider):
+    """
+    Gửi truy vấn song song tới nhiều provider và trả về kết quả KHÔNG RỖNG đầu tiên,
+    giúp giảm độ trễ đuôi (tail latency) khi một nguồn chậm hoặc lỗi.
+    """
+
+    def __init__(self, providers, timeout=15.0):
+        self.providers = list(providers)
+        self.timeout = timeout
+        self.name = "fanout(" + ",".join(p.name for p in self.providers) + ")"
+        self._executor = ThreadPoolExecutor(max_workers=max(2, 4 * len(self.providers)), thread_name_prefix="search")
+
+    def search(self, query):
+        futures = {self._executor.submit(p.search, query): p for p in self.providers}
+        errors = []
+        try:
+            for future in as_completed(futures, timeout=self.timeout):
+                try:
+                    results = future.result()
+                except Exception as e:
+                    errors.append(f"{futures[future].name}: {e}")
+                    continue
+                if results:
+                    print(f"🏁 Kết quả đầu tiên từ provider: {futures[future].name}")
+                    return results
+        except FuturesTimeout:
+            raise RuntimeError(f"Hết thời gian chờ {self.timeout}s từ {self.name}")
+        finally:
+            # Không chờ các provider chậm hơn; kết quả của chúng bị bỏ qua
+            for future in futures:
+                future.cancel()
+        if errors and len(errors) >= len(self.providers):
+            raise RuntimeError("; ".join(errors))
+        return []
+
+
+def build_search_provider():
+    """
+    Tạo provider theo biến môi trường:
+
+    - CINEBOT_SEARCH_PROVIDER: danh sách phân tách bằng dấu phẩy, gồm `tavily` và/hoặc
+      `fixture` (mặc định `tavily`); nhiều provider sẽ được chạy song song (fan-out).
+    - CINEBOT_SEARCH_FIXTURES: file JSON cho provider `fixture`.
+    - CINEBOT_SEARCH_LATENCY: độ trễ giả lập (giây) thêm vào mỗi provider.
+    - CINEBOT_SEARCH_RECORD: ghi kết quả Tavily vào file fixture này.
+    """
+    names = [n.strip() for n in os.getenv("CINEBOT_SEARCH_PROVIDER", "tavily").split(",") if n.strip()]
+    fixtures = os.getenv("CINEBOT_SEARCH_FIXTURES", os.path.join("data", "search_fixtures.json"))
+    latency = float(os.getenv("CINEBOT_SEARCH_LATENCY", "0"))
+    record_path = os.getenv("CINEBOT_SEARCH_RECORD")
+
+    providers = []
+    for name in names:
+        if name == "tavily":
+            provider = TavilyProvider()
+            if record_path:
+                provider = RecordingProvider(provider, record_path)
+        elif name == "fixture":
+            provider = FixtureSearchProvider(fixtures)
+        else:
+            raise ValueError(f"Search provider không hợp lệ: {name}")
+        if latency:
+            provider = LatencyInjectingProvider(provider, latency=latency)
+        providers.append(provider)
+
+    if not providers:
+        raise ValueError("CINEBOT_SEARCH_PROVIDER không được để trống")
+    return providers[0] if len(providers) == 1 else FanOutProvider(providers)
@@ -0,0 +1,146 @@
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+from cache_utils import SingleFlight, TTLCache
+
+SHOWTIMES_TTL = int(os.getenv("CINEBOT_SHOWTIMES_TTL", "600"))  # 10 phút
+PRESCRAPE_INTERVAL = int(os.getenv("CINEBOT_PRESCRAPE_INTERVAL", "480"))
+
+
+class ShowtimesStore:
+    """
+    Lưu lịch chiếu đã chuẩn hóa theo key (URL rạp, ngày).
+
+    - Các request giống nhau trong thời hạn TTL được trả về ngay từ cache.
+    - Các request trùng nhau chạy đồng thời chỉ kích hoạt một lần scrape (single-flight).
+    - Có thể chạy nền để scrape trước các rạp phổ biến.
+
+    Args:
+        scrape_func (callable): Hàm (specific_cinema_url, cinema_info) -> dict giống
+            kết quả của `scrape_cinema_showtimes`; key `dates` liệt kê các ngày đã scrape được.
+        days (int): Số ngày lịch chiếu mà mỗi lần scrape trả về.
+        ttl (int): Thời hạn (giây) của mỗi phần tử trong cache.
+    """
+
+    def __init__(self, scrape_func, days, ttl=SHOWTIMES_TTL, max_entries=2048):
+        self.scrape_func = scrape_func
+        self.days = days
+        self.cache = TTLCache(ttl, max_entries=max_entries, name="showtimes")
+        self._flight = SingleFlight()
+        self._refresher = None
+        self._stop = threading.Event()
+
+    @staticmethod
+    def _normalize_url(url):
+        return url.strip().rstrip('/').lower()
+
+    def _dates(self):
+        return [(datetime.now() + timedelta(days=i)).strftime('%Y%m%d') for i in range(self.days)]
+
+    def _store(self, url_key, result):
+        """
+        Tách kết quả scrape theo ngày và lưu từng ngày vào cache.
+
+        Chỉ lưu các ngày scrape thực sự đã lấy được (`result['dates']`); ngày còn thiếu không được
+        cache thành "không có suất chiếu" để `_lookup` trượt và scrape lại.
+        """
+        schedules = result.get('schedules', [])
+        covered = result.get('dates')
+        if covered is None:
+            covered = {date_str for movie in schedules for date_str in movie['dates']}
+        by_date = {date_str: [] for date_str in covered}
+        for movie in schedules:
+            for date_str, showtimes in movie['dates'].items():
+                if date_str in by_date:
+                    by_date[date_str].append({'title': movie['title'], 'showtimes': showtimes})
+        meta = {key: result.get(key) for key in ('scrape_time', 'method')}
+        for date_str, movies in by_date.items():
+            self.cache.set((url_key, date_str), {'movies': movies, **meta})
+
+    def _assemble(self, cached, cinema_info):
+        """Ghép các phần tử theo ngày thành định dạng kết quả của `scrape_cinema_showtimes`."""
+        final_movies = {}
+        for date_str, entry in cached:
+            for movie in entry['movies']:
+                final_movies.setdefault(movie['title'], {'dates': {}})['dates'][date_str] = movie['showtimes']
+        return {
+            'status': 'success',
+            'cinema_info': cinema_info,
+            'scrape_time': min(entry['scrape_time'] for _, entry in cached),
+            'method': 'cache',
+            'schedules': [{'title': title, **data} for title, data in final_movies.items()],
+        }
+
+    def _lookup(self, url_key, cinema_info):
+        cached = []
+        for date_str in self._dates():
+            entry = self.cache.get((url_key, date_str))
+            if entry is None:
+                return None
+            cached.append((date_str, entry))
+        return self._assemble(cached, cinema_info)
+
+    def refresh(self, specific_cinema_url, cinema_info):
+        """Scrape lại (dùng single-flight) và cập nhật cache; trả về kết quả scrape."""
+        url_key = self._normalize_url(specific_cinema_url)
+
+        def _scrape():
+            result = self.scrape_func(specific_cinema_url, cinema_info)
+            if result.get('status') == 'success':
+                self._store(url_key, result)
+            return result
+
+        return self._flight.do(url_key, _scrape)
+
+    def get(self, specific_cinema_url, cinema_info):
+        url_key = self._normalize_url(specific_cinema_url)
+        cached = self._lookup(url_key, cinema_info)
+        if cached is not None:
+            print(f"⚡ Lịch chiếu lấy từ cache: {cinema_info.get('name', specific_cinema_url)}")
+            return cached
+        result = self.refresh(specific_cinema_url, cinema_info)
+        if result.get('status') == 'success':
+            # Trả về cinema_info của người gọi (có thể khác với lời gọi dẫn đầu single-flight)
+            result = {**result, 'cinema_info': cinema_info}
+        return result
+
+    def start_background_refresh(self, cinemas, interval=PRESCRAPE_INTERVAL):
+        """
+        Định kỳ scrape trước các rạp phổ biến để cache luôn còn hạn.
+
+        Args:
+            cinemas (list): Danh sách dict gồm `specific_cinema_url` và `name`/`location`.
+            interval (int): Số giây giữa hai lượt scrape (nên nhỏ hơn TTL).
+        """
+        if self._refresher and self._refresher.is_alive():
+            return self._refresher
+
+        def _loop():
+            while not self._stop.is_set():
+                for cinema in cinemas:
+                    if self._stop.is_set():
+                        break
+                    url = cinema['specific_cinema_url']
+                    cinema_info = {'name': cinema.get('name'), 'location': cinema.get('location'), 'source_url': url}
+                    try:
+                        self.refresh(url, cinema_info)
+                    except Exception as e:
+                        print(f"⚠️ Lỗi khi scrape trước {cinema.get('name', url)}: {e}")
+                self._stop.wait(interval)
+
+        self._stop.clear()
+        self._refresher = threading.Thread(target=_loop, name="showtimes-prescrape", daemon=True)
+        self._refresher.start()
+        print(f"🔄 Bắt đầu scrape nền {len(cinemas)} rạp phổ biến mỗi {interval}s.")
+        return self._refresher
+
+    def stop_background_refresh(self):
+        self._stop.set()
+
+
+def load_popular_cinemas(file_path):
+    """Đọc danh sách rạp phổ biến từ file JSON (list các dict `specific_cinema_url`, `name`, `location`)."""
+    with open(file_path, "r", encoding="utf-8") as f:
+        return json.load(f)
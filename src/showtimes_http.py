@@ -0,0 +1,215 @@
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urljoin
+
+import requests
+from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+HTTP_TIMEOUT = 8
+FIXTURES_DIR = os.getenv("SHOWTIMES_FIXTURES_DIR", "data/fixtures/showtimes")
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept-Language': 'vi-VN,vi;q=0.9,en;q=0.8',
+}
+
+# Các key thường chứa đoạn HTML khi endpoint AJAX trả về JSON
+_JSON_HTML_KEYS = ('html', 'content', 'data', 'result')
+_QUOTED_URL_RE = re.compile(r"""['"]((?:https?://|/)[^'"\s]+)['"]""")
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_http_session():
+    """Session HTTP dùng chung với connection pool và retry nhẹ."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                retry = Retry(total=2, backoff_factor=0.2, status_forcelist=(502, 503, 504))
+                adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=retry)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers.update(HEADERS)
+                _session = session
+    return _session
+
+
+def http_fetch(url):
+    """Tải một URL qua session dùng chung, trả về nội dung dạng text."""
+    response = get_http_session().get(url, timeout=HTTP_TIMEOUT)
+    response.raise_for_status()
+    return response.text
+
+
+def _to_soup(text):
+    """Chuyển phản hồi (HTML hoặc JSON bọc HTML) thành BeautifulSoup."""
+    stripped = text.lstrip()
+    if stripped.startswith('{') or stripped.startswith('['):
+        try:
+            payload = json.loads(stripped)
+        except ValueError:
+            payload = None
+        if isinstance(payload, dict):
+            for key in _JSON_HTML_KEYS:
+                if isinstance(payload.get(key), str):
+                    return BeautifulSoup(payload[key], 'html.parser')
+    return BeautifulSoup(text, 'html.parser')
+
+
+def find_date_fragment_url(soup, tab_id, base_url):
+    """
+    Tìm URL của fragment lịch chiếu phía sau một tab ngày (ví dụ `cgv20250701`).
+
+    Thử lần lượt các thuộc tính data-url / data-href / href rồi URL nằm trong onclick,
+    chỉ trên chính tab và các link bên trong nó (URL của khối cha thuộc về cả dãy tab,
+    không phải ngày này). Trả về None nếu tab chỉ hoạt động bằng JavaScript.
+    """
+    tab = soup.find(id=tab_id)
+    if tab is None:
+        return None
+    candidates = [tab] + tab.find_all('a')
+    for elem in candidates:
+        for attr in ('data-url', 'data-href', 'href'):
+            value = elem.get(attr)
+            if value and not value.startswith(('#', 'javascript:')):
+                return urljoin(base_url, value)
+        onclick = elem.get('onclick') or ''
+        match = _QUOTED_URL_RE.search(onclick)
+        if match:
+            return urljoin(base_url, match.group(1))
+    return None
+
+
+def fetch_showtimes_http(specific_cinema_url, extract_schedules, days=2, fetch=None, tab_id_format="cgv{date}",
+                         start_date=None, covered_dates=None):
+    """
+    Lấy lịch chiếu chỉ bằng HTTP, không cần trình duyệt.
+
+    Args:
+        specific_cinema_url (str): URL trang lịch chiếu của rạp.
+        extract_schedules (callable): Hàm (soup, date_str) -> list lịch chiếu.
+        days (int): Số ngày cần lấy, tính từ hôm nay.
+        fetch (callable): Hàm url -> text; mặc định dùng session HTTP chung
+            (có thể thay bằng hàm đọc fixture HTML/JSON đã lưu khi test offline).
+        tab_id_format (str | None): Mẫu ID của tab ngày; None nếu trang không có tab ngày.
+        start_date (datetime | None): Ngày bắt đầu; mặc định là hôm nay (fixture dùng ngày cố định).
+        covered_dates (list | None): Nếu có, được thêm các ngày (YYYYMMDD) đã biết chắc lịch chiếu:
+            ngày đã đọc được, và các ngày trang không cung cấp (không có tab ngày).
+
+    Returns:
+        list | None: Danh sách lịch chiếu, hoặc None nếu trang (hay tab của một ngày cần lấy)
+        cần JavaScript (khi đó nên dùng Selenium).
+    """
+    fetch = fetch or http_fetch
+    page_soup = _to_soup(fetch(specific_cinema_url))
+
+    start_date = start_date or datetime.now()
+    dates = [(start_date + timedelta(days=i)).strftime('%Y%m%d') for i in range(days)]
+    fragment_urls = {}
+    if tab_id_format:
+        for date_str in dates:
+            fragment_urls[date_str] = find_date_fragment_url(page_soup, tab_id_format.format(date=date_str), specific_cinema_url)
+
+    # Tải song song các fragment theo ngày
+    pending = [url for url in fragment_urls.values() if url]
+    with ThreadPoolExecutor(max_workers=max(1, min(len(pending), 4))) as executor:
+        fragments = dict(zip(pending, executor.map(fetch, pending)))
+
+    all_schedules = []
+    for i, date_str in enumerate(dates):
+        fragment_url = fragment_urls.get(date_str)
+        if fragment_url:
+            soup = _to_soup(fragments[fragment_url])
+        elif i == 0:
+            soup = page_soup
+        elif tab_id_format and page_soup.find(id=tab_id_format.format(date=date_str)) is not None:
+            # Tab ngày có trên trang nhưng chỉ mở được bằng JavaScript: trả về None để dùng
+            # Selenium thay vì âm thầm bỏ mất ngày này
+            return None
+        else:
+            # Trang không cung cấp ngày này (và các ngày sau): không có lịch chiếu để lấy
+            if covered_dates is not None:
+                covered_dates.extend(dates[i:])
+            break
+
+        schedules_for_date = extract_schedules(soup, date_str)
+        if i == 0 and not schedules_for_date and not fragment_url:
+            # Trang gốc không có lịch chiếu trong HTML tĩnh -> cần render JS
+            return None
+        all_schedules.extend(schedules_for_date)
+        if covered_dates is not None:
+            covered_dates.append(date_str)
+
+    return all_schedules
+
+
+def _fixture_fetcher(fixtures_dir, responses):
+    """Hàm fetch đọc phản hồi đã lưu; URL không có trong fixture là lỗi (không gọi mạng)."""
+    def fetch(url):
+        if url not in responses:
+            raise KeyError(f"URL không có trong fixture: {url}")
+        with open(os.path.join(fixtures_dir, responses[url]), encoding='utf-8') as f:
+            return f.read()
+    return fetch
+
+
+def check_fixtures(fixtures_dir=FIXTURES_DIR):
+    """
+    Chạy đường HTTP trên các trang HTML/JSON đã lưu và so với kết quả mong đợi.
+
+    Returns:
+        bool: True nếu mọi case đều khớp.
+    """
+    from cinema_adapters import get_adapter
+
+    with open(os.path.join(fixtures_dir, 'fixtures.json'), encoding='utf-8') as f:
+        cases = json.load(f)['cases']
+
+    ok = True
+    for case in cases:
+        adapter = get_adapter(case['url'])
+        try:
+            result = fetch_showtimes_http(
+                case['url'],
+                adapter.extract_schedules,
+                days=case.get('days', 2),
+                fetch=_fixture_fetcher(fixtures_dir, case['responses']),
+                tab_id_format=adapter.tab_id_format,
+                start_date=datetime.strptime(case['start_date'], '%Y-%m-%d'),
+            )
+        except Exception as e:
+            result = f"lỗi: {e}"
+        if result == case['expected']:
+            print(f"✅ {case['name']}")
+        else:
+            ok = False
+            print(f"❌ {case['name']}")
+            print(f"   Mong đợi: {case['expected']}")
+            print(f"   Nhận được: {result}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lấy lịch chiếu qua HTTP (không cần trình duyệt)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    check_parser = subparsers.add_parser("check", help="Kiểm tra offline trên các fixture HTML/JSON đã lưu")
+    check_parser.add_argument("--fixtures", default=FIXTURES_DIR, help="Thư mục chứa fixtures.json")
+    args = parser.parse_args()
+
+    if args.command == "check":
+        if not check_fixtures(args.fixtures):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
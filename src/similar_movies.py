@@ -0,0 +1,278 @@
+"""
+Gợi ý phim tương tự từ đồ thị láng giềng (kNN) tính trước trên các vector của build_index.py.
+
+Ví dụ:
+    python src/similar_movies.py build                  # vector_db -> data/similar_movies.npz
+    python src/similar_movies.py build --alpha 0.7 --k 20
+    python src/similar_movies.py query "Inception"
+"""
+import argparse
+import os
+import re
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+from langchain.tools import StructuredTool
+from pydantic import BaseModel, Field
+
+from cinema_geo_index import DATA_DIR, normalize_vn_text
+from movie_chunker import movie_parent_id
+
+SIMILAR_INDEX_FILE = os.getenv("CINEBOT_SIMILAR_INDEX", os.path.join(DATA_DIR, "similar_movies.npz"))
+VECTOR_DB_DIR = "vector_db"
+COLLECTION_NAME = "movies"
+NEIGHBOURS = 20          # Số láng giềng lưu cho mỗi phim
+CANDIDATES = 50          # Số ứng viên theo cosine trước khi trộn điểm metadata
+ALPHA = 0.8              # Trọng số của độ tương đồng vector; phần còn lại cho metadata
+BLOCK_ROWS = 1024        # Số phim tính cosine mỗi lần (giới hạn bộ nhớ ma trận tương đồng)
+READ_BATCH = 5000
+
+# Trọng số các thành phần metadata trong điểm trùng lặp (tổng = 1)
+OVERLAP_WEIGHTS = {"genre": 0.5, "director": 0.3, "cast": 0.2}
+_LIST_SPLIT = re.compile(r"\s*(?:,|/|;|\||&|\band\b)\s*")
+
+
+def _tokens(value):
+    if not value or value == "Unknown":
+        return frozenset()
+    return frozenset(t for t in (normalize_vn_text(p) for p in _LIST_SPLIT.split(str(value))) if t)
+
+
+def _jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def load_movie_vectors(db_dir=VECTOR_DB_DIR, collection_name=COLLECTION_NAME):
+    """
+    Đọc mọi chunk trong Chroma và gộp thành một vector cho mỗi phim (trung bình các chunk, chuẩn hóa L2).
+
+    Returns:
+        tuple[np.ndarray, list[dict]]: ma trận (số phim, số chiều) float32 và metadata của từng phim.
+    """
+    import chromadb
+
+    collection = chromadb.PersistentClient(path=db_dir).get_collection(collection_name)
+    total = collection.count()
+    sums, counts, movies = {}, {}, {}
+    for offset in range(0, total, READ_BATCH):
+        page = collection.get(include=["embeddings", "metadatas"], limit=READ_BATCH, offset=offset)
+        for vector, metadata in zip(page["embeddings"], page["metadatas"]):
+            metadata = metadata or {}
+            # Index cũ (trước movie_chunker) không có parent_id
+            key = metadata.get("parent_id") or movie_parent_id(metadata.get("title", ""), metadata.get("release_year"))
+            vector = np.asarray(vector, dtype=np.float32)
+            if key in sums:
+                sums[key] += vector
+                counts[key] += 1
+            else:
+                sums[key] = vector.copy()
+                counts[key] = 1
+                movies[key] = metadata
+        print(f"📥 Đã đọc {min(offset + READ_BATCH, total)}/{total} chunks")
+
+    keys = list(sums)
+    vectors = np.stack([sums[k] / counts[k] for k in keys]) if keys else np.zeros((0, 0), dtype=np.float32)
+    vectors /= np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+    return vectors, [movies[k] for k in keys]
+
+
+def build_neighbour_graph(vectors, metadatas, k=NEIGHBOURS, candidates=CANDIDATES, alpha=ALPHA):
+    """
+    Với mỗi phim: lấy `candidates` phim gần nhất theo cosine, trộn điểm
+    `alpha * cosine + (1 - alpha) * trùng lặp (thể loại, đạo diễn, diễn viên)` rồi giữ `k` phim tốt nhất.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: chỉ số láng giềng (int32) và điểm (float16), cùng kích thước (số phim, k).
+    """
+    n = len(vectors)
+    k = min(k, max(n - 1, 0))
+    candidates = min(max(candidates, k), max(n - 1, 0))
+    neighbours = np.full((n, k), -1, dtype=np.int32)
+    scores = np.zeros((n, k), dtype=np.float16)
+    if n < 2 or k == 0:
+        return neighbours, scores
+
+    features = [{name: _tokens(m.get(name)) for name in OVERLAP_WEIGHTS} for m in metadatas]
+    for start in range(0, n, BLOCK_ROWS):
+        block = vectors[start:start + BLOCK_ROWS] @ vectors.T
+        rows = np.arange(block.shape[0])
+        block[rows, rows + start] = -np.inf  # Bỏ chính phim đó
+        top = np.argpartition(-block, candidates - 1, axis=1)[:, :candidates]
+        for row, cand in enumerate(top):
+            i = start + row
+            cosine = block[row, cand]
+            if alpha < 1.0:
+                overlap = np.array([
+                    sum(w * _jaccard(features[i][name], features[j][name]) for name, w in OVERLAP_WEIGHTS.items())
+                    for j in cand
+                ], dtype=np.float32)
+                blended = alpha * cosine + (1.0 - alpha) * overlap
+            else:
+                blended = cosine
+            best = np.argsort(-blended)[:k]
+            neighbours[i] = cand[best]
+            scores[i] = blended[best]
+        print(f"🔗 Đã tính láng giềng cho {min(start + BLOCK_ROWS, n)}/{n} phim")
+    return neighbours, scores
+
+
+def save_index(path, neighbours, scores, metadatas, alpha=ALPHA):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    field = lambda name: np.array([str(m.get(name) or "Unknown") for m in metadatas])
+    tmp_path = path + ".tmp.npz"
+    np.savez_compressed(
+        tmp_path,
+        neighbours=neighbours,
+        scores=scores,
+        titles=field("title"),
+        years=field("release_year"),
+        genres=field("genre"),
+        directors=field("director"),
+        alpha=np.float32(alpha),
+    )
+    os.replace(tmp_path, path)
+
+
+class SimilarMovieIndex:
+    """Tra cứu phim tương tự: tìm chỉ số phim theo tên rồi đọc hàng tương ứng của đồ thị láng giềng."""
+
+    def __init__(self, path=SIMILAR_INDEX_FILE):
+        with np.load(path) as data:
+            self.neighbours = data["neighbours"]
+            self.scores = data["scores"]
+            self.titles = data["titles"].tolist()
+            self.years = data["years"].tolist()
+            self.genres = data["genres"].tolist()
+            self.directors = data["directors"].tolist()
+        self._by_title = {}
+        for i, title in enumerate(self.titles):
+            self._by_title.setdefault(normalize_vn_text(title), []).append(i)
+        print(f"✅ Đã nạp đồ thị phim tương tự: {len(self.titles)} phim, {self.neighbours.shape[1]} láng giềng/phim")
+
+    def __len__(self):
+        return len(self.titles)
+
+    def find(self, title, year=None):
+        """Chỉ số của phim khớp tên (ưu tiên khớp chính xác và đúng năm), None nếu không thấy."""
+        key = normalize_vn_text(title)
+        matches = self._by_title.get(key)
+        if not matches:
+            matches = [i for t, idx in self._by_title.items() if key and key in t for i in idx]
+            matches.sort(key=lambda i: len(self.titles[i]))
+        if not matches:
+            return None
+        if year:
+            same_year = [i for i in matches if self.years[i] == str(year)]
+            matches = same_year or matches
+        return matches[0]
+
+    def similar(self, title, year=None, limit=5):
+        index = self.find(title, year)
+        if index is None:
+            return None, []
+        result = []
+        for j, score in zip(self.neighbours[index], self.scores[index]):
+            if j < 0:
+                break
+            result.append({
+                "title": self.titles[j],
+                "release_year": self.years[j],
+                "genre": self.genres[j],
+                "director": self.directors[j],
+                "score": round(float(score), 3),
+            })
+            if len(result) >= limit:
+                break
+        return index, result
+
+
+_similar_index = None
+_similar_index_lock = threading.Lock()
+
+
+def get_similar_index():
+    """Đồ thị phim tương tự dùng chung, hoặc None nếu chưa chạy `python src/similar_movies.py build`."""
+    global _similar_index
+    if _similar_index is None and os.path.exists(SIMILAR_INDEX_FILE):
+        with _similar_index_lock:
+            if _similar_index is None:
+                _similar_index = SimilarMovieIndex(SIMILAR_INDEX_FILE)
+    return _similar_index
+
+
+def set_similar_index(index):
+    """Thay đồ thị phim tương tự dùng chung (ví dụ nạp từ snapshot của warm_state.py)."""
+    global _similar_index
+    with _similar_index_lock:
+        _similar_index = index
+
+
+class SimilarMovieInput(BaseModel):
+    title: str = Field(description="Tên phim gốc (tên gốc tiếng Anh nếu có), ví dụ 'Inception'.")
+    release_year: Optional[int] = Field(default=None, description="Năm phát hành để phân biệt các phim trùng tên.")
+    limit: int = Field(default=5, description="Số phim gợi ý (tối đa 20).")
+
+
+def find_similar_movies(title, release_year=None, limit=5):
+    """
+    Gợi ý các phim giống một bộ phim trong cơ sở dữ liệu nội bộ (tra đồ thị láng giềng tính trước).
+
+    Returns:
+        str: Danh sách phim tương tự hoặc thông báo không tìm thấy.
+    """
+    index = get_similar_index()
+    if index is None:
+        return "Chưa có dữ liệu phim tương tự. Hãy dùng movie_database_search để tìm phim cùng thể loại."
+    movie, similar = index.similar(title, release_year, limit=max(1, min(limit, 20)))
+    if movie is None:
+        return f"Không tìm thấy phim '{title}' trong cơ sở dữ liệu nội bộ. Hãy thử tmdb_movie_search hoặc web search."
+    lines = [f"Các phim giống {index.titles[movie]} ({index.years[movie]}):"]
+    for item in similar:
+        lines.append(f"- {item['title']} ({item['release_year']}) - Thể loại: {item['genre']}, "
+                     f"Đạo diễn: {item['director']} (độ tương đồng {item['score']})")
+    return "\n".join(lines)
+
+
+movie_similar_tool = StructuredTool.from_function(
+    name="movie_similar",
+    func=find_similar_movies,
+    args_schema=SimilarMovieInput,
+    description=(
+        "Gợi ý các phim GIỐNG một bộ phim cụ thể (ví dụ 'phim giống Inception', 'phim tương tự Titanic'). "
+        "Tra cứu tức thì từ cơ sở dữ liệu phim nội bộ, dựa trên nội dung cốt truyện, thể loại, đạo diễn và diễn viên."
+    )
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đồ thị phim tương tự cho CineBot")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build_cmd = sub.add_parser("build", help="Tính đồ thị kNN từ vector_db")
+    build_cmd.add_argument("--db", default=VECTOR_DB_DIR)
+    build_cmd.add_argument("--out", default=SIMILAR_INDEX_FILE)
+    build_cmd.add_argument("--k", type=int, default=NEIGHBOURS)
+    build_cmd.add_argument("--candidates", type=int, default=CANDIDATES)
+    build_cmd.add_argument("--alpha", type=float, default=ALPHA, help="1.0 = chỉ dùng vector, không trộn metadata")
+    query_cmd = sub.add_parser("query", help="Thử tra cứu phim tương tự")
+    query_cmd.add_argument("title")
+    query_cmd.add_argument("--year", type=int)
+    query_cmd.add_argument("--limit", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        started = time.perf_counter()
+        vectors, metadatas = load_movie_vectors(args.db)
+        neighbours, scores = build_neighbour_graph(vectors, metadatas, args.k, args.candidates, args.alpha)
+        save_index(args.out, neighbours, scores, metadatas, args.alpha)
+        size_mb = os.path.getsize(args.out) / 1024 / 1024
+        print(f"✅ Đã ghi {args.out} ({len(metadatas)} phim, {size_mb:.1f} MB) trong {time.perf_counter() - started:.1f}s")
+    else:
+        print(find_similar_movies(args.title, args.year, args.limit))
+
+
+if __name__ == "__main__":
+    main()
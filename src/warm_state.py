@@ -0,0 +1,295 @@
+"""
+Snapshot trạng thái "ấm" của engine để một replica mới phục vụ được ngay sau vài giây khởi động.
+
+Một snapshot là một thư mục gồm:
+- manifest.json: thời điểm tạo, backend embedding, số phần tử của từng cache.
+- caches.json: các phần tử còn hạn của cache web search, lịch chiếu, geocoding/Overpass và điểm re-rank.
+- query_embeddings.npz: embedding của các truy vấn đã gặp (không phải chạy lại tokenizer + encoder).
+- data/: đồ thị phim tương tự, chỉ mục rạp và gazetteer.
+- models/: bản sao cục bộ của encoder (ONNX hoặc sentence-transformers) và cross-encoder.
+
+Ví dụ:
+    python src/warm_state.py export                # model + chỉ mục + cache đã lưu trên đĩa (geo cache)
+    python src/warm_state.py export --no-models
+    python src/warm_state.py show
+    curl -X POST localhost:8000/snapshot           # từ API đang chạy, kèm mọi cache trong bộ nhớ
+
+Replica mới tự nạp snapshot trong CINEBOT_SNAPSHOT_DIR (mặc định `snapshot/`) nếu thư mục tồn tại.
+
+Mỗi lần export ghi một thư mục mới `snapshot-<thời điểm>-<id>/` rồi đổi symlink `snapshot` sang đó
+(một thao tác rename nguyên tử), nên replica đang đọc không bao giờ thấy snapshot ghi dở.
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import numpy as np
+
+from cinema_geo_index import CINEMAS_CSV, GAZETTEER_CSV, CinemaGeoIndex, Gazetteer, set_geo_indexes
+from geocode_cache import get_geo_cache
+from onnx_encoder import (EMBEDDING_BACKEND, EMBEDDING_MODEL, FP32_FILE, INT8_FILE, ONNX_DIR, ONNX_QUANTIZED,
+                          query_embedding_cache)
+from reranker import RERANKER_MODEL, get_reranker
+from scrape_cinema_showtimes import showtimes_store
+from similar_movies import SIMILAR_INDEX_FILE, SimilarMovieIndex, set_similar_index
+from web_search_agent import search_cache
+
+SNAPSHOT_DIR = os.getenv("CINEBOT_SNAPSHOT_DIR", "snapshot")
+SNAPSHOT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+CACHES_FILE = "caches.json"
+QUERY_EMBEDDINGS_FILE = "query_embeddings.npz"
+EMBEDDING_MODEL_DIR = os.path.join("models", "embedding")
+RERANKER_MODEL_DIR = os.path.join("models", "reranker")
+KEEP_VERSIONS = 2  # Giữ thêm bản trước để replica đang nạp bản đó không bị xóa mất file
+DATA_FILES = {
+    "similar_movies": SIMILAR_INDEX_FILE,
+    "cinemas": CINEMAS_CSV,
+    "gazetteer": GAZETTEER_CSV,
+}
+
+
+_export_lock = threading.Lock()
+
+
+def _caches(reranker=None):
+    """Các TTLCache được lưu vào snapshot, theo tên."""
+    geo_cache = get_geo_cache()
+    caches = {
+        "web_search": search_cache,
+        "showtimes": showtimes_store.cache,
+        "geocode": geo_cache.geocode,
+        "overpass": geo_cache.overpass,
+    }
+    if reranker is not None:
+        caches["rerank_scores"] = reranker.scores
+    return caches
+
+
+def _export_models(out_dir, reranker=None, embedding_model=None):
+    """
+    Chép model đang được tiến trình dùng vào `out_dir/models`; trả về đường dẫn tương đối của từng model.
+
+    `embedding_model` là model engine đã nạp (có thể từ một snapshot trước), nên replica khởi động
+    từ snapshot vẫn export lại được mà không cần ONNX_DIR hay HF hub.
+    """
+    models = {}
+    embedding_dir = os.path.join(out_dir, EMBEDDING_MODEL_DIR)
+    inner = getattr(embedding_model, "inner", embedding_model)
+    if EMBEDDING_BACKEND == "onnx":
+        # Chỉ chép file model đang dùng (int8 hoặc fp32) và các file tokenizer
+        source_dir = os.path.dirname(inner.encoder.model_file) if inner is not None else ONNX_DIR
+        unused = FP32_FILE if ONNX_QUANTIZED else INT8_FILE
+        shutil.copytree(source_dir, embedding_dir, ignore=shutil.ignore_patterns(unused))
+    elif inner is not None:
+        # HuggingFaceEmbeddings giữ SentenceTransformer đã nạp trong `_client` (langchain_huggingface)
+        # hoặc `client` (langchain_community); nếu không có, tải lại theo tên model đang dùng
+        client = getattr(inner, "_client", None) or getattr(inner, "client", None)
+        if client is None:
+            from sentence_transformers import SentenceTransformer
+
+            client = SentenceTransformer(inner.model_name, device="cpu")
+        client.save(embedding_dir)
+    else:
+        from sentence_transformers import SentenceTransformer
+
+        SentenceTransformer(EMBEDDING_MODEL, device="cpu").save(embedding_dir)
+    models["embedding"] = EMBEDDING_MODEL_DIR
+    print(f"📦 Đã chép encoder ({EMBEDDING_BACKEND}) vào {embedding_dir}")
+
+    if reranker is not None:
+        reranker.save_model(os.path.join(out_dir, RERANKER_MODEL_DIR))
+        models["reranker"] = RERANKER_MODEL_DIR
+        print(f"📦 Đã chép cross-encoder {RERANKER_MODEL}")
+    return models
+
+
+def _export_query_embeddings(path):
+    entries = query_embedding_cache.export()
+    if not entries:
+        return 0
+    np.savez(
+        path,
+        queries=np.array([key for key, _, _ in entries]),
+        expires_at=np.array([expires_at for _, expires_at, _ in entries], dtype=np.float64),
+        vectors=np.array([vector for _, _, vector in entries], dtype=np.float32),
+    )
+    return len(entries)
+
+
+def _publish(version_dir, snapshot_dir):
+    """Đổi symlink `snapshot_dir` sang `version_dir` bằng os.replace (nguyên tử) và dọn các bản cũ."""
+    link_tmp = f"{snapshot_dir}.link-{uuid.uuid4().hex[:8]}"
+    os.symlink(os.path.basename(version_dir), link_tmp)
+    if os.path.isdir(snapshot_dir) and not os.path.islink(snapshot_dir):
+        shutil.rmtree(snapshot_dir)  # Snapshot dạng thư mục thật từ phiên bản cũ
+    os.replace(link_tmp, snapshot_dir)
+
+    current = os.path.realpath(snapshot_dir)
+    versions = sorted((path for path in glob.glob(f"{snapshot_dir}-*")
+                       if os.path.isdir(path) and os.path.realpath(path) != current), key=os.path.getmtime)
+    for old in versions[:-(KEEP_VERSIONS - 1) or None]:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+def export_snapshot(snapshot_dir=SNAPSHOT_DIR, reranker=None, embedding_model=None, include_models=True):
+    """
+    Ghi snapshot trạng thái hiện tại của tiến trình vào `snapshot_dir`.
+
+    Snapshot được ghi vào thư mục tạm riêng của lần export này rồi mới được công bố (xem `_publish`);
+    các lần export đồng thời trong tiến trình chạy lần lượt.
+
+    Args:
+        reranker: CrossEncoderReranker đang dùng (để lưu điểm đã chấm và model); None nếu tắt re-rank.
+        embedding_model: Embedding model engine đang dùng; None thì nạp theo cấu hình (ONNX_DIR / HF hub).
+        include_models: Chép cả model vào snapshot (chậm hơn, nhưng replica không cần HF hub / ONNX_DIR).
+
+    Returns:
+        dict: Nội dung manifest.json.
+    """
+    with _export_lock:
+        return _export_snapshot(snapshot_dir.rstrip("/\\"), reranker, embedding_model, include_models)
+
+
+def _export_snapshot(snapshot_dir, reranker, embedding_model, include_models):
+    started = time.perf_counter()
+    tmp_dir = f"{snapshot_dir}.tmp-{uuid.uuid4().hex[:8]}"
+    os.makedirs(os.path.join(tmp_dir, "data"))
+
+    caches = {name: cache.export() for name, cache in _caches(reranker).items()}
+    with open(os.path.join(tmp_dir, CACHES_FILE), "w", encoding="utf-8") as f:
+        json.dump(caches, f, ensure_ascii=False)
+    query_count = _export_query_embeddings(os.path.join(tmp_dir, QUERY_EMBEDDINGS_FILE))
+
+    data = {}
+    for name, source in DATA_FILES.items():
+        if os.path.exists(source):
+            data[name] = os.path.join("data", os.path.basename(source))
+            shutil.copy2(source, os.path.join(tmp_dir, data[name]))
+
+    manifest = {
+        "version": SNAPSHOT_VERSION,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "embedding_backend": EMBEDDING_BACKEND,
+        "onnx_quantized": ONNX_QUANTIZED,
+        # Tên model theo cấu hình (không phải đường dẫn đã nạp) để replica sau so khớp với CINEBOT_RERANKER
+        "reranker": RERANKER_MODEL if reranker is not None else None,
+        "models": _export_models(tmp_dir, reranker, embedding_model) if include_models else {},
+        "data": data,
+        "caches": {name: len(entries) for name, entries in caches.items()},
+        "query_embeddings": query_count,
+    }
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    version_dir = f"{snapshot_dir}-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{uuid.uuid4().hex[:6]}"
+    os.replace(tmp_dir, version_dir)
+    _publish(version_dir, snapshot_dir)
+    print(f"✅ Đã ghi snapshot vào {snapshot_dir} trong {time.perf_counter() - started:.1f}s: "
+          f"{sum(manifest['caches'].values())} phần tử cache, {query_count} embedding truy vấn")
+    return manifest
+
+
+class WarmState:
+    """Snapshot đã đọc manifest; `restore()` nạp cache và chỉ mục vào các đối tượng dùng chung của tiến trình."""
+
+    def __init__(self, snapshot_dir, manifest):
+        self.snapshot_dir = snapshot_dir
+        self.manifest = manifest
+
+    def _path(self, relative):
+        return os.path.join(self.snapshot_dir, relative) if relative else None
+
+    @property
+    def same_encoder(self):
+        """Snapshot được tạo với cùng backend/lượng tử hóa encoder như cấu hình hiện tại."""
+        return (self.manifest.get("embedding_backend") == EMBEDDING_BACKEND
+                and (EMBEDDING_BACKEND != "onnx" or self.manifest.get("onnx_quantized") == ONNX_QUANTIZED))
+
+    @property
+    def embedding_path(self):
+        """Thư mục encoder trong snapshot, None nếu không có hoặc khác encoder đang cấu hình."""
+        if not self.same_encoder:
+            return None
+        return self._path(self.manifest.get("models", {}).get("embedding"))
+
+    @property
+    def reranker_path(self):
+        if self.manifest.get("reranker") != RERANKER_MODEL:
+            return None
+        return self._path(self.manifest.get("models", {}).get("reranker"))
+
+    def restore(self, reranker=None):
+        """Nạp cache, embedding truy vấn, đồ thị phim tương tự và chỉ mục rạp từ snapshot."""
+        started = time.perf_counter()
+        caches_file = os.path.join(self.snapshot_dir, CACHES_FILE)
+        if os.path.exists(caches_file):
+            with open(caches_file, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            for name, cache in _caches(reranker).items():
+                cache.load(saved.get(name, []))
+
+        embeddings_file = os.path.join(self.snapshot_dir, QUERY_EMBEDDINGS_FILE)
+        # Vector của encoder khác (hoặc bản int8/fp32 khác) không dùng chung được
+        if self.same_encoder and os.path.exists(embeddings_file):
+            with np.load(embeddings_file) as data:
+                query_embedding_cache.load([[query, float(expires_at), vector.tolist()] for query, expires_at, vector
+                                            in zip(data["queries"].tolist(), data["expires_at"], data["vectors"])])
+
+        data = self.manifest.get("data", {})
+        if data.get("similar_movies"):
+            set_similar_index(SimilarMovieIndex(self._path(data["similar_movies"])))
+        set_geo_indexes(
+            cinema_index=CinemaGeoIndex.from_csv(self._path(data["cinemas"])) if data.get("cinemas") else None,
+            gazetteer=Gazetteer.from_csv(self._path(data["gazetteer"])) if data.get("gazetteer") else None,
+        )
+        print(f"✅ Đã nạp snapshot {self.snapshot_dir} ({self.manifest.get('created_at')}) "
+              f"trong {time.perf_counter() - started:.2f}s: "
+              + ", ".join(f"{name}={len(cache)}" for name, cache in _caches(reranker).items())
+              + f", query_embeddings={len(query_embedding_cache)}")
+
+
+def load_snapshot(snapshot_dir=SNAPSHOT_DIR):
+    """WarmState của snapshot trong `snapshot_dir`, hoặc None nếu chưa có snapshot hợp lệ."""
+    # Giữ đường dẫn thật của phiên bản hiện tại để export đồng thời (đổi symlink) không ảnh hưởng lúc nạp
+    snapshot_dir = os.path.realpath(snapshot_dir)
+    manifest_file = os.path.join(snapshot_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_file):
+        return None
+    try:
+        with open(manifest_file, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except Exception as e:
+        print(f"⚠️ Không đọc được snapshot {manifest_file}: {e}")
+        return None
+    if manifest.get("version") != SNAPSHOT_VERSION:
+        print(f"⚠️ Bỏ qua snapshot {snapshot_dir}: phiên bản {manifest.get('version')} không được hỗ trợ")
+        return None
+    return WarmState(snapshot_dir, manifest)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Snapshot trạng thái ấm của CineBot")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export_cmd = sub.add_parser("export", help="Ghi snapshot (model, chỉ mục, cache đã lưu trên đĩa)")
+    export_cmd.add_argument("--out", default=SNAPSHOT_DIR)
+    export_cmd.add_argument("--no-models", action="store_true", help="Không chép model vào snapshot")
+    show_cmd = sub.add_parser("show", help="In manifest của snapshot")
+    show_cmd.add_argument("--dir", default=SNAPSHOT_DIR)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_snapshot(args.out, reranker=get_reranker(), include_models=not args.no_models)
+    else:
+        state = load_snapshot(args.dir)
+        print(json.dumps(state.manifest, ensure_ascii=False, indent=2) if state else f"❌ Chưa có snapshot tại {args.dir}")
+
+
+if __name__ == "__main__":
+    main()
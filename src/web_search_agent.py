@@ -1,70 +1,131 @@
 from langchain.tools import Tool
-from langchain_tavily import TavilySearch
 import os
+import re
+import threading
 
-# Cấu hình API key
-TAVILY_API_KEY = os.getenv('TAVILY_API_KEY', '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')
+from cache_utils import RateLimiter, SingleFlight, TTLCache
+from search_providers import build_search_provider, normalize_query
 
-print(f"✅ API Key: {TAVILY_API_KEY[:8]}...")
+# Nguồn tìm kiếm được tạo khi cần (xem search_providers.build_search_provider)
+_search_provider = None
+_provider_lock = threading.Lock()
 
-# Tạo instance TavilySearch với tham số đúng
-try:
-    tavily_search = TavilySearch(
-        max_results=5,
-        tavily_api_key=TAVILY_API_KEY,
-        search_type="web",  # Chọn loại tìm kiếm là web
-        search_engine="google",  # Chọn công cụ tìm kiếm là Google
-        days=30  # Tìm kiếm trong 30 ngày gần đây
-    )
-    print("✅ TavilySearch instance đã được tạo thành công")
-except Exception as e:
-    print(f"❌ Lỗi khi tạo TavilySearch: {e}")
-    tavily_search = None
 
-# Hàm wrapper với xử lý lỗi tốt hơn
-def tavily_search_func(query: str) -> str:
-    if not tavily_search:
-        return "❌ TavilySearch chưa được khởi tạo đúng cách"
-    
-    try:
-        print(f"🔍 Đang tìm kiếm: {query}")
-        results = tavily_search.run(query)
-        print(f"📊 Loại kết quả: {type(results)}")
-        
-        if not results:
-            return "❌ Không tìm thấy kết quả nào."
+def get_search_provider():
+    global _search_provider
+    if _search_provider is None:
+        with _provider_lock:
+            if _search_provider is None:
+                _search_provider = build_search_provider()
+                print(f"✅ Search provider: {_search_provider.name}")
+    return _search_provider
 
-        # Xử lý kết quả trả về
-        if isinstance(results, str):
-            return f"📝 Kết quả tìm kiếm:\n{results}"
-        
-        elif isinstance(results, list):
-            output = []
-            for idx, item in enumerate(results, 1):
-                if isinstance(item, dict):
-                    title = item.get("title", "Không có tiêu đề")
-                    content = item.get("content", "Không có nội dung")
-                    url = item.get("url", "Không có URL")
-                    
-                    result_text = (
-                        f"📄 Kết quả {idx}:\n"
-                        f"Tiêu đề: {title}\n"
-                        f"Nội dung: {content[:200]}{'...' if len(content) > 200 else ''}\n"
-                        f"URL: {url}\n"
-                    )
-                else:
-                    result_text = f"📄 Kết quả {idx}:\n{str(item)}"
+
+def set_search_provider(provider):
+    """Thay nguồn tìm kiếm (ví dụ provider fixture khi test/load-test) và xóa cache cũ."""
+    global _search_provider
+    with _provider_lock:
+        _search_provider = provider
+    search_cache.clear()
+
+# Cache kết quả tìm kiếm: các câu hỏi gần giống nhau (ví dụ "ngày phát hành X Việt Nam")
+# lặp lại thường xuyên giữa các người dùng
+SEARCH_CACHE_TTL = int(os.getenv("CINEBOT_SEARCH_CACHE_TTL", str(6 * 3600)))
+SEARCH_MISS_TTL = 300  # Không có kết quả có thể chỉ là lỗi tạm thời của nguồn tìm kiếm: chỉ cache 5 phút
+SEARCH_RATE_PER_MINUTE = float(os.getenv("CINEBOT_SEARCH_RATE_PER_MINUTE", "30"))  # 0 = không giới hạn tốc độ
+SEARCH_BUDGET = int(os.getenv("CINEBOT_SEARCH_BUDGET", "0")) or None  # 0 = không giới hạn
+SNIPPET_CHARS = 200
+
+search_cache = TTLCache(SEARCH_CACHE_TTL, max_entries=5000, name="web_search")
+_search_flight = SingleFlight()
+search_rate_limiter = RateLimiter(SEARCH_RATE_PER_MINUTE, burst=5, budget=SEARCH_BUDGET)
+
+
+def _compact(text: str, limit: int = SNIPPET_CHARS) -> str:
+    """Rút gọn nội dung thành đoạn trích ngắn, cắt ở ranh giới câu/từ nếu có thể."""
+    text = re.sub(r'\s+', ' ', text or '').strip()
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    boundary = max(cut.rfind('. '), cut.rfind('! '), cut.rfind('? '))
+    if boundary > limit // 2:
+        return cut[:boundary + 1]
+    return cut.rsplit(' ', 1)[0] + '...'
+
+
+def _format_results(results) -> str:
+    """Định dạng kết quả Tavily (str, list hoặc dict có key 'results') thành văn bản gọn."""
+    if isinstance(results, dict):
+        results = results.get("results", results)
+
+    # Xử lý kết quả trả về
+    if isinstance(results, str):
+        return f"📝 Kết quả tìm kiếm:\n{_compact(results, SNIPPET_CHARS * 5)}"
+    
+    elif isinstance(results, list):
+        output = []
+        for idx, item in enumerate(results, 1):
+            if isinstance(item, dict):
+                title = item.get("title", "Không có tiêu đề")
+                content = item.get("content", "Không có nội dung")
+                url = item.get("url", "Không có URL")
                 
-                output.append(result_text)
+                result_text = (
+                    f"📄 Kết quả {idx}:\n"
+                    f"Tiêu đề: {title}\n"
+                    f"Nội dung: {_compact(content)}\n"
+                    f"URL: {url}\n"
+                )
+            else:
+                result_text = f"📄 Kết quả {idx}:\n{_compact(str(item))}"
             
-            return "\n" + "="*50 + "\n".join(output)
+            output.append(result_text)
         
-        else:
-            return f"📝 Kết quả: {str(results)}"
-            
+        return "\n" + "="*50 + "\n".join(output)
+    
+    else:
+        return f"📝 Kết quả: {_compact(str(results), SNIPPET_CHARS * 5)}"
+
+
+def _search_uncached(query: str):
+    """Gọi nguồn tìm kiếm; trả về (văn bản, thời hạn cache tính bằng giây hoặc None nếu không cache)."""
+    if not search_rate_limiter.acquire():
+        return "❌ Đã vượt giới hạn tìm kiếm web, vui lòng thử lại sau.", None
+
+    print(f"🔍 Đang tìm kiếm: {query}")
+    results = get_search_provider().search(query)
+    print(f"📊 Số kết quả: {len(results)}")
+    
+    if not results:
+        return "❌ Không tìm thấy kết quả nào.", SEARCH_MISS_TTL
+    return _format_results(results), SEARCH_CACHE_TTL
+
+
+# Hàm wrapper với xử lý lỗi tốt hơn
+def tavily_search_func(query: str) -> str:
+    key = normalize_query(query)
+    cached = search_cache.get(key)
+    if cached is not None:
+        print(f"⚡ Kết quả tìm kiếm lấy từ cache: {query}")
+        return cached
+
+    def _search():
+        text, ttl = _search_uncached(query)
+        if ttl:
+            search_cache.set(key, text, ttl=ttl)
+        return text
+
+    try:
+        # Các truy vấn giống nhau chạy đồng thời chỉ gọi Tavily một lần
+        return _search_flight.do(key, _search)
     except Exception as e:
         return f"❌ Lỗi khi tìm kiếm: {str(e)}\n📋 Loại lỗi: {type(e).__name__}"
 
+
+def get_web_search_stats():
+    """Thống kê cache và số lần gọi nguồn tìm kiếm."""
+    return {'cache': search_cache.stats(), 'calls': search_rate_limiter.stats()}
+
 # Định nghĩa Tool cho LangChain
 web_search_tool = Tool(
     name="TavilyWebSearch", 
@@ -1,19 +1,31 @@
 import gradio as gr
+import argparse
+import multiprocessing
 import sys
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 
 # Thêm thư mục src vào Python path
 current_dir = os.path.dirname(os.path.abspath(__file__))
 src_dir = os.path.join(os.path.dirname(current_dir), 'src')
 sys.path.append(src_dir)
-from chatbot_engine import ChatbotEngine
+from chatbot_engine import ChatbotEngine, REQUEST_TIMEOUT
+
+# Số lượt trả lời được xử lý đồng thời trong một tiến trình
+QUEUE_CONCURRENCY = int(os.getenv("CINEBOT_QUEUE_CONCURRENCY", "8"))
+QUEUE_MAX_SIZE = int(os.getenv("CINEBOT_QUEUE_MAX_SIZE", "64"))
 
 class ChatbotUI:
     """Giao diện người dùng cho chatbot"""
     
-    def __init__(self):
-        # Khởi tạo chatbot engine
+    def __init__(self, request_timeout=REQUEST_TIMEOUT, concurrency=QUEUE_CONCURRENCY):
+        # Khởi tạo chatbot engine (dùng chung; mỗi phiên Gradio có lịch sử riêng)
         self.engine = ChatbotEngine()
+        self.request_timeout = request_timeout
+        self.concurrency = concurrency
+        # Dư thêm thread cho các lượt đã quá hạn nhưng agent chưa kịp dừng
+        self._executor = ThreadPoolExecutor(max_workers=concurrency * 2, thread_name_prefix="cinebot-turn")
         
         # CSS tùy chỉnh
         self.css = """
@@ -37,8 +49,22 @@ class ChatbotUI:
             ["Tôi thích phim anime, có gợi ý gì không?"]
         ]
     
-    def _respond(self, message, chat_history=None, *args, **kwargs):
-        return self.engine.get_response(message)
+    def _respond(self, message, chat_history=None, clear_btn=None, request: gr.Request = None):
+        # Mỗi tab trình duyệt có session_hash riêng -> lịch sử trò chuyện riêng
+        session_id = request.session_hash if request else None
+        cancel_event = threading.Event()
+        future = self._executor.submit(self.engine.get_response, message, session_id, None, cancel_event)
+        try:
+            return future.result(timeout=self.request_timeout)
+        except TimeoutError:
+            # Thread vẫn đang chạy; báo agent dừng ở bước kế tiếp và không ghi lượt này vào lịch sử.
+            # Câu hỏi tiếp theo của phiên này chờ tới khi bước đang chạy (LLM/tool) kết thúc.
+            cancel_event.set()
+            return f"⏳ Xin lỗi, câu hỏi này mất quá {int(self.request_timeout)} giây để xử lý. Bạn thử hỏi lại hoặc hỏi cụ thể hơn nhé!"
+
+    def _end_session(self, request: gr.Request):
+        if request:
+            self.engine.end_session(request.session_hash)
 
     
     def create_interface(self):
@@ -79,10 +105,14 @@ class ChatbotUI:
                 gr.Button(value="🗑️ Xóa lịch sử", interactive=True, elem_id="clear_btn")
             ]
         )
+
+        # Giải phóng lịch sử của phiên khi người dùng đóng tab
+        if hasattr(demo, "unload"):
+            demo.unload(self._end_session)
         
         return demo
     
-    def launch(self, **kwargs):
+    def launch(self, max_queue_size=QUEUE_MAX_SIZE, **kwargs):
         """Khởi chạy giao diện"""
         print("🎬 Khởi động CineBot Movie Recommendation Chatbot...")
         
@@ -93,6 +123,9 @@ class ChatbotUI:
             print("✅ Chatbot đã sẵn sàng!")
             print("🌐 Đang mở web interface...")
             
+            # Hàng đợi cho phép nhiều lượt trả lời chạy song song thay vì xử lý lần lượt
+            demo.queue(default_concurrency_limit=self.concurrency, max_size=max_queue_size)
+
             # Launch với cấu hình tối ưu
             demo.launch(**kwargs)
             
@@ -100,16 +133,43 @@ class ChatbotUI:
             print(f"❌ Lỗi khởi động ứng dụng: {e}")
             raise
 
+def _run_worker(port, args):
+    ui = ChatbotUI(request_timeout=args.timeout, concurrency=args.concurrency)
+    ui.launch(max_queue_size=args.queue_size, server_name=args.host, server_port=port)
+
+
 def main():
     """Chạy ứng dụng"""
+    parser = argparse.ArgumentParser(description="CineBot Gradio UI")
+    parser.add_argument("--host", default=os.getenv("CINEBOT_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("CINEBOT_PORT", "7860")))
+    parser.add_argument("--concurrency", type=int, default=QUEUE_CONCURRENCY, help="Số lượt trả lời chạy song song mỗi tiến trình")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_MAX_SIZE, help="Số request tối đa trong hàng đợi")
+    parser.add_argument("--timeout", type=float, default=REQUEST_TIMEOUT, help="Thời gian tối đa (giây) cho một lượt trả lời")
+    parser.add_argument("--workers", type=int, default=1, help="Số tiến trình worker (cổng liên tiếp từ --port)")
+    args = parser.parse_args()
+
     try:
-        # Tạo UI và khởi chạy
-        ui = ChatbotUI()
-        ui.launch()
+        if args.workers <= 1:
+            _run_worker(args.port, args)
+            return
+
+        # Lịch sử trò chuyện và hàng đợi Gradio nằm trong từng tiến trình, nên mỗi worker
+        # nghe một cổng riêng; đặt một load balancer sticky (theo IP/cookie) phía trước
+        # để gom về một cổng công khai. Các worker cùng đọc một thư mục vector_db.
+        ctx = multiprocessing.get_context("spawn")
+        ports = [args.port + i for i in range(args.workers)]
+        workers = [ctx.Process(target=_run_worker, args=(port, args), daemon=False) for port in ports]
+        for worker in workers:
+            worker.start()
+        print("🧩 Workers: " + ", ".join(f"{args.host}:{port}" for port in ports))
+        print("💡 Ví dụ nginx: upstream cinebot { ip_hash; " + " ".join(f"server {args.host}:{port};" for port in ports) + " }")
+        for worker in workers:
+            worker.join()
         
     except Exception as e:
         print(f"❌ Lỗi khởi động: {e}")
         raise
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()